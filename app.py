@@ -1,11 +1,21 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, request, jsonify
 from src.agent.agent_setup import create_agent
+from src.db import catalog
+from src.tools.clients import pool_stats
+from src.utils import cancellation, document_store, tracing, workspace
 import os
 from dotenv import load_dotenv
 import logging
 
+# Multipart file parts are streamed straight into the document store, hashed on the way
+class DocumentRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return document_store.HashingWriter()
+
 # Initialize Flask app
 app = Flask(__name__)
+app.request_class = DocumentRequest
+app.config["MAX_CONTENT_LENGTH"] = document_store.MAX_UPLOAD_BYTES
 
 # Load environment variables from .env file
 load_dotenv()
@@ -54,22 +64,106 @@ def handle_chat():
     agent_input_dict = {"input": user_input}
     agent_config = {"configurable": {"session_id": session_id}}
 
+    # Opt-in tracing (and profiling) of this request alone, e.g. `X-Trace: 1` or `X-Trace: cprofile`
+    trace_enabled, profile = tracing.parse_header(request.headers.get(tracing.TRACE_HEADER))
+
+    # The run stops at the request's deadline (CHAT_DEADLINE_SECONDS, or a shorter 'timeout'
+    # in seconds from the client) or as soon as the client hangs up
+    token = cancellation.request_token(data.get('timeout'))
+    progress = cancellation.CancelCallbackHandler()
+
     # Invoke the agent with the input data and session ID
     try:
         logging.info(f"Invoking agent for session_id: {session_id}...")
-        response = agent_executor.invoke(agent_input_dict, config=agent_config)
+        with tracing.trace("chat", profile, enabled=trace_enabled, session_id=session_id) as trace, \
+                workspace.run(session_id), cancellation.scope(token), \
+                cancellation.watch_socket(request.environ.get("werkzeug.socket"), token):
+            agent_config["callbacks"] = tracing.callbacks() + [progress]
+            response = agent_executor.invoke(agent_input_dict, config=agent_config)
         logging.info(f"Agent invocation complete for session_id: {session_id}.")
 
         output_data = {
             "session_id": session_id,
             "output": response.get('output', "Agent executed but produced no standard output.") 
         }
-        return jsonify(output_data), 200
+        return jsonify(output_data), 200, {"X-Trace-Id": trace.trace_id} if trace else {}
+
+    except cancellation.DeadlineExceeded:
+        logging.warning(f"Agent run for session {session_id} reached its deadline.")
+        return jsonify({
+            "error": "The request reached its deadline before the agent finished.",
+            "session_id": session_id,
+            "partial_output": progress.last_output,
+        }), 504
+
+    except cancellation.Cancelled as e:
+        logging.info(f"Agent run for session {session_id} cancelled: {e}")
+        return jsonify({"error": f"Request cancelled: {e}"}), 499
 
     except Exception as e:
         logging.exception(f"ERROR during agent execution for session {session_id}: {e}") 
         return jsonify({"error": "An internal error occurred processing the request."}), 500
 
+# API endpoint to search extracted activities without invoking the agent
+@app.route('/activities/search', methods=['GET'])
+def search_activities():
+    """Full-text search over catalogued activities, e.g. /activities/search?q=magnets&page_from=10&page_to=40"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Missing required query parameter: 'q'"}), 400
+
+    try:
+        page_from = request.args.get('page_from', type=int)
+        page_to = request.args.get('page_to', type=int)
+        textbook_id = request.args.get('textbook_id', type=int)
+        grade = request.args.get('grade', type=int)
+        limit = max(1, min(request.args.get('limit', default=20, type=int), 100))
+
+        with catalog.session() as conn:
+            results = catalog.search_activities(
+                conn, query, page_from=page_from, page_to=page_to,
+                textbook_id=textbook_id, grade=grade, limit=limit,
+            )
+        return jsonify({"query": query, "count": len(results), "results": results}), 200
+
+    except Exception as e:
+        logging.exception(f"ERROR during activity search for '{query}': {e}")
+        return jsonify({"error": "An internal error occurred processing the request."}), 500
+
+# API endpoint to upload a PDF; identical uploads are stored once
+@app.route('/documents', methods=['POST'])
+def upload_document():
+    """
+    Store a PDF sent as multipart form field 'file' or as a raw application/pdf body.
+    Returns its content hash and the server-side path to pass to the agent's tools.
+    """
+    try:
+        if request.mimetype == 'application/pdf':
+            file_name = request.args.get('file_name')
+            writer = document_store.store_stream(request.stream)
+        else:
+            upload = request.files.get('file')
+            if upload is None or not upload.filename:
+                return jsonify({"error": "Missing required file field: 'file'"}), 400
+            file_name = upload.filename
+            writer = upload.stream
+
+        document = document_store.store_document(writer, file_name=file_name)
+        logging.info(f"Stored document {document['sha256']} ({document['size']} bytes, duplicate={document['duplicate']})")
+        return jsonify(document), 200 if document["duplicate"] else 201
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.exception(f"ERROR during document upload: {e}")
+        return jsonify({"error": "An internal error occurred processing the request."}), 500
+
+# Connection reuse of the shared OpenAI and Mistral connection pools
+@app.route('/stats/http', methods=['GET'])
+def http_stats():
+    """Requests, connections opened, TLS handshakes and reuse rate per provider since startup."""
+    return jsonify(pool_stats()), 200
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)  # Run the Flask app
     
\ No newline at end of file
@@ -0,0 +1,210 @@
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from src.agent.agent_setup import create_agent
+from src.db import catalog
+from src.tools.clients import pool_stats
+from src.utils import cancellation, document_store, tracing, workspace
+from src.utils.session_locks import SessionLocks
+import asyncio
+import os
+from dotenv import load_dotenv
+import logging
+
+# Async serving mode: the same API as app.py on an ASGI server, e.g.
+#   uvicorn asgi_app:app --host 0.0.0.0 --port 5000 --workers 2
+# Every request awaits the agent instead of holding a thread, so one worker
+# serves many concurrent sessions; turns of one session are serialized.
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO)
+
+# Agent executor setup
+agent_executor = None
+session_locks = SessionLocks()
+
+try:
+    openai_api_key = os.getenv("OPENAI_API_KEY")
+    if not openai_api_key:
+        logging.error("OPENAI_API_KEY not found in environment variables.")
+
+    else:
+        logging.info("Creating async agent executor...")
+        agent_executor = create_agent(openai_api_key, verbose=True, async_mode=True)
+        logging.info("Agent executor created successfully.")
+except Exception as e:
+    logging.error(f"Error creating agent executor: {e}")
+    raise
+
+async def cancel_on_disconnect(request: Request, token: cancellation.CancelToken):
+    """Cancel `token` once the client of `request` hangs up."""
+    while not await request.is_disconnected():
+        await asyncio.sleep(cancellation.DISCONNECT_POLL_SECONDS)
+    token.cancel("client disconnected")
+
+#  API endpoint to handle requests
+async def handle_chat(request: Request):
+    """Handles incoming chat requests."""
+    if agent_executor is None:
+        logging.error("Chat request received but agent is not initialized.")
+        return JSONResponse({"error": "Agent service is currently unavailable."}, status_code=503)
+
+    # get JSON payload from request
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data or not isinstance(data, dict):
+        return JSONResponse({"error": "Invalid JSON payload"}, status_code=400)
+
+    user_input = data.get('input')
+    session_id = data.get('session_id')
+
+    if not user_input or not session_id:
+        missing = []
+        if not user_input: missing.append("'input'")
+        if not session_id: missing.append("'session_id'")
+        return JSONResponse({"error": f"Missing required fields: {', '.join(missing)}"}, status_code=400)
+
+    logging.info(f"Received request for session_id: {session_id}")
+
+    agent_input_dict = {"input": user_input}
+    agent_config = {"configurable": {"session_id": session_id}}
+
+    # Opt-in tracing of this request alone, e.g. `X-Trace: 1`. A cProfile here would see the
+    # whole event loop, so `X-Trace: sample` (the threads this request ran on) is more useful
+    trace_enabled, profile = tracing.parse_header(request.headers.get(tracing.TRACE_HEADER))
+
+    # The run stops at the request's deadline (CHAT_DEADLINE_SECONDS, or a shorter 'timeout'
+    # in seconds from the client) or as soon as the client hangs up, aborting its pending
+    # LLM calls; tools running in worker threads stop at their next cancellation check
+    token = cancellation.request_token(data.get('timeout'))
+    progress = cancellation.CancelCallbackHandler()
+    watcher = asyncio.create_task(cancel_on_disconnect(request, token))
+
+    # Turns of one session wait for each other, so each reads the history the previous one wrote
+    try:
+        async with session_locks.hold(session_id):
+            logging.info(f"Invoking agent for session_id: {session_id}...")
+            with tracing.trace("chat", profile, enabled=trace_enabled, session_id=session_id) as trace, \
+                    workspace.run(session_id), cancellation.scope(token):
+                agent_config["callbacks"] = tracing.callbacks() + [progress]
+                response = await cancellation.guard(agent_executor.ainvoke(agent_input_dict, config=agent_config))
+            logging.info(f"Agent invocation complete for session_id: {session_id}.")
+
+        output_data = {
+            "session_id": session_id,
+            "output": response.get('output', "Agent executed but produced no standard output.")
+        }
+        return JSONResponse(output_data, status_code=200, headers={"X-Trace-Id": trace.trace_id} if trace else None)
+
+    except cancellation.DeadlineExceeded:
+        logging.warning(f"Agent run for session {session_id} reached its deadline.")
+        return JSONResponse({
+            "error": "The request reached its deadline before the agent finished.",
+            "session_id": session_id,
+            "partial_output": progress.last_output,
+        }, status_code=504)
+
+    except cancellation.Cancelled as e:
+        logging.info(f"Agent run for session {session_id} cancelled: {e}")
+        return JSONResponse({"error": f"Request cancelled: {e}"}, status_code=499)
+
+    except Exception as e:
+        logging.exception(f"ERROR during agent execution for session {session_id}: {e}")
+        return JSONResponse({"error": "An internal error occurred processing the request."}, status_code=500)
+
+    finally:
+        watcher.cancel()
+
+# API endpoint to search extracted activities without invoking the agent
+async def search_activities(request: Request):
+    """Full-text search over catalogued activities, e.g. /activities/search?q=magnets&page_from=10&page_to=40"""
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return JSONResponse({"error": "Missing required query parameter: 'q'"}, status_code=400)
+
+    def int_param(name, default=None):
+        value = request.query_params.get(name)
+        try:
+            return int(value) if value is not None else default
+        except ValueError:
+            return default
+
+    def search():
+        with catalog.session() as conn:
+            return catalog.search_activities(
+                conn, query, page_from=int_param('page_from'), page_to=int_param('page_to'),
+                textbook_id=int_param('textbook_id'), grade=int_param('grade'),
+                limit=max(1, min(int_param('limit', 20), 100)),
+            )
+
+    try:
+        results = await run_in_threadpool(search)
+        return JSONResponse({"query": query, "count": len(results), "results": results}, status_code=200)
+    except Exception as e:
+        logging.exception(f"ERROR during activity search for '{query}': {e}")
+        return JSONResponse({"error": "An internal error occurred processing the request."}, status_code=500)
+
+# API endpoint to upload a PDF as a raw application/pdf body; identical uploads are stored once
+async def upload_document(request: Request):
+    """Store a PDF streamed as the request body. Multipart uploads are served by app.py."""
+    if request.headers.get('content-type', '').split(';')[0].strip() != 'application/pdf':
+        return JSONResponse({"error": "Send the PDF as an application/pdf request body."}, status_code=415)
+
+    too_large = JSONResponse(
+        {"error": f"The PDF is larger than the {document_store.MAX_UPLOAD_MB} MB upload limit."}, status_code=413
+    )
+    try:
+        if int(request.headers.get('content-length', 0)) > document_store.MAX_UPLOAD_BYTES:
+            return too_large
+    except ValueError:
+        return JSONResponse({"error": "Invalid Content-Length header."}, status_code=400)
+
+    writer = await run_in_threadpool(document_store.HashingWriter)
+    try:
+        # Count the bytes (chunked bodies have no Content-Length) and write them off the event
+        # loop, gathered into UPLOAD_CHUNK_SIZE pieces
+        size = 0
+        pending = bytearray()
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > document_store.MAX_UPLOAD_BYTES:
+                return too_large
+            pending += chunk
+            if len(pending) >= document_store.UPLOAD_CHUNK_SIZE:
+                await run_in_threadpool(writer.write, bytes(pending))
+                pending.clear()
+        if pending:
+            await run_in_threadpool(writer.write, bytes(pending))
+        document = await run_in_threadpool(
+            document_store.store_document, writer, request.query_params.get('file_name')
+        )
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        logging.exception(f"ERROR during document upload: {e}")
+        return JSONResponse({"error": "An internal error occurred processing the request."}, status_code=500)
+    finally:
+        await run_in_threadpool(writer.close)
+
+    logging.info(f"Stored document {document['sha256']} ({document['size']} bytes, duplicate={document['duplicate']})")
+    return JSONResponse(document, status_code=200 if document["duplicate"] else 201)
+
+# Connection reuse of the shared OpenAI and Mistral connection pools
+async def http_stats(request: Request):
+    """Requests, connections opened, TLS handshakes and reuse rate per provider since startup."""
+    return JSONResponse(pool_stats(), status_code=200)
+
+app = Starlette(routes=[
+    Route('/chat', handle_chat, methods=['POST']),
+    Route('/activities/search', search_activities, methods=['GET']),
+    Route('/documents', upload_document, methods=['POST']),
+    Route('/stats/http', http_stats, methods=['GET']),
+])
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run("asgi_app:app", host='0.0.0.0', port=5000, workers=int(os.getenv("ASGI_WORKERS", "1")))
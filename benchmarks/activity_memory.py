@@ -0,0 +1,74 @@
+"""
+Memory benchmark: bytes per activity for the plain dicts returned by
+`json.load` against the slotted Activity model and the columnar ActivityBatch.
+
+Usage:
+    python -m benchmarks.activity_memory [number_of_activities]
+"""
+import gc
+import json
+import random
+import sys
+import tracemalloc
+
+from src.models.activity import ActivityBatch, activities_from_json
+
+CONCEPTS = [f"Concept {i}: properties of matter and energy" for i in range(60)]
+MATERIALS = [f"material {i}" for i in range(150)]
+
+
+def synthetic_catalog(n: int, seed: int = 7) -> str:
+    """A JSON catalog shaped like the extractor output, with realistic repetition."""
+    rng = random.Random(seed)
+    activities = [
+        {
+            "activity": f"Activity {i // 10 + 1}.{i % 10 + 1}: Let us explore",
+            "concept": rng.choice(CONCEPTS),
+            "materials": rng.sample(MATERIALS, rng.randint(2, 6)),
+            "description": " ".join(rng.choice(["Take", "a", "magnet", "and", "bring", "it", "near", "the", "iron", "filings", "observe", "what", "happens"]) for _ in range(30)),
+            "page": [rng.randint(1, 300)],
+        }
+        for i in range(n)
+    ]
+    return json.dumps(activities)
+
+
+def measure(build) -> int:
+    """Bytes still allocated by `build()` once it returns its result."""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def as_dicts(text: str):
+    return json.loads(text)
+
+
+def as_activities(text: str):
+    activities, _ = activities_from_json(json.loads(text))
+    return activities
+
+
+def as_batch(text: str):
+    return ActivityBatch.from_activities(as_activities(text))
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    text = synthetic_catalog(n)
+
+    results = {
+        "dict (json.load)": measure(lambda: as_dicts(text)),
+        "Activity (__slots__)": measure(lambda: as_activities(text)),
+        "ActivityBatch (columnar)": measure(lambda: as_batch(text)),
+    }
+
+    baseline = results["dict (json.load)"]
+    print(f"{n} activities")
+    for name, total in results.items():
+        print(f"  {name:<26} {total / n:8.1f} bytes/activity  ({total / baseline:5.0%} of dict)")
@@ -0,0 +1,93 @@
+"""
+Chat history load latency against session length and table size.
+
+Fills a scratch copy of the history table with `sessions` interleaved sessions
+(as concurrent tenants would write them) plus a few probe sessions of growing
+length, then times `SQLChatMessageHistory.messages` - the read every agent
+turn makes - on the bare LangChain table and again after `chat_history.connect`
+has added the session index.
+
+Usage:
+    python -m benchmarks.chat_history_load [total_messages] [sessions]
+"""
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "unused-by-this-benchmark")
+
+from langchain_community.chat_message_histories import SQLChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage, message_to_dict
+from sqlalchemy import create_engine
+
+from src.db import chat_history
+
+PROBE_LENGTHS = (10, 100, 1000)
+REPEATS = 5
+
+
+def message_rows(session_id: str, count: int):
+    for i in range(count):
+        message = (HumanMessage if i % 2 == 0 else AIMessage)(
+            content=f"Turn {i}: which activities in chapter {i % 12 + 1} use magnets?"
+        )
+        yield session_id, json.dumps(message_to_dict(message))
+
+
+def fill(db_file: str, total_messages: int, sessions: int) -> None:
+    """Bare LangChain table: background sessions written round-robin, then the probes."""
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE TABLE message_store (id INTEGER NOT NULL, session_id TEXT, message TEXT, PRIMARY KEY (id))")
+    sample = json.dumps(message_to_dict(HumanMessage(content="Background tenant message " * 4)))
+    conn.executemany(
+        "INSERT INTO message_store (session_id, message) VALUES (?, ?)",
+        ((f"tenant-{i % sessions}", sample) for i in range(total_messages)),
+    )
+    for length in PROBE_LENGTHS:
+        conn.executemany("INSERT INTO message_store (session_id, message) VALUES (?, ?)",
+                         message_rows(f"probe-{length}", length))
+    conn.commit()
+    conn.close()
+
+
+def load_latency(engine, session_id: str) -> float:
+    """Median seconds to load one session's messages."""
+    timings = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        messages = SQLChatMessageHistory(session_id=session_id, connection=engine).messages
+        timings.append(time.perf_counter() - start)
+    assert messages, f"no messages loaded for {session_id}"
+    return statistics.median(timings)
+
+
+if __name__ == "__main__":
+    total_messages = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    sessions = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "chat_history.db")
+        start = time.perf_counter()
+        fill(db_file, total_messages, sessions)
+        print(f"{total_messages:,} background messages in {sessions:,} sessions "
+              f"({os.path.getsize(db_file) / 2**20:.0f} MB, filled in {time.perf_counter() - start:.1f}s)")
+
+        engine = create_engine(f"sqlite:///{db_file}")
+        unindexed = {length: load_latency(engine, f"probe-{length}") for length in PROBE_LENGTHS}
+        engine.dispose()
+
+        start = time.perf_counter()
+        chat_history.connect(db_file).close()
+        print(f"  index and activity table built in {time.perf_counter() - start:.2f}s")
+
+        engine = create_engine(f"sqlite:///{db_file}")
+        indexed = {length: load_latency(engine, f"probe-{length}") for length in PROBE_LENGTHS}
+        engine.dispose()
+
+    print(f"  {'session length':>14}  {'no index':>10}  {'indexed':>10}")
+    for length in PROBE_LENGTHS:
+        print(f"  {length:>14}  {unindexed[length] * 1000:>8.1f}ms  {indexed[length] * 1000:>8.1f}ms")
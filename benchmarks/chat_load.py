@@ -0,0 +1,341 @@
+"""
+Concurrent load test of the Flask `/chat` service against a local fake LLM.
+
+Serves app.py in-process and points the agent's OpenAI client at a stand-in
+OpenAI endpoint on 127.0.0.1, so nothing leaves the machine. Synthetic users
+then run sessions of several turns each - plain chat, activity searches (one
+tool call through the catalog) and history questions - with `concurrency`
+sessions in flight at once. Chat history, catalog and tool cache databases
+live in a scratch directory.
+
+Reports throughput, p50/p95/p99 latency and error rate (overall and per query
+type), the time chat-history writes spent in SQLite (writes slower than
+--lock-wait-ms are counted as lock waits) and "database is locked" errors,
+then checks them against the SLO flags and exits non-zero on a miss.
+
+Usage:
+    python -m benchmarks.chat_load [--sessions 40] [--concurrency 8] [--turns 3]
+        [--llm-latency-ms 150] [--mix chat=0.5,search=0.3,history=0.2]
+        [--slo-p95-ms 3000] [--slo-p99-ms 6000] [--slo-error-rate 0.01] [--slo-min-rps 0]
+    python -m benchmarks.chat_load --url http://host:5000/chat ...   # an already running service
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUERY_TYPES = ("chat", "search", "history")
+SEARCH_WORDS = ("magnets", "evaporation", "light", "plants", "sound", "acids", "friction", "circuits")
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of unsorted `values`; 0 for none."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """
+    OpenAI chat completions stand-in. Answers after the server's latency; for a
+    user turn starting with "search:" and tools on offer, it first calls
+    ActivitySearch (as a legacy function call or a tool call, whichever the
+    request uses) and answers once the result comes back.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        server = self.server
+        with server.lock:
+            server.calls += 1
+        time.sleep(max(0.0, random.gauss(server.latency, server.latency / 4)))
+
+        messages = body.get("messages", [])
+        last = messages[-1] if messages else {}
+        user_turn = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        message = {"role": "assistant", "content": None}
+        finish_reason = "stop"
+        if last.get("role") == "user" and user_turn.startswith("search:") and (body.get("functions") or body.get("tools")):
+            arguments = json.dumps({"__arg1": user_turn.removeprefix("search:").strip()})
+            if body.get("tools"):
+                message["tool_calls"] = [{"id": f"call_{server.calls}", "type": "function",
+                                          "function": {"name": "ActivitySearch", "arguments": arguments}}]
+                finish_reason = "tool_calls"
+            else:
+                message["function_call"] = {"name": "ActivitySearch", "arguments": arguments}
+                finish_reason = "function_call"
+        else:
+            message["content"] = f"Answer to: {user_turn[:80]}"
+
+        common = {"id": f"chatcmpl-{server.calls}", "created": int(time.time()), "model": body.get("model", "fake")}
+        if body.get("stream"):
+            # The agent streams: the whole message as one delta, then the finish reason
+            if "tool_calls" in message:
+                message["tool_calls"][0]["index"] = 0
+            chunks = [
+                {**common, "object": "chat.completion.chunk",
+                 "choices": [{"index": 0, "delta": message, "finish_reason": None}]},
+                {**common, "object": "chat.completion.chunk",
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]},
+            ]
+            payload = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks).encode() + b"data: [DONE]\n\n"
+            content_type = "text/event-stream"
+        else:
+            payload = json.dumps({
+                **common, "object": "chat.completion",
+                "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                "usage": {"prompt_tokens": sum(len(str(m.get("content") or "")) // 4 for m in messages),
+                          "completion_tokens": 20, "total_tokens": 0},
+            }).encode()
+            content_type = "application/json"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_fake_llm(latency_ms: float) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeLLMHandler)
+    server.daemon_threads = True
+    server.latency = latency_ms / 1000
+    server.calls = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class HistoryWriteMonitor:
+    """
+    Times every statement SQLAlchemy runs against the chat history tables. Under
+    contention SQLite writers mostly wait for the database lock, so the time a
+    history write takes is its lock wait plus a near-constant insert cost.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.writes = []
+        self.reads = []
+        self.locked_errors = 0
+
+    def install(self) -> None:
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        event.listen(Engine, "before_cursor_execute", self._before)
+        event.listen(Engine, "after_cursor_execute", self._after)
+        event.listen(Engine, "handle_error", self._error)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("load_test_started", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["load_test_started"].pop()
+        if "message_store" not in statement:
+            return
+        verb = statement.lstrip()[:6].upper()
+        with self._lock:
+            if verb == "SELECT":
+                self.reads.append(elapsed)
+            elif verb in ("INSERT", "UPDATE", "DELETE"):
+                self.writes.append(elapsed)
+
+    def _error(self, context):
+        started = context.connection.info.get("load_test_started") if context.connection is not None else None
+        if started:
+            started.pop()
+        if "database is locked" in str(context.original_exception):
+            with self._lock:
+                self.locked_errors += 1
+
+
+def start_app(tmp: str, llm_url: str) -> tuple:
+    """Serve app.py on a free local port with scratch databases; returns (server, /chat URL)."""
+    os.environ.update({
+        "OPENAI_API_KEY": "sk-load-test",
+        "OPENAI_BASE_URL": llm_url,
+        "OPENAI_API_BASE": llm_url,
+        "CHAT_HISTORY_DB_PATH": os.path.join(tmp, "chat_history.db"),
+        "CHAT_ARCHIVE_DB_PATH": os.path.join(tmp, "chat_history_archive.db"),
+        "CATALOG_DB_PATH": os.path.join(tmp, "catalog.db"),
+        "TOOL_CACHE_DB_PATH": os.path.join(tmp, "tool_cache.db"),
+        "WORKSPACE_DIR": os.path.join(tmp, "workspace"),
+    })
+    import logging
+    from werkzeug.serving import make_server
+
+    # Before app.py configures INFO logging of every request
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    import app as chat_app
+
+    server = make_server("127.0.0.1", 0, chat_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/chat"
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in QUERY_TYPES:
+            raise argparse.ArgumentTypeError(f"unknown query type {name!r}, expected one of {', '.join(QUERY_TYPES)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def query(kind: str, rng: random.Random, turn: int) -> str:
+    if kind == "search":
+        return f"search: {rng.choice(SEARCH_WORDS)} pages {rng.randint(1, 40)}-{rng.randint(41, 120)}"
+    if kind == "history":
+        return "Which files did you save for me earlier in this conversation?"
+    return f"Turn {turn}: what makes a good hands-on activity about {rng.choice(SEARCH_WORDS)}?"
+
+
+def run_session(client, url: str, session_number: int, args, results: list, lock: threading.Lock) -> None:
+    rng = random.Random(args.seed + session_number)
+    session_id = f"load-{args.seed}-{session_number}"
+    kinds, weights = zip(*args.mix.items())
+    for turn in range(args.turns):
+        kind = rng.choices(kinds, weights)[0]
+        start = time.perf_counter()
+        try:
+            response = client.post(url, json={"input": query(kind, rng, turn), "session_id": session_id})
+            error = None if response.status_code == 200 else f"HTTP {response.status_code}"
+        except Exception as e:
+            error = type(e).__name__
+        with lock:
+            results.append((kind, time.perf_counter() - start, error))
+        if args.think_ms:
+            time.sleep(rng.uniform(0, 2 * args.think_ms) / 1000)
+
+
+def summarize(name: str, results: list) -> str:
+    latencies = [elapsed * 1000 for _, elapsed, _ in results]
+    errors = sum(1 for *_, error in results if error)
+    return (f"  {name:<8} {len(results):6d} req  p50 {percentile(latencies, 50):7.0f} ms  "
+            f"p95 {percentile(latencies, 95):7.0f} ms  p99 {percentile(latencies, 99):7.0f} ms  "
+            f"errors {errors / len(results) if results else 0:6.2%}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the /chat endpoint with synthetic sessions.")
+    parser.add_argument("--url", help="/chat URL of a running service (default: serve app.py locally against a fake LLM)")
+    parser.add_argument("--sessions", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8, help="sessions in flight at once")
+    parser.add_argument("--turns", type=int, default=3, help="turns per session, sent one after the other")
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between a session's turns")
+    parser.add_argument("--llm-latency-ms", type=float, default=150, help="mean latency of the fake LLM")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("chat=0.5,search=0.3,history=0.2"))
+    parser.add_argument("--timeout", type=float, default=120, help="per-request timeout in seconds")
+    parser.add_argument("--lock-wait-ms", type=float, default=10, help="history writes slower than this count as lock waits")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--slo-p95-ms", type=float, default=3000)
+    parser.add_argument("--slo-p99-ms", type=float, default=6000)
+    parser.add_argument("--slo-error-rate", type=float, default=0.01)
+    parser.add_argument("--slo-min-rps", type=float, default=0)
+    parser.add_argument("--slo-max-lock-wait-ms", type=float, default=0, help="max p99 history write time (0: no SLO)")
+    parser.add_argument("--verbose", action="store_true", help="keep the agent's output")
+    args = parser.parse_args(argv)
+
+    import httpx
+
+    stdout = sys.stdout
+    if not args.verbose:
+        # The agent is created verbose and prints every step
+        sys.stdout = open(os.devnull, "w")
+    tmp = tempfile.TemporaryDirectory()
+    llm = monitor = server = None
+    url = args.url
+    if url is None:
+        llm = start_fake_llm(args.llm_latency_ms)
+        monitor = HistoryWriteMonitor()
+        monitor.install()
+        server, url = start_app(tmp.name, f"http://127.0.0.1:{llm.server_port}/v1")
+
+    results = []
+    lock = threading.Lock()
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    start = time.perf_counter()
+    try:
+        with httpx.Client(timeout=args.timeout, limits=limits) as client, \
+                ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            for future in [pool.submit(run_session, client, url, n, args, results, lock) for n in range(args.sessions)]:
+                future.result()
+    finally:
+        wall = time.perf_counter() - start
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+        if server is not None:
+            server.shutdown()
+            llm.shutdown()
+
+    latencies = [elapsed * 1000 for _, elapsed, _ in results]
+    errors = sum(1 for *_, error in results if error)
+    error_rate = errors / len(results) if results else 1.0
+    rps = len(results) / wall if wall else 0.0
+    print(f"{args.sessions} sessions x {args.turns} turns, {args.concurrency} concurrent, "
+          f"{'fake LLM ' + format(args.llm_latency_ms, '.0f') + ' ms' if llm else url}")
+    print(f"  throughput {rps:.1f} req/s over {wall:.1f}s")
+    print(summarize("all", results))
+    for kind in args.mix:
+        print(summarize(kind, [result for result in results if result[0] == kind]))
+    error_kinds = defaultdict(int)
+    for *_, error in results:
+        if error:
+            error_kinds[error] += 1
+    if error_kinds:
+        print("  errors: " + ", ".join(f"{error} x{count}" for error, count in sorted(error_kinds.items())))
+
+    write_p99 = None
+    if monitor is not None:
+        writes = [elapsed * 1000 for elapsed in monitor.writes]
+        reads = [elapsed * 1000 for elapsed in monitor.reads]
+        waits = [elapsed for elapsed in writes if elapsed > args.lock_wait_ms]
+        write_p99 = percentile(writes, 99)
+        print(f"  history writes {len(writes)}: p50 {percentile(writes, 50):.1f} ms  p99 {write_p99:.1f} ms  "
+              f"max {max(writes, default=0):.1f} ms; reads {len(reads)}: p99 {percentile(reads, 99):.1f} ms")
+        print(f"  lock waits (> {args.lock_wait_ms:.0f} ms) {len(waits)}, {sum(waits):.0f} ms in total; "
+              f"'database is locked' errors {monitor.locked_errors}")
+        print(f"  fake LLM calls {llm.calls}")
+        from src.tools.clients import pool_stats
+        openai_pool = pool_stats()["openai"]
+        print(f"  OpenAI pool: {openai_pool['requests']} requests over {openai_pool['connections_opened']} connections "
+              f"(max {openai_pool['max_connections']}), reuse rate {openai_pool['reuse_rate'] or 0:.0%}")
+
+    checks = [
+        ("p95", percentile(latencies, 95), args.slo_p95_ms, "ms", False),
+        ("p99", percentile(latencies, 99), args.slo_p99_ms, "ms", False),
+        ("error rate", error_rate, args.slo_error_rate, "", False),
+    ]
+    if args.slo_min_rps:
+        checks.append(("throughput", rps, args.slo_min_rps, "req/s", True))
+    if args.slo_max_lock_wait_ms and write_p99 is not None:
+        checks.append(("history write p99", write_p99, args.slo_max_lock_wait_ms, "ms", False))
+    passed = True
+    for name, value, limit, unit, at_least in checks:
+        ok = value >= limit if at_least else value <= limit
+        passed &= ok
+        shown = f"{value:.2%} vs {limit:.2%}" if name == "error rate" else f"{value:.1f} vs {limit:g} {unit}"
+        print(f"  {'PASS' if ok else 'FAIL'} {name} {shown} ({'min' if at_least else 'max'})")
+    print("SLO " + ("PASS" if passed else "FAIL"))
+    tmp.cleanup()
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""
+Sharded OCR against a local stand-in for the Mistral files/OCR endpoints.
+
+Builds a synthetic scanned-style PDF whose pages carry their own page number,
+runs it through one whole-document OCR call and through `extract_text_sharded`
+(with some shards failing on their first attempt), checks that every page comes
+back under its global page number, and compares wall time.
+
+Usage:
+    python -m benchmarks.sharded_ocr [pages] [seconds_per_page]
+"""
+import os
+import sys
+import threading
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "unused-by-this-benchmark")
+os.environ.setdefault("MISTRAL_API_KEY", "unused-by-this-benchmark")
+
+import fitz  # PyMuPDF
+from src.tools.sharded_ocr import extract_text_sharded
+
+
+class _Obj:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeMistral:
+    """
+    Stand-in for `mistral_client.files` and `mistral_client.ocr`: uploads are
+    kept in memory, OCR takes `seconds_per_page` per page and returns the
+    text printed on each page, and the first OCR attempt of every
+    `fail_every`-th upload raises.
+    """
+
+    def __init__(self, seconds_per_page: float = 0.01, fail_every: int = 3):
+        self.seconds_per_page = seconds_per_page
+        self.fail_every = fail_every
+        self.uploads = {}
+        self.calls = {"upload": 0, "ocr": 0, "failures": 0}
+        self._lock = threading.Lock()
+        self._failed_once = set()
+        self.files = _Obj(upload=self._upload, get_signed_url=self._get_signed_url)
+        self.ocr = _Obj(process=self._process)
+
+    def _upload(self, file, purpose, timeout_ms=None):
+        content = file["content"]
+        data = content if isinstance(content, bytes) else content.read()
+        with self._lock:
+            self.calls["upload"] += 1
+            file_id = f"file-{self.calls['upload']}"
+            self.uploads[file_id] = data
+        return _Obj(id=file_id)
+
+    def _get_signed_url(self, file_id, expiry=24, timeout_ms=None):
+        return _Obj(url=f"local://{file_id}")
+
+    def _process(self, model, document, timeout_ms=None):
+        file_id = document["document_url"].removeprefix("local://")
+        with self._lock:
+            self.calls["ocr"] += 1
+            number = int(file_id.split("-")[1])
+            if number % self.fail_every == 0 and file_id not in self._failed_once:
+                self._failed_once.add(file_id)
+                self.calls["failures"] += 1
+                raise ConnectionError(f"simulated OCR failure for {file_id}")
+            # PyMuPDF is not thread-safe, so reading the upload is serialized
+            doc = fitz.open(stream=self.uploads[file_id], filetype="pdf")
+            texts = [page.get_text("text").strip() for page in doc]
+            doc.close()
+        time.sleep(self.seconds_per_page * len(texts))
+        return _Obj(pages=[_Obj(index=i, markdown=text) for i, text in enumerate(texts)])
+
+
+def synthetic_pdf(path: str, pages: int) -> None:
+    doc = fitz.open()
+    for number in range(1, pages + 1):
+        doc.new_page().insert_text((72, 72), f"Scanned page {number}")
+    doc.save(path)
+    doc.close()
+
+
+def whole_document(client, pdf_path: str) -> dict:
+    with open(pdf_path, "rb") as f:
+        uploaded = client.files.upload(file={"file_name": "book.pdf", "content": f.read()}, purpose="ocr")
+    url = client.files.get_signed_url(file_id=uploaded.id).url
+    response = client.ocr.process(model="mistral-ocr-latest", document={"type": "document_url", "document_url": url})
+    return {page.index + 1: page.markdown for page in response.pages}
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    page_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    seconds_per_page = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, "book.pdf")
+        synthetic_pdf(pdf_path, page_count)
+
+        client = FakeMistral(seconds_per_page, fail_every=10**9)
+        start = time.perf_counter()
+        single = whole_document(client, pdf_path)
+        single_time = time.perf_counter() - start
+
+        client = FakeMistral(seconds_per_page, fail_every=10**9)
+        start = time.perf_counter()
+        sharded = extract_text_sharded(pdf_path, client=client, shard_pages=20, max_workers=4)
+        sharded_time = time.perf_counter() - start
+        shard_calls = client.calls["ocr"]
+
+        client = FakeMistral(seconds_per_page, fail_every=3)
+        start = time.perf_counter()
+        retried = extract_text_sharded(pdf_path, client=client, shard_pages=20, max_workers=4)
+        retried_time = time.perf_counter() - start
+
+    expected = {number: f"Scanned page {number}" for number in range(1, page_count + 1)}
+    assert single == expected, "whole-document OCR returned unexpected pages"
+    assert sharded == expected, "sharded OCR did not renumber pages back to global page numbers"
+    assert retried == expected, "sharded OCR lost pages of shards that failed once"
+
+    print(f"{page_count} pages, {seconds_per_page * 1000:.0f} ms/page simulated OCR")
+    print(f"  whole document: {single_time:6.2f}s (1 upload, 1 OCR call)")
+    print(f"  sharded:        {sharded_time:6.2f}s ({shard_calls} shards, {single_time / sharded_time:.1f}x faster)")
+    print(f"  with failures:  {retried_time:6.2f}s ({client.calls['ocr']} OCR calls, "
+          f"{client.calls['failures']} shard failures retried with backoff)")
+    print("  page numbering: OK")
@@ -1,13 +1,17 @@
+import argparse
 import sys
 from src.agent.agent_setup import create_agent
 from src.config import load_api_key
+from src.utils import tracing, workspace
 import uuid
 
 def run_agent_query(agent_executor, query: str):
     """Runs a query through the agent executor and prints the result."""
     print(f"\n> You: {query}")
+    session_id = str(uuid.uuid4())
     try:
-        response = agent_executor.invoke({"input": query}, config={"configurable": {"session_id": str(uuid.uuid4())}})
+        with workspace.run(session_id):
+            response = agent_executor.invoke({"input": query}, config={"configurable": {"session_id": session_id}})
         print(f"< Agent: {response['output']}")
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -24,6 +28,22 @@ def session_id_generator():
     return session_id
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chat with the activity agent.")
+    parser.add_argument(
+        "--trace", nargs="?", const="spans", choices=["spans", *tracing.PROFILE_MODES],
+        help=f"Write a trace of every turn to {tracing.TRACE_DIR}, optionally with a cProfile or sampling profile.",
+    )
+    parser.add_argument(
+        "--estimate", nargs="+", metavar=("PDF", "USER_JSON"),
+        help="Print the expected calls, cost and time of processing a PDF (and the full pipeline with a User JSON) and exit.",
+    )
+    args = parser.parse_args()
+    if args.estimate:
+        from src.tools.cost_estimator import estimate, format_estimate
+        print(format_estimate(estimate(*args.estimate[:2])))
+        sys.exit(0)
+    trace_enabled, profile = tracing.parse_header(args.trace)
+
     print("Loading configuration and initializing agent...")
     try:
         # Load the API key and create the agent
@@ -54,10 +74,12 @@ if __name__ == "__main__":
             print("< Agent is thinking...")
 
             try:
-                response = agent_executor.invoke(
-                    {"input": user_query},
-                    config={'configurable': {'session_id': session_id}},
-                    )
+                with tracing.trace("chat", profile, enabled=trace_enabled, session_id=session_id), \
+                        workspace.run(session_id):
+                    response = agent_executor.invoke(
+                        {"input": user_query},
+                        config={'configurable': {'session_id': session_id}, 'callbacks': tracing.callbacks()},
+                        )
                 print(f"< Agent: {response['output']}")
             except Exception as e:
                 print(f"An error occurred during agent execution: {e}")
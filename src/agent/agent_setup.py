@@ -1,35 +1,54 @@
 from langchain_openai import ChatOpenAI
 from langchain.agents import Tool, AgentExecutor, create_openai_functions_agent
-from src.tools.activity_extractor_tool import extract_activities_from_pdf
-from src.tools.activity_match_tool import activity_match_wrapper
-from src.tools.activity_filter_tool import activity_filter_wrapper
-from src.tools.activity_generator_tool import generate_activities
+from src.tools.activity_extractor_tool import extract_activities_from_pdf, aextract_activities_from_pdf, EXTRACTOR_VERSION
+from src.tools.activity_match_tool import activity_match_wrapper, aactivity_match_wrapper, MATCHER_VERSION
+from src.tools.activity_filter_tool import activity_filter_wrapper, FILTER_VERSION
+from src.tools.activity_generator_tool import generate_activities, agenerate_activities, GENERATOR_VERSION
+from src.tools.activity_pipeline import stream_pipeline_wrapper, PIPELINE_VERSION
+from src.tools.activity_search_tool import search_activities_tool
+from src.tools.cost_estimator import cost_estimator_tool
+from src.db.tool_cache import memoize
+from src.db import chat_history
+from src.config import model_route
+from src.tools.clients import openai_http_client, async_openai_http_client
 from langchain_core.prompts import MessagesPlaceholder, ChatPromptTemplate
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_community.chat_message_histories import SQLChatMessageHistory
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from pathlib import Path
 
 # Database for the agent executor
-DB_DIR = Path(__file__).resolve().parent.parent / "db"
-DB_DIR.mkdir(parents=True, exist_ok=True)
-DB_FILE = DB_DIR / "chat_history.db"
+DB_FILE = chat_history.CHAT_HISTORY_DB_FILE
 CONNECTION_STRING = f"sqlite:///{DB_FILE.resolve()}"
+ASYNC_CONNECTION_STRING = f"sqlite+aiosqlite:///{DB_FILE.resolve()}"
 print("Using SQLite database for chat history:", CONNECTION_STRING)
 
+# The extractor tool's function; background prefetching (streamlit_app.py) calls the same one,
+# so the agent's call joins or reuses a prefetch of the same PDF
+extract_activities_tool = memoize("TextbookActivityExtractor", EXTRACTOR_VERSION)(extract_activities_from_pdf)
+
 # Create the agent executor with memory for handling multiple sessions
-def create_agent(openai_api_key: str, verbose: bool = True) -> AgentExecutor:
+def create_agent(openai_api_key: str, verbose: bool = True, async_mode: bool = False) -> AgentExecutor:
     """
     Initializes the LLM, the specific PDF Activity Extractor Tool, and the Agent Executor.
+    With async_mode, chat history is read and written through an async engine,
+    as needed by `ainvoke` (see asgi_app.py).
     """
 
-    print("Initializing LLM (using gpt-4o)...")
+    route = model_route("agent")
+    print(f"Initializing LLM (using {route.model})...")
     try:
         llm = ChatOpenAI(
             temperature=0,
             openai_api_key=openai_api_key,
-            model_name="gpt-4o", 
+            model_name=route.model,
+            max_tokens=route.max_tokens,
+            timeout=route.timeout,
+            # The connection pools the tools use, so agent turns reuse their warm connections
+            http_client=openai_http_client,
+            http_async_client=async_openai_http_client,
         )
     except Exception as e:
         print(f"ERROR: Failed to initialize ChatOpenAI LLM: {e}")
@@ -39,35 +58,59 @@ def create_agent(openai_api_key: str, verbose: bool = True) -> AgentExecutor:
     tools = [
         Tool(
             name="TextbookActivityExtractor",
-            func=extract_activities_from_pdf,
+            func=extract_activities_tool,
+            coroutine=memoize("TextbookActivityExtractor", EXTRACTOR_VERSION)(aextract_activities_from_pdf),
             description=(
                "Use this tool ONLY when specifically asked to find, extract, or list classroom activities, experiments, 'let's do', 'let's explore', or similar hands-on sections from a specific PDF textbook file provided via its LOCAL FILE PATH. "
                 "Input MUST be the exact file path (relative or absolute) to the source PDF textbook on the local system (e.g., 'path/to/textbook.pdf' or 'C:/docs/science_book.pdf'). The file MUST exist at the given path. "
                 "The tool analyzes the PDF content, identifies activities, structures their details (name, concept, materials, description, page number), and saves them to a JSON file. "
                 "The tool automatically attempts to process the PDF text directly. If it internally detects that the PDF likely requires Optical Character Recognition (OCR) (e.g., it seems image-based or lacks extractable text), it will automatically ATTEMPT to use an OCR service (Mistral AI) by generating a temporary internal URL. This automatic OCR step requires specific setup and may not always succeed. The user does NOT need to specify whether to use OCR. "
-                "The tool returns a string message indicating success (including the full path to the output JSON file, typically saved in the same directory as the input PDF with '_activities.json' appended) or an error message upon failure. "
+                "The tool returns a string message indicating success (including the full path to the output JSON file, saved in this run's workspace directory with '_activities.json' appended to the PDF's name) or an error message upon failure. "
                 "Do NOT use this for processing web URLs directly, general Q&A, simple text summarization, checking inventory, order status, or processing non-PDF files."
             )
         ),
         Tool(
             name="ActivityMatcher", 
-            func=activity_match_wrapper,
+            func=memoize("ActivityMatcher", MATCHER_VERSION)(activity_match_wrapper),
+            coroutine=memoize("ActivityMatcher", MATCHER_VERSION)(aactivity_match_wrapper),
             description=( 
-                "Use ONLY to compare activities between TWO JSON files: a 'Master JSON' file (usually the output from TextbookActivityExtractor) and a 'User JSON' file. Finds activities from the Master JSON that match those in the User JSON and saves ONLY these MATCHING activities to a NEW file (e.g., 'master_activities_matching.json'). IMPORTANT: Returns a success message including the full file path to the new 'matching' JSON file. Input MUST clearly provide BOTH file paths (e.g., '/path/master.json, /path/user.json')."
+                "Use ONLY to compare activities between TWO JSON files: a 'Master JSON' file (usually the output from TextbookActivityExtractor) and a 'User JSON' file. Finds activities from the Master JSON that match those in the User JSON and saves ONLY these MATCHING activities to a NEW file (e.g., 'master_activities_matching.json'). IMPORTANT: Returns a success message including the full file path to the new 'matching' JSON file. Input MUST clearly provide BOTH JSON files, as file paths or artifact ids of earlier tool outputs (e.g., 'art-1a2b3c4d, /path/user.json')."
             )
         ),
         Tool(
             name="ActivityFilter",
-            func=activity_filter_wrapper, 
+            func=memoize("ActivityFilter", FILTER_VERSION)(activity_filter_wrapper), 
             description=(
-                "Use ONLY to find activities in a 'Master JSON' that are NOT present in a 'Matching JSON' (the output file from ActivityMatcher). Saves these NON-MATCHING (unique to master) activities to a NEW file. Returns a message including the full path to the new 'filtered' JSON file. Input MUST clearly provide BOTH file paths (Master first, then Matching)."
+                "Use ONLY to find activities in a 'Master JSON' that are NOT present in a 'Matching JSON' (the output file from ActivityMatcher). Saves these NON-MATCHING (unique to master) activities to a NEW file. Returns a message including the full path to the new 'filtered' JSON file. Input MUST clearly provide BOTH JSON files as file paths or artifact ids (Master first, then Matching, e.g. 'art-1a2b3c4d, art-5e6f7a8b')."
             )
         ),
         Tool(
             name="ActivityGenerator",
-            func=generate_activities, 
+            func=memoize("ActivityGenerator", GENERATOR_VERSION)(generate_activities), 
+            coroutine=memoize("ActivityGenerator", GENERATOR_VERSION)(agenerate_activities),
+            description=(
+                "Use ONLY to generate NEW, improved, hands-on classroom activities based on a list of existing activities provided in a JSON file (typically the output of ActivityFilter, e.g., '..._filtered.json'). It uses an LLM to create 4 or fewer high-quality activities following specific criteria (safety, material accessibility, concept depth etc.) Saves these newly generated activities to a NEW file ('new_activities.json' in this run's workspace directory). Returns a message including the full path to this 'new_activities.json' file. Input MUST be the file path or artifact id of the JSON containing the activities to be used as inspiration."
+            )
+        ),
+        Tool(
+            name="StreamingActivityPipeline",
+            func=memoize("StreamingActivityPipeline", PIPELINE_VERSION)(stream_pipeline_wrapper),
+            description=(
+                "Use ONLY when the user wants the full extract -> match -> filter workflow in one step for a PDF textbook and already provided a 'User JSON' file. Runs TextbookActivityExtractor, ActivityMatcher and ActivityFilter as a single streaming pipeline, so matching and filtering start while later pages are still being extracted. Returns a message with the full paths of the Master, matching and filtered JSON files. Input MUST contain BOTH the PDF file path and the User JSON file path or artifact id (e.g., '/path/book.pdf, /path/user.json')."
+            )
+        ),
+        Tool(
+            name="ActivitySearch",
+            func=search_activities_tool,
             description=(
-                "Use ONLY to generate NEW, improved, hands-on classroom activities based on a list of existing activities provided in a JSON file (typically the output of ActivityFilter, e.g., '..._filtered.json'). It uses an LLM to create 4 or fewer high-quality activities following specific criteria (safety, material accessibility, concept depth etc.) Saves these newly generated activities to a NEW file ('new_activities.json' in the same directory as the input). Returns a message including the full path to this 'new_activities.json' file. Input MUST be the file path to the JSON containing the activities to be used as inspiration."
+                "Use FIRST for questions about activities that were already extracted, e.g. 'which activities use magnets?' or 'activities about evaporation on pages 40-60'. Searches activity names, concepts, materials and descriptions of all previously processed textbooks instantly, without re-extracting anything. Input MUST be the search words, optionally followed by a page range like 'pages 10-40'. Returns the best matching activities with their textbook and page numbers."
+            )
+        ),
+        Tool(
+            name="CostEstimator",
+            func=cost_estimator_tool,
+            description=(
+                "Use when the user asks what processing a PDF textbook would cost or how long it would take, BEFORE running TextbookActivityExtractor or StreamingActivityPipeline on a large book. Estimates locally, without calling any model: pages needing OCR, pages with activities, the number of LLM/OCR calls, tokens, cost in USD and expected wall time. Input MUST be the PDF file path, optionally followed by the User JSON file path (or artifact id) to also estimate the full pipeline and generation (e.g., '/path/book.pdf, /path/user.json')."
             )
         )
     ]
@@ -81,6 +124,10 @@ def create_agent(openai_api_key: str, verbose: bool = True) -> AgentExecutor:
                    "3. ActivityFilter: Compares Master JSON and Matching JSON (output of Tool 2), saves NON-MATCHING activities to a new file.\n"
                    "Use the chat history to find file paths mentioned in previous turns. If you need two paths for ActivityMatcher and only have one, ask the user for the missing one.\n"
                    "4. ActivityGenerator: Takes Filtered JSON -> NEW activities JSON (using LLM generation).\n"
+                   "5. StreamingActivityPipeline: Runs tools 1-3 in one streaming pass when both the PDF and the User JSON are known.\n"
+                   "6. ActivitySearch: Answers questions about already extracted activities (e.g. which use magnets) without re-running extraction.\n"
+                   "7. CostEstimator: Predicts the calls, cost and time of processing a PDF without running anything.\n"
+                   "Tools report each file they save with a short artifact id, e.g. 'Matched activities (art-1a2b3c4d) saved to /path/matched.json'. Pass that id instead of the path when a later tool needs the file.\n"
                    "IMPORTANT: When asked about file locations, SEARCH the chat history for messages where tools reported saving files (e.g., 'Results saved to \'/path/to/file.json\''). Report the exact path found in the history if relevant to the user's query. If no specific file path is found in the history related to the query, explain that."
                    ),
         MessagesPlaceholder(variable_name="chat_history"), # <<< Where memory goes
@@ -110,14 +157,24 @@ def create_agent(openai_api_key: str, verbose: bool = True) -> AgentExecutor:
         raise
 
     print("Setting up sqlite database for chat history...")
+    # Adds the session index (and retention bookkeeping) to the history table before first use
+    chat_history.connect().close()
+    chat_history.maybe_maintain()
+    # One async engine is shared by all sessions. SQLite connections are cheap to open, and
+    # pooled aiosqlite connections would keep their threads (and the server process) alive
+    async_engine = create_async_engine(ASYNC_CONNECTION_STRING, poolclass=NullPool) if async_mode else None
+
     # Initialize memory for the agent
     # This is where the chat history will be stored
     def get_session_history(session_id: str) -> BaseChatMessageHistory:
         """Retrieves SQLChatHistory for a given session ID."""
         print(f"Accessing history for session_id: {session_id} using SQLite.") 
+        chat_history.maybe_maintain()
+        # A session archived as cold (see src/db/chat_history.py) comes back with its history
+        chat_history.restore_if_archived(session_id)
         return SQLChatMessageHistory(
             session_id=session_id,
-            connection=create_engine(CONNECTION_STRING)
+            connection=async_engine or create_engine(CONNECTION_STRING)
         )
     
     # Create a memory object that uses the message history store
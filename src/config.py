@@ -1,6 +1,8 @@
 import os
 from dotenv import load_dotenv
 
+load_dotenv()
+
 def load_api_key() -> str:
     """
     Load API keys from environment variables.
@@ -10,5 +12,76 @@ def load_api_key() -> str:
 
     if not openai_api_key:
         raise ValueError("OPENAI_API_KEY is not set in the environment variables.")
-    
-    return openai_api_key
\ No newline at end of file
+
+    return openai_api_key
+
+# Model routing per stage: the model, its output-token budget, the request timeout in
+# seconds and how many requests of the stage run at once. A stage with `escalate_to` asks
+# its (fast) model first and re-asks the stronger model only when the answer does not
+# parse or covers less than `min_coverage` of the input. The matcher has no coverage check,
+# as finding no match is a valid answer. Any field can be overridden per stage from the
+# environment, e.g. EXTRACTOR_MODEL=gpt-4o, MATCHER_ESCALATE_TO= (off), GENERATOR_TIMEOUT=180.
+MODEL_ROUTES = {
+    "agent": {"model": "gpt-4o", "timeout": 60},
+    "extractor": {"model": "gpt-4o-mini", "escalate_to": "gpt-4", "max_tokens": 3000,
+                  "timeout": 60, "concurrency": 8, "min_coverage": 0.5},
+    "matcher": {"model": "gpt-4o-mini", "escalate_to": "gpt-4", "max_tokens": 1500,
+                "timeout": 60, "concurrency": 8},
+    "generator": {"model": "gpt-4", "max_tokens": 2000, "timeout": 120, "concurrency": 4},
+}
+
+
+class ModelRoute:
+    """How one stage calls the LLM; see MODEL_ROUTES."""
+    __slots__ = ("stage", "model", "escalate_to", "max_tokens", "timeout", "concurrency", "min_coverage")
+
+    def __init__(self, stage: str, model: str, escalate_to: str | None = None, max_tokens: int | None = None,
+                 timeout: float = 60, concurrency: int = 4, min_coverage: float = 0.0):
+        self.stage = stage
+        self.model = model
+        self.escalate_to = escalate_to or None
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.min_coverage = min_coverage
+
+    @property
+    def models(self) -> tuple:
+        """The models to try, in order."""
+        return (self.model, self.escalate_to) if self.escalate_to and self.escalate_to != self.model else (self.model,)
+
+    @property
+    def key(self) -> str:
+        """Identifies the models and budget, e.g. for tool result cache versions."""
+        return ">".join(self.models) + (f":{self.max_tokens}" if self.max_tokens else "")
+
+    def __repr__(self):
+        return f"ModelRoute({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+
+_FIELD_TYPES = {"model": str, "escalate_to": str, "max_tokens": int, "timeout": float,
+                "concurrency": int, "min_coverage": float}
+
+
+def model_route(stage: str) -> ModelRoute:
+    """The route of a stage in MODEL_ROUTES, with <STAGE>_<FIELD> environment overrides applied."""
+    if stage not in MODEL_ROUTES:
+        raise ValueError(f"Unknown model routing stage: {stage}")
+    fields = dict(MODEL_ROUTES[stage])
+    for name, cast in _FIELD_TYPES.items():
+        value = os.getenv(f"{stage.upper()}_{name.upper()}")
+        if value is None or (name == "model" and not value.strip()):
+            continue
+        # An empty value unsets the field, e.g. MATCHER_ESCALATE_TO= turns escalation off
+        fields[name] = cast(value) if value.strip() else None
+    return ModelRoute(stage, **{name: value for name, value in fields.items() if value is not None})
+
+
+# Prices in USD per million prompt and completion tokens, and per OCR'd page, for cost
+# estimates (see src/tools/cost_estimator.py); update them when the providers do
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4": (30.00, 60.00),
+}
+OCR_PRICE_PER_PAGE = float(os.getenv("OCR_PRICE_PER_PAGE", "0.001"))
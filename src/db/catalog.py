@@ -0,0 +1,472 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from src.models.activity import Activity, normalize_pages
+from src.utils.helper import atomic_write
+from src.utils.prompt_builder import name_tokens
+
+# Catalog database, next to the chat history database
+DB_DIR = Path(__file__).resolve().parent
+CATALOG_DB_FILE = Path(os.getenv("CATALOG_DB_PATH", DB_DIR / "catalog.db"))
+# PRAGMA user_version of the current schema; older catalogs are migrated on first connect
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS textbooks (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    title TEXT,
+    grade INTEGER,
+    activities_digest TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_textbooks_grade ON textbooks(grade);
+
+CREATE TABLE IF NOT EXISTS pages (
+    textbook_id INTEGER NOT NULL REFERENCES textbooks(id) ON DELETE CASCADE,
+    page_number INTEGER NOT NULL,
+    text TEXT,
+    PRIMARY KEY (textbook_id, page_number)
+);
+
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY,
+    textbook_id INTEGER NOT NULL REFERENCES textbooks(id) ON DELETE CASCADE,
+    activity TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    concept TEXT,
+    materials TEXT,
+    description TEXT,
+    pages TEXT,
+    first_page INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_activities_textbook_name ON activities(textbook_id, activity);
+CREATE INDEX IF NOT EXISTS idx_activities_name_key ON activities(name_key, textbook_id);
+CREATE INDEX IF NOT EXISTS idx_activities_first_page ON activities(textbook_id, first_page);
+
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY,
+    activity_id INTEGER NOT NULL REFERENCES activities(id) ON DELETE CASCADE,
+    user_activity TEXT NOT NULL,
+    UNIQUE (activity_id, user_activity)
+);
+
+CREATE TABLE IF NOT EXISTS generated_activities (
+    id INTEGER PRIMARY KEY,
+    textbook_id INTEGER NOT NULL REFERENCES textbooks(id) ON DELETE CASCADE,
+    activity TEXT NOT NULL,
+    concept TEXT,
+    materials TEXT,
+    description TEXT,
+    pages TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_generated_textbook ON generated_activities(textbook_id);
+
+-- JSON files written by the tools, so a path handed to the next tool maps back to its textbook
+-- as long as the textbook still has the activities (activities_digest) the file was written from
+CREATE TABLE IF NOT EXISTS exports (
+    path TEXT PRIMARY KEY,
+    textbook_id INTEGER NOT NULL REFERENCES textbooks(id) ON DELETE CASCADE,
+    view TEXT NOT NULL,
+    mtime_ns INTEGER,
+    activities_digest TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_exports_textbook ON exports(textbook_id, view);
+
+-- Full-text index over the activities table, kept in sync by triggers
+CREATE VIRTUAL TABLE IF NOT EXISTS activities_fts USING fts5(
+    activity, concept, materials, description,
+    content='activities', content_rowid='id', tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS activities_fts_insert AFTER INSERT ON activities BEGIN
+    INSERT INTO activities_fts (rowid, activity, concept, materials, description)
+    VALUES (new.id, new.activity, new.concept, new.materials, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS activities_fts_delete AFTER DELETE ON activities BEGIN
+    INSERT INTO activities_fts (activities_fts, rowid, activity, concept, materials, description)
+    VALUES ('delete', old.id, old.activity, old.concept, old.materials, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS activities_fts_update AFTER UPDATE ON activities BEGIN
+    INSERT INTO activities_fts (activities_fts, rowid, activity, concept, materials, description)
+    VALUES ('delete', old.id, old.activity, old.concept, old.materials, old.description);
+    INSERT INTO activities_fts (rowid, activity, concept, materials, description)
+    VALUES (new.id, new.activity, new.concept, new.materials, new.description);
+END;
+"""
+
+# Words dropped from free-text questions before they are turned into an FTS query
+SEARCH_STOPWORDS = {
+    "a", "an", "and", "are", "about", "activities", "activity", "all", "any", "do", "does", "for",
+    "find", "from", "how", "i", "in", "is", "list", "me", "of", "on", "or", "show", "that", "the",
+    "there", "to", "use", "uses", "using", "what", "which", "with",
+}
+
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def connect(db_file: Path | str | None = None) -> sqlite3.Connection:
+    """Open a connection to the catalog, creating the schema on first use."""
+    db_file = Path(db_file or CATALOG_DB_FILE)
+    conn = sqlite3.connect(db_file, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    with _init_lock:
+        if db_file not in _initialized:
+            db_file.parent.mkdir(parents=True, exist_ok=True)
+            conn.execute("PRAGMA journal_mode = WAL")
+            had_fts = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'activities_fts'"
+            ).fetchone() is not None
+            conn.executescript(SCHEMA)
+            if not had_fts:
+                # Index activities stored before the full-text table existed
+                conn.execute("INSERT INTO activities_fts (activities_fts) VALUES ('rebuild')")
+                conn.commit()
+            _migrate(conn)
+            _initialized.add(db_file)
+    return conn
+
+
+def _migrate(conn) -> None:
+    """Bring a catalog written by an older version up to SCHEMA_VERSION."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version < 1:
+        # Name keys were whitespace-normalized names; they are now token sets, as in CandidateIndex
+        conn.executemany(
+            "UPDATE activities SET name_key = ? WHERE id = ?",
+            [(name_key(row["activity"]), row["id"]) for row in conn.execute("SELECT id, activity FROM activities")],
+        )
+    if version < 2:
+        # Exports recorded without a digest never map back to their textbook again
+        for table in ("textbooks", "exports"):
+            columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if "activities_digest" not in columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN activities_digest TEXT")
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    conn.commit()
+
+
+@contextmanager
+def session(db_file: Path | str | None = None):
+    """Connection that commits on success, rolls back on error and is always closed."""
+    conn = connect(db_file)
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def name_key(name: str) -> str:
+    """
+    Normalized activity name used for exact-name joins: its sorted `name_tokens`,
+    so names the matcher's CandidateIndex treats as identical (e.g. 'Activity 4.1:'
+    and 'activity 4.1') join.
+    """
+    return " ".join(sorted(name_tokens(name)))
+
+
+def infer_grade(pdf_path: str) -> int | None:
+    """Guess the grade from file names like 'CLS_7.pdf' or 'grade-6-science.pdf'."""
+    match = re.search(r"(?:cls|class|grade|std)[ _-]?(\d{1,2})", Path(pdf_path).stem, re.IGNORECASE)
+    return int(match.group(1)) if match else None
+
+
+def _canonical_path(path) -> str:
+    return Path(path).resolve().as_posix()
+
+
+def _pages_text(page) -> str:
+    return json.dumps(list(normalize_pages(page)))
+
+
+def _row_to_activity(row) -> Activity:
+    return Activity(
+        activity=row["activity"],
+        concept=row["concept"] or "",
+        materials=json.loads(row["materials"] or "[]"),
+        description=row["description"] or "",
+        page=json.loads(row["pages"] or "[]"),
+    )
+
+
+def register_textbook(conn, pdf_path: str, grade: int | None = None) -> int:
+    """Insert or update a textbook row and return its id."""
+    path = _canonical_path(pdf_path)
+    grade = grade if grade is not None else infer_grade(pdf_path)
+    conn.execute(
+        "INSERT INTO textbooks (path, title, grade) VALUES (?, ?, ?) "
+        "ON CONFLICT(path) DO UPDATE SET grade = COALESCE(excluded.grade, textbooks.grade)",
+        (path, Path(pdf_path).stem, grade),
+    )
+    return conn.execute("SELECT id FROM textbooks WHERE path = ?", (path,)).fetchone()["id"]
+
+
+def store_pages(conn, textbook_id: int, pages) -> None:
+    """Store page text; `pages` is a dict or an iterable of (page_number, text)."""
+    items = pages.items() if isinstance(pages, dict) else pages
+    conn.executemany(
+        "INSERT OR REPLACE INTO pages (textbook_id, page_number, text) VALUES (?, ?, ?)",
+        ((textbook_id, number, text) for number, text in items),
+    )
+
+
+def activities_digest(activities) -> str:
+    """Content hash of a list of activities, to tell one extraction of a textbook from another."""
+    data = json.dumps([a.to_dict() for a in activities], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def store_activities(conn, textbook_id: int, activities) -> None:
+    """
+    Replace the extracted activities of a textbook (and their matches). Files
+    exported from its previous activities no longer map back to it, unless
+    those were the same.
+    """
+    activities = list(activities)
+    conn.execute("DELETE FROM activities WHERE textbook_id = ?", (textbook_id,))
+    conn.execute("UPDATE textbooks SET activities_digest = ? WHERE id = ?",
+                 (activities_digest(activities), textbook_id))
+    conn.executemany(
+        "INSERT INTO activities (textbook_id, activity, name_key, concept, materials, description, pages, first_page) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            (textbook_id, a.activity, name_key(a.activity), a.concept, json.dumps(list(a.materials)),
+             a.description, json.dumps(list(a.page)), min(a.page) if a.page else None)
+            for a in activities
+        ),
+    )
+
+
+def store_generated(conn, textbook_id: int, activities) -> None:
+    """Replace the generated activities of a textbook."""
+    conn.execute("DELETE FROM generated_activities WHERE textbook_id = ?", (textbook_id,))
+    conn.executemany(
+        "INSERT INTO generated_activities (textbook_id, activity, concept, materials, description, pages) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            (textbook_id, a.activity, a.concept, json.dumps(list(a.materials)), a.description, json.dumps(list(a.page)))
+            for a in activities
+        ),
+    )
+
+
+def record_export(conn, path, textbook_id: int, view: str) -> None:
+    """Remember which textbook, view and activities of the textbook a JSON file written by a tool belongs to."""
+    conn.execute(
+        "INSERT OR REPLACE INTO exports (path, textbook_id, view, mtime_ns, activities_digest) "
+        "VALUES (?, ?, ?, ?, (SELECT activities_digest FROM textbooks WHERE id = ?))",
+        (_canonical_path(path), textbook_id, view, os.stat(path).st_mtime_ns, textbook_id),
+    )
+
+
+def textbook_for_path(conn, json_path) -> int | None:
+    """
+    Return the textbook id of a JSON file previously written by a tool, or None
+    if the file is unknown, has been modified since it was written, or the
+    textbook has been extracted again (with other activities) since.
+    """
+    row = conn.execute(
+        "SELECT e.textbook_id, e.mtime_ns, e.activities_digest = t.activities_digest AS current "
+        "FROM exports e JOIN textbooks t ON t.id = e.textbook_id WHERE e.path = ?",
+        (_canonical_path(json_path),),
+    ).fetchone()
+    if not row or not row["current"]:
+        return None
+    if not os.path.exists(json_path) or os.stat(json_path).st_mtime_ns != row["mtime_ns"]:
+        return None
+    return row["textbook_id"]
+
+
+def find_textbook(json_path) -> int | None:
+    """`textbook_for_path` in its own session; returns None if the catalog is unavailable."""
+    try:
+        with session() as conn:
+            return textbook_for_path(conn, json_path)
+    except Exception as e:
+        print(f"🚨 Catalog lookup failed for {json_path}: {e}")
+        return None
+
+
+def match_by_name(conn, textbook_id: int, user_names: list) -> list:
+    """
+    Match a textbook's activities against user activity names with an indexed join
+    on the normalized name, record the matches and return them in the
+    `matched_activities.json` format.
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS user_names (name TEXT, name_key TEXT)")
+    conn.execute("DELETE FROM user_names")
+    conn.executemany("INSERT INTO user_names VALUES (?, ?)", ((n, name_key(n)) for n in user_names))
+    conn.execute(
+        "DELETE FROM matches WHERE activity_id IN (SELECT id FROM activities WHERE textbook_id = ?)",
+        (textbook_id,),
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO matches (activity_id, user_activity) "
+        "SELECT a.id, u.name FROM user_names u JOIN activities a "
+        "ON a.name_key = u.name_key AND a.textbook_id = ? WHERE u.name_key != ''",
+        (textbook_id,),
+    )
+    return matched_records(conn, textbook_id)
+
+
+def import_matches(conn, textbook_id: int, match_data: list) -> None:
+    """Replace a textbook's matches with the records of a matched_activities.json file."""
+    conn.execute(
+        "DELETE FROM matches WHERE activity_id IN (SELECT id FROM activities WHERE textbook_id = ?)",
+        (textbook_id,),
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO matches (activity_id, user_activity) "
+        "SELECT id, ? FROM activities WHERE textbook_id = ? AND activity = ? AND pages = ?",
+        (
+            (entry.get("json2_activity") or entry.get("json1_activity"), textbook_id,
+             entry.get("json1_activity"), _pages_text(entry.get("page")))
+            for entry in match_data if isinstance(entry, dict)
+        ),
+    )
+
+
+def matched_records(conn, textbook_id: int) -> list:
+    rows = conn.execute(
+        "SELECT a.pages, a.activity, m.user_activity FROM matches m "
+        "JOIN activities a ON a.id = m.activity_id WHERE a.textbook_id = ? ORDER BY a.id",
+        (textbook_id,),
+    )
+    return [
+        {"page": json.loads(row["pages"]), "json1_activity": row["activity"], "json2_activity": row["user_activity"]}
+        for row in rows
+    ]
+
+
+def unmatched_activities(conn, textbook_id: int | None = None, grade: int | None = None) -> list:
+    """Activities with no match, for one textbook or across all textbooks of a grade."""
+    query = (
+        "SELECT a.* FROM activities a JOIN textbooks t ON t.id = a.textbook_id "
+        "WHERE NOT EXISTS (SELECT 1 FROM matches m WHERE m.activity_id = a.id)"
+    )
+    params = []
+    if textbook_id is not None:
+        query += " AND a.textbook_id = ?"
+        params.append(textbook_id)
+    if grade is not None:
+        query += " AND t.grade = ?"
+        params.append(grade)
+    query += " ORDER BY a.textbook_id, a.id"
+    return [_row_to_activity(row) for row in conn.execute(query, params)]
+
+
+def textbook_activities(conn, textbook_id: int) -> list:
+    rows = conn.execute("SELECT * FROM activities WHERE textbook_id = ? ORDER BY id", (textbook_id,))
+    return [_row_to_activity(row) for row in rows]
+
+
+def generated_activities(conn, textbook_id: int) -> list:
+    rows = conn.execute("SELECT * FROM generated_activities WHERE textbook_id = ? ORDER BY id", (textbook_id,))
+    return [_row_to_activity(row) for row in rows]
+
+
+def fts_query(text: str) -> str:
+    """Turn a free-text question like 'which activities use magnets?' into an FTS5 query."""
+    terms = [t for t in re.findall(r"\w+", text.lower()) if t not in SEARCH_STOPWORDS]
+    if not terms:
+        terms = re.findall(r"\w+", text.lower())
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+def search_activities(conn, query: str, page_from: int | None = None, page_to: int | None = None,
+                      textbook_id: int | None = None, grade: int | None = None, limit: int = 20) -> list:
+    """
+    Full-text search over activity name, concept, materials and description,
+    ranked by BM25 (name and concept weighted highest). Optional filters keep
+    activities with a page in [page_from, page_to], from one textbook or grade.
+    """
+    match = fts_query(query)
+    if not match:
+        return []
+
+    sql = (
+        "SELECT a.*, t.path AS textbook, t.grade AS grade, "
+        "bm25(activities_fts, 4.0, 3.0, 2.0, 1.0) AS score, "
+        "snippet(activities_fts, 3, '[', ']', '...', 12) AS snippet "
+        "FROM activities_fts JOIN activities a ON a.id = activities_fts.rowid "
+        "JOIN textbooks t ON t.id = a.textbook_id "
+        "WHERE activities_fts MATCH ?"
+    )
+    params = [match]
+    if page_from is not None or page_to is not None:
+        sql += " AND EXISTS (SELECT 1 FROM json_each(a.pages) WHERE value BETWEEN ? AND ?)"
+        params.extend([page_from if page_from is not None else 0, page_to if page_to is not None else 1_000_000])
+    if textbook_id is not None:
+        sql += " AND a.textbook_id = ?"
+        params.append(textbook_id)
+    if grade is not None:
+        sql += " AND t.grade = ?"
+        params.append(grade)
+    sql += " ORDER BY score LIMIT ?"
+    params.append(limit)
+
+    results = []
+    for row in conn.execute(sql, params):
+        result = _row_to_activity(row).to_dict()
+        result.update({
+            "textbook": row["textbook"],
+            "grade": row["grade"],
+            "score": round(-row["score"], 4),
+            "snippet": row["snippet"],
+        })
+        results.append(result)
+    return results
+
+
+def export_view(conn, textbook_id: int, view: str, path) -> str:
+    """
+    Write one of the catalog views to a JSON file in the format the tools have
+    always produced: 'activities', 'matched', 'filtered' or 'generated'.
+    """
+    if view == "activities":
+        data = [a.to_dict() for a in textbook_activities(conn, textbook_id)]
+    elif view == "matched":
+        data = matched_records(conn, textbook_id)
+    elif view == "filtered":
+        data = [a.to_dict() for a in unmatched_activities(conn, textbook_id=textbook_id)]
+    elif view == "generated":
+        data = [a.to_dict() for a in generated_activities(conn, textbook_id)]
+    else:
+        raise ValueError(f"Unknown catalog view: {view}")
+
+    with atomic_write(path) as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    record_export(conn, path, textbook_id, view)
+    return str(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the activity catalog.")
+    parser.add_argument("command", choices=["unmatched", "textbooks", "search"])
+    parser.add_argument("query", nargs="?", default="")
+    parser.add_argument("--grade", type=int, default=None)
+    parser.add_argument("--textbook", type=int, default=None)
+    args = parser.parse_args()
+
+    with session() as conn:
+        if args.command == "textbooks":
+            for row in conn.execute("SELECT id, grade, path FROM textbooks ORDER BY id"):
+                print(f"{row['id']:>4}  grade={row['grade']}  {row['path']}")
+        elif args.command == "search":
+            results = search_activities(conn, args.query, textbook_id=args.textbook, grade=args.grade)
+            print(json.dumps(results, indent=2, ensure_ascii=False))
+        else:
+            activities = unmatched_activities(conn, textbook_id=args.textbook, grade=args.grade)
+            print(json.dumps([a.to_dict() for a in activities], indent=2, ensure_ascii=False))
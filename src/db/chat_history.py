@@ -0,0 +1,336 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Chat history database used by SQLChatMessageHistory, and the archive cold sessions are moved to
+DB_DIR = Path(__file__).resolve().parent
+CHAT_HISTORY_DB_FILE = Path(os.getenv("CHAT_HISTORY_DB_PATH", DB_DIR / "chat_history.db"))
+CHAT_ARCHIVE_DB_FILE = Path(os.getenv("CHAT_ARCHIVE_DB_PATH", DB_DIR / "chat_history_archive.db"))
+
+# Retention, off by default (0): sessions idle for CHAT_HISTORY_RETENTION_DAYS are archived
+# and sessions keep their last CHAT_HISTORY_MAX_MESSAGES messages, the older ones archived;
+# CHAT_HISTORY_ARCHIVE=0 deletes instead. A session whose id comes back is restored from the
+# archive. Maintenance runs at most every CHAT_HISTORY_MAINTENANCE_HOURS.
+CHAT_HISTORY_RETENTION_DAYS = float(os.getenv("CHAT_HISTORY_RETENTION_DAYS", "0"))
+CHAT_HISTORY_MAX_MESSAGES = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "0"))
+CHAT_HISTORY_ARCHIVE = os.getenv("CHAT_HISTORY_ARCHIVE", "1") != "0"
+CHAT_HISTORY_MAINTENANCE_HOURS = float(os.getenv("CHAT_HISTORY_MAINTENANCE_HOURS", "24"))
+# VACUUM only once free pages make up this share of the file
+VACUUM_FREE_RATIO = 0.2
+
+# message_store is the table SQLChatMessageHistory creates (same DDL). The index serves its
+# only read, WHERE session_id = ? ORDER BY id, and session_activity is kept up to date by
+# triggers, since message_store has no timestamps.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS message_store (
+    id INTEGER NOT NULL,
+    session_id TEXT,
+    message TEXT,
+    PRIMARY KEY (id)
+);
+CREATE INDEX IF NOT EXISTS idx_message_store_session ON message_store(session_id, id);
+
+CREATE TABLE IF NOT EXISTS session_activity (
+    session_id TEXT PRIMARY KEY,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_session_activity_last_seen ON session_activity(last_seen);
+
+CREATE TRIGGER IF NOT EXISTS message_store_ai AFTER INSERT ON message_store BEGIN
+    INSERT INTO session_activity (session_id, first_seen, last_seen, message_count)
+    VALUES (new.session_id, (julianday('now') - 2440587.5) * 86400.0, (julianday('now') - 2440587.5) * 86400.0, 1)
+    ON CONFLICT(session_id) DO UPDATE SET
+        last_seen = excluded.last_seen, message_count = message_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS message_store_ad AFTER DELETE ON message_store BEGIN
+    UPDATE session_activity SET message_count = message_count - 1 WHERE session_id = old.session_id;
+END;
+"""
+
+# Archived rows get their own key: SQLite reuses message_store ids once the highest rows are
+# deleted, so the live id (kept to restore messages in order) is not unique over time
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive.archived_messages (
+    archive_id INTEGER PRIMARY KEY,
+    id INTEGER NOT NULL,
+    session_id TEXT,
+    message TEXT,
+    archived_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS archive.idx_archived_messages_session ON archived_messages(session_id, id);
+"""
+
+_initialized = set()
+_init_lock = threading.Lock()
+_last_maintenance = 0.0
+
+
+def connect(db_file: Path | str | None = None) -> sqlite3.Connection:
+    """
+    Open a connection to the chat history, adding the session index, the
+    activity table and its triggers on first use (existing sessions are backfilled).
+    """
+    db_file = Path(db_file or CHAT_HISTORY_DB_FILE)
+    conn = sqlite3.connect(db_file, timeout=30)
+    conn.row_factory = sqlite3.Row
+    with _init_lock:
+        if db_file not in _initialized:
+            db_file.parent.mkdir(parents=True, exist_ok=True)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(SCHEMA)
+            conn.execute(
+                "INSERT OR IGNORE INTO session_activity (session_id, first_seen, last_seen, message_count) "
+                "SELECT session_id, (julianday('now') - 2440587.5) * 86400.0, (julianday('now') - 2440587.5) * 86400.0, COUNT(*) "
+                "FROM message_store WHERE session_id NOT IN (SELECT session_id FROM session_activity) "
+                "GROUP BY session_id"
+            )
+            conn.commit()
+            _initialized.add(db_file)
+    return conn
+
+
+@contextmanager
+def session(db_file: Path | str | None = None):
+    """Connection that commits on success, rolls back on error and is always closed."""
+    conn = connect(db_file)
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _attach_archive(conn, archive_file: Path | str | None = None) -> None:
+    if any(row[1] == "archive" for row in conn.execute("PRAGMA database_list")):
+        return
+    conn.execute("ATTACH DATABASE ? AS archive", (str(archive_file or CHAT_ARCHIVE_DB_FILE),))
+    columns = [row[1] for row in conn.execute("PRAGMA archive.table_info(archived_messages)")]
+    if columns and "archive_id" not in columns:
+        # Archives keyed on the live message id: move their rows into the current table
+        conn.executescript(
+            "DROP INDEX IF EXISTS archive.idx_archived_messages_session;"
+            "ALTER TABLE archive.archived_messages RENAME TO archived_messages_old;"
+        )
+        conn.executescript(ARCHIVE_SCHEMA)
+        conn.execute(
+            "INSERT INTO archive.archived_messages (id, session_id, message, archived_at) "
+            "SELECT id, session_id, message, archived_at FROM archive.archived_messages_old ORDER BY id"
+        )
+        conn.execute("DROP TABLE archive.archived_messages_old")
+        conn.commit()
+    conn.executescript(ARCHIVE_SCHEMA)
+
+
+def _remove_sessions(conn, session_ids: list, archive: bool) -> int:
+    """Move (or delete) all messages of the given sessions. Returns the number of messages."""
+    moved = 0
+    for session_id in session_ids:
+        if archive:
+            conn.execute(
+                "INSERT INTO archive.archived_messages (id, session_id, message, archived_at) "
+                "SELECT id, session_id, message, (julianday('now') - 2440587.5) * 86400.0 FROM message_store "
+                "WHERE session_id = ? ORDER BY id",
+                (session_id,),
+            )
+        moved += conn.execute("DELETE FROM message_store WHERE session_id = ?", (session_id,)).rowcount
+        conn.execute("DELETE FROM session_activity WHERE session_id = ?", (session_id,))
+    return moved
+
+
+def archive_cold_sessions(conn, max_idle_days: float, archive: bool = True) -> tuple[int, int]:
+    """
+    Archive (or delete) sessions without a new message for `max_idle_days`.
+    Returns (sessions, messages) removed from the live table.
+    """
+    cutoff = time.time() - max_idle_days * 86400
+    session_ids = [
+        row["session_id"]
+        for row in conn.execute("SELECT session_id FROM session_activity WHERE last_seen < ?", (cutoff,))
+    ]
+    if not session_ids:
+        return 0, 0
+    if archive:
+        _attach_archive(conn)
+    return len(session_ids), _remove_sessions(conn, session_ids, archive)
+
+
+def trim_sessions(conn, max_messages: int, archive: bool = True) -> int:
+    """
+    Archive (or delete) all but the last `max_messages` messages of every longer
+    session. Returns the number of messages removed from the live table.
+    """
+    dropped = 0
+    sessions = conn.execute(
+        "SELECT session_id FROM session_activity WHERE message_count > ?", (max_messages,)
+    ).fetchall()
+    if sessions and archive:
+        _attach_archive(conn)
+    for row in sessions:
+        session_id = row["session_id"]
+        cutoff = conn.execute(
+            "SELECT id FROM message_store WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+            (session_id, max_messages - 1),
+        ).fetchone()["id"]
+        if archive:
+            conn.execute(
+                "INSERT INTO archive.archived_messages (id, session_id, message, archived_at) "
+                "SELECT id, session_id, message, (julianday('now') - 2440587.5) * 86400.0 FROM message_store "
+                "WHERE session_id = ? AND id < ? ORDER BY id",
+                (session_id, cutoff),
+            )
+        dropped += conn.execute(
+            "DELETE FROM message_store WHERE session_id = ? AND id < ?", (session_id, cutoff)
+        ).rowcount
+    return dropped
+
+
+def _restore(conn, session_id: str) -> int:
+    """
+    Move a session's archived messages back into the live table as new messages,
+    in their original order and ahead of any it still has there (trimmed sessions).
+    """
+    _attach_archive(conn)
+    live = conn.execute("SELECT MAX(id) FROM message_store WHERE session_id = ?", (session_id,)).fetchone()[0]
+    restored = conn.execute(
+        "INSERT INTO message_store (session_id, message) "
+        "SELECT session_id, message FROM archive.archived_messages WHERE session_id = ? ORDER BY id, archive_id",
+        (session_id,),
+    ).rowcount
+    if restored and live is not None:
+        # Archived messages are older than the live ones: move those behind them
+        conn.execute(
+            "INSERT INTO message_store (session_id, message) "
+            "SELECT session_id, message FROM message_store WHERE session_id = ? AND id <= ? ORDER BY id",
+            (session_id, live),
+        )
+        conn.execute("DELETE FROM message_store WHERE session_id = ? AND id <= ?", (session_id, live))
+    conn.execute("DELETE FROM archive.archived_messages WHERE session_id = ?", (session_id,))
+    return restored
+
+
+def restore_session(session_id: str) -> int:
+    """Move an archived session back into the live table. Returns the number of messages restored."""
+    with session() as conn:
+        return _restore(conn, session_id)
+
+
+def restore_if_archived(session_id: str) -> int:
+    """
+    Restore a session that has no live messages but archived ones, e.g. a cold
+    session whose id comes back. Returns the number of messages restored.
+    """
+    if not CHAT_ARCHIVE_DB_FILE.exists():
+        return 0
+    try:
+        with session() as conn:
+            if conn.execute("SELECT 1 FROM message_store WHERE session_id = ? LIMIT 1", (session_id,)).fetchone():
+                return 0
+            _attach_archive(conn)
+            if not conn.execute(
+                "SELECT 1 FROM archive.archived_messages WHERE session_id = ? LIMIT 1", (session_id,)
+            ).fetchone():
+                return 0
+            restored = _restore(conn, session_id)
+    except sqlite3.Error as e:
+        print(f"🚨 Could not restore archived session {session_id}: {e}")
+        return 0
+    print(f"♻️ Restored {restored} archived messages of session {session_id}.")
+    return restored
+
+
+def compact(force: bool = False) -> bool:
+    """
+    Checkpoint the WAL and VACUUM the database if free pages make up
+    VACUUM_FREE_RATIO of it (or always, with `force`). Returns True if it vacuumed.
+    """
+    conn = connect()
+    try:
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        vacuum = force or (page_count and free_pages / page_count >= VACUUM_FREE_RATIO)
+        if vacuum:
+            conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return bool(vacuum)
+    finally:
+        conn.close()
+
+
+def maintain(retention_days: float = CHAT_HISTORY_RETENTION_DAYS, max_messages: int = CHAT_HISTORY_MAX_MESSAGES,
+             archive: bool = CHAT_HISTORY_ARCHIVE) -> dict:
+    """Apply age- and count-based retention, then compact. Returns what was done."""
+    report = {"sessions_archived" if archive else "sessions_deleted": 0, "messages_trimmed": 0}
+    with session() as conn:
+        if retention_days:
+            sessions, _ = archive_cold_sessions(conn, retention_days, archive)
+            report["sessions_archived" if archive else "sessions_deleted"] = sessions
+        if max_messages:
+            report["messages_trimmed"] = trim_sessions(conn, max_messages, archive)
+    report["vacuumed"] = compact()
+    return report
+
+
+def maybe_maintain() -> None:
+    """Run `maintain` in a background thread if it has not run in this process for CHAT_HISTORY_MAINTENANCE_HOURS."""
+    global _last_maintenance
+    with _init_lock:
+        if time.time() - _last_maintenance < CHAT_HISTORY_MAINTENANCE_HOURS * 3600:
+            return
+        _last_maintenance = time.time()
+
+    def run():
+        try:
+            report = maintain()
+            print(f"Chat history maintenance: {report}")
+        except Exception as e:
+            print(f"🚨 Chat history maintenance failed: {e}")
+
+    threading.Thread(target=run, name="chat-history-maintenance", daemon=True).start()
+
+
+def stats() -> dict:
+    with session() as conn:
+        row = conn.execute(
+            "SELECT COUNT(*) AS sessions, COALESCE(SUM(message_count), 0) AS messages, "
+            "COALESCE(MAX(message_count), 0) AS longest, MIN(last_seen) AS oldest FROM session_activity"
+        ).fetchone()
+        pages = conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+    return {
+        "sessions": row["sessions"],
+        "messages": row["messages"],
+        "longest_session": row["longest"],
+        "oldest_activity": time.strftime("%Y-%m-%d %H:%M", time.localtime(row["oldest"])) if row["oldest"] else None,
+        "size_mb": round(pages / 2**20, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the chat history database.")
+    parser.add_argument("command", choices=["stats", "maintain", "vacuum", "restore"])
+    parser.add_argument("session_id", nargs="?", help="Session to restore from the archive.")
+    parser.add_argument("--days", type=float, default=CHAT_HISTORY_RETENTION_DAYS)
+    parser.add_argument("--max-messages", type=int, default=CHAT_HISTORY_MAX_MESSAGES)
+    parser.add_argument("--delete", action="store_true", help="Delete cold sessions and trimmed messages instead of archiving them.")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        print(stats())
+    elif args.command == "maintain":
+        print(maintain(args.days, args.max_messages, archive=not args.delete))
+    elif args.command == "vacuum":
+        compact(force=True)
+        print(stats())
+    else:
+        if not args.session_id:
+            parser.error("restore needs a session_id")
+        print(f"Restored {restore_session(args.session_id)} messages.")
@@ -0,0 +1,173 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+import fitz  # PyMuPDF
+
+# OCR cache database, next to the chat history database
+DB_DIR = Path(__file__).resolve().parent
+OCR_CACHE_DB_FILE = Path(os.getenv("OCR_CACHE_DB_PATH", DB_DIR / "ocr_cache.db"))
+
+# Signed URLs are requested for this many hours and not reused in their last minutes
+SIGNED_URL_EXPIRY_HOURS = 24
+SIGNED_URL_MARGIN_SECONDS = 600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    sha256 TEXT PRIMARY KEY,
+    file_name TEXT,
+    page_count INTEGER,
+    file_id TEXT,
+    signed_url TEXT,
+    url_expires_at REAL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS pages (
+    doc_sha256 TEXT NOT NULL REFERENCES documents(sha256) ON DELETE CASCADE,
+    page_number INTEGER NOT NULL,
+    page_hash TEXT,
+    markdown TEXT NOT NULL,
+    PRIMARY KEY (doc_sha256, page_number)
+);
+CREATE INDEX IF NOT EXISTS idx_pages_hash ON pages(page_hash);
+"""
+
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def connect(db_file: Path | str | None = None) -> sqlite3.Connection:
+    """Open a connection to the OCR cache, creating the schema on first use."""
+    db_file = Path(db_file or OCR_CACHE_DB_FILE)
+    conn = sqlite3.connect(db_file, timeout=30)
+    conn.row_factory = sqlite3.Row
+    with _init_lock:
+        if db_file not in _initialized:
+            db_file.parent.mkdir(parents=True, exist_ok=True)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(SCHEMA)
+            _initialized.add(db_file)
+    return conn
+
+
+@contextmanager
+def session(db_file: Path | str | None = None):
+    """Connection that commits on success, rolls back on error and is always closed."""
+    conn = connect(db_file)
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's contents, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def page_hashes(pdf_path: str) -> list:
+    """
+    SHA-256 per page over its content stream and the raw bytes of its images,
+    so the same scanned page is recognized inside a different file.
+    """
+    hashes = []
+    doc = fitz.open(pdf_path)
+    try:
+        for page in doc:
+            digest = hashlib.sha256(page.read_contents())
+            for image in page.get_images(full=True):
+                digest.update(doc.xref_stream_raw(image[0]) or b"")
+            hashes.append(digest.hexdigest())
+    finally:
+        doc.close()
+    return hashes
+
+
+def cached_pages(doc_sha256: str, hashes: list | None = None) -> dict | None:
+    """
+    Return {page_number: markdown} for a known document, or None on a miss.
+    Falls back to per-page hashes, so a file whose pages were all OCR'd before
+    (e.g. as part of another file) is still a hit.
+    """
+    with session() as conn:
+        document = conn.execute("SELECT page_count FROM documents WHERE sha256 = ?", (doc_sha256,)).fetchone()
+        if document and document["page_count"]:
+            rows = conn.execute(
+                "SELECT page_number, markdown FROM pages WHERE doc_sha256 = ? ORDER BY page_number",
+                (doc_sha256,),
+            ).fetchall()
+            if len(rows) == document["page_count"]:
+                return {row["page_number"]: row["markdown"] for row in rows}
+
+    if hashes:
+        pages = cached_pages_by_hash(hashes)
+        if len(pages) == len(hashes):
+            return pages
+    return None
+
+
+def cached_pages_by_hash(hashes: list) -> dict:
+    """Return {page_number: markdown} for the pages whose hash has been OCR'd before."""
+    pages = {}
+    with session() as conn:
+        for number, page_hash in enumerate(hashes, start=1):
+            row = conn.execute("SELECT markdown FROM pages WHERE page_hash = ? LIMIT 1", (page_hash,)).fetchone()
+            if row is not None:
+                pages[number] = row["markdown"]
+    return pages
+
+
+def store_pages(doc_sha256: str, file_name: str, pages: dict, hashes: list | None = None) -> None:
+    """Store OCR markdown per page; page hashes are kept only if they line up with the pages."""
+    if hashes is not None and len(hashes) != len(pages):
+        hashes = None
+    with session() as conn:
+        conn.execute(
+            "INSERT INTO documents (sha256, file_name, page_count) VALUES (?, ?, ?) "
+            "ON CONFLICT(sha256) DO UPDATE SET page_count = excluded.page_count",
+            (doc_sha256, file_name, len(pages)),
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO pages (doc_sha256, page_number, page_hash, markdown) VALUES (?, ?, ?, ?)",
+            (
+                (doc_sha256, number, hashes[number - 1] if hashes else None, markdown)
+                for number, markdown in sorted(pages.items())
+            ),
+        )
+
+
+def cached_upload(doc_sha256: str) -> tuple[str | None, str | None]:
+    """Return (file_id, signed_url) of a previous upload; the URL is None once it is about to expire."""
+    with session() as conn:
+        row = conn.execute(
+            "SELECT file_id, signed_url, url_expires_at FROM documents WHERE sha256 = ?", (doc_sha256,)
+        ).fetchone()
+    if not row:
+        return None, None
+    url = row["signed_url"]
+    if not url or not row["url_expires_at"] or row["url_expires_at"] - SIGNED_URL_MARGIN_SECONDS < time.time():
+        url = None
+    return row["file_id"], url
+
+
+def remember_upload(doc_sha256: str, file_name: str, file_id: str, signed_url: str,
+                    expiry_hours: int = SIGNED_URL_EXPIRY_HOURS) -> None:
+    with session() as conn:
+        conn.execute(
+            "INSERT INTO documents (sha256, file_name, file_id, signed_url, url_expires_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(sha256) DO UPDATE SET file_id = excluded.file_id, "
+            "signed_url = excluded.signed_url, url_expires_at = excluded.url_expires_at",
+            (doc_sha256, file_name, file_id, signed_url, time.time() + expiry_hours * 3600),
+        )
@@ -0,0 +1,467 @@
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from src.db.ocr_cache import file_sha256
+from src.utils.single_flight import AsyncSingleFlight, SingleFlight
+from src.utils import artifacts, cancellation, tracing
+
+# Tool result cache, next to the chat history database
+DB_DIR = Path(__file__).resolve().parent
+TOOL_CACHE_DB_FILE = Path(os.getenv("TOOL_CACHE_DB_PATH", DB_DIR / "tool_cache.db"))
+
+# Input files are the PDF/JSON paths in a tool's input; outputs are the paths it reports saving to
+INPUT_PATH_RE = re.compile(r"['\"]?([^,'\"\s]+\.(?:pdf|json))['\"]?", re.IGNORECASE)
+OUTPUT_PATH_RE = re.compile(r"saved to ['\"]?(.+?)['\"]?\s*$", re.MULTILINE)
+
+# A process waiting for another one's run polls its lock every TOOL_LOCK_POLL_SECONDS; locks
+# older than TOOL_LOCK_TIMEOUT_SECONDS, or held by a process that is gone, are taken over
+TOOL_LOCK_POLL_SECONDS = float(os.getenv("TOOL_LOCK_POLL_SECONDS", "1"))
+TOOL_LOCK_TIMEOUT_SECONDS = float(os.getenv("TOOL_LOCK_TIMEOUT_SECONDS", "3600"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tool_results (
+    tool TEXT NOT NULL,
+    version TEXT NOT NULL,
+    input_key TEXT NOT NULL,
+    output TEXT NOT NULL,
+    output_files TEXT NOT NULL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (tool, version, input_key)
+);
+
+CREATE TABLE IF NOT EXISTS tool_result_inputs (
+    tool TEXT NOT NULL,
+    version TEXT NOT NULL,
+    input_key TEXT NOT NULL,
+    file_sha256 TEXT NOT NULL,
+    FOREIGN KEY (tool, version, input_key) REFERENCES tool_results(tool, version, input_key) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_tool_result_inputs_sha ON tool_result_inputs(file_sha256);
+
+CREATE TABLE IF NOT EXISTS tool_locks (
+    tool TEXT NOT NULL,
+    version TEXT NOT NULL,
+    input_key TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    host TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    acquired_at REAL NOT NULL,
+    PRIMARY KEY (tool, version, input_key)
+);
+"""
+
+_initialized = set()
+_init_lock = threading.Lock()
+
+# (path, size, mtime_ns) -> sha256, so a file is hashed once per process while unchanged
+_file_hashes = {}
+
+# Concurrent runs of a tool on the same input share one run: within a process through
+# these, across processes on the host through the tool_locks table
+_flights = SingleFlight()
+_async_flights = AsyncSingleFlight()
+
+
+def connect(db_file: Path | str | None = None) -> sqlite3.Connection:
+    """Open a connection to the tool result cache, creating the schema on first use."""
+    db_file = Path(db_file or TOOL_CACHE_DB_FILE)
+    conn = sqlite3.connect(db_file, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    with _init_lock:
+        if db_file not in _initialized:
+            db_file.parent.mkdir(parents=True, exist_ok=True)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(SCHEMA)
+            _initialized.add(db_file)
+    return conn
+
+
+@contextmanager
+def session(db_file: Path | str | None = None):
+    """Connection that commits on success, rolls back on error and is always closed."""
+    conn = connect(db_file)
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def content_hash(path: str) -> str:
+    """SHA-256 of a file, reused while its size and mtime are unchanged."""
+    stat = os.stat(path)
+    key = (str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        _file_hashes[key] = file_sha256(path)
+    return _file_hashes[key]
+
+
+def input_fingerprint(input_str: str, params: str = "") -> tuple[str | None, list]:
+    """
+    Key of a tool input by the contents of the files it names (by path or
+    artifact id), in order, and any extra call parameters. Returns (None, [])
+    if the input names no existing file.
+    """
+    paths = [p for p in INPUT_PATH_RE.findall(artifacts.expand(input_str)) if os.path.isfile(p)]
+    if not paths:
+        return None, []
+    hashes = [content_hash(p) for p in paths]
+    key = "\n".join(hashes + ([params] if params else []))
+    return hashlib.sha256(key.encode()).hexdigest(), hashes
+
+
+def output_files(output: str) -> list:
+    """(path, size, mtime_ns) of every existing file a tool reported saving to."""
+    files = []
+    for path in OUTPUT_PATH_RE.findall(str(output or "")):
+        path = path.strip()
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            files.append([path, stat.st_size, stat.st_mtime_ns])
+    return files
+
+
+def lookup(tool: str, version: str, input_key: str) -> str | None:
+    """The stored output of a tool run, or None if missing or its files changed on disk since."""
+    with session() as conn:
+        row = conn.execute(
+            "SELECT output, output_files FROM tool_results WHERE tool = ? AND version = ? AND input_key = ?",
+            (tool, version, input_key),
+        ).fetchone()
+        if row is None:
+            return None
+        for path, size, mtime_ns in json.loads(row["output_files"]):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+            if stat is None or stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                conn.execute(
+                    "DELETE FROM tool_results WHERE tool = ? AND version = ? AND input_key = ?",
+                    (tool, version, input_key),
+                )
+                return None
+    return row["output"]
+
+
+def remember(tool: str, version: str, input_key: str, input_hashes: list, output: str, files: list) -> None:
+    with session() as conn:
+        conn.execute(
+            "DELETE FROM tool_results WHERE tool = ? AND version = ? AND input_key = ?", (tool, version, input_key)
+        )
+        conn.execute(
+            "INSERT INTO tool_results (tool, version, input_key, output, output_files) VALUES (?, ?, ?, ?, ?)",
+            (tool, version, input_key, output, json.dumps(files)),
+        )
+        conn.executemany(
+            "INSERT INTO tool_result_inputs (tool, version, input_key, file_sha256) VALUES (?, ?, ?, ?)",
+            ((tool, version, input_key, sha) for sha in input_hashes),
+        )
+
+
+def invalidate(tool: str | None = None, path: str | None = None) -> int:
+    """
+    Drop cached results: of one tool, of every run that read the file at `path`
+    (by its current contents), or both combined. With no arguments, drops everything.
+    Returns the number of results dropped.
+    """
+    where, params = [], []
+    if tool:
+        where.append("tool = ?")
+        params.append(tool)
+    if path:
+        where.append(
+            "(tool, version, input_key) IN "
+            "(SELECT tool, version, input_key FROM tool_result_inputs WHERE file_sha256 = ?)"
+        )
+        params.append(content_hash(path))
+    sql = "DELETE FROM tool_results" + (" WHERE " + " AND ".join(where) if where else "")
+    with session() as conn:
+        return conn.execute(sql, params).rowcount
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":  # os.kill would terminate the process on Windows; rely on the timeout
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _lock_is_stale(row) -> bool:
+    if row["acquired_at"] < time.time() - TOOL_LOCK_TIMEOUT_SECONDS:
+        return True
+    return row["host"] == socket.gethostname() and not _pid_alive(row["pid"])
+
+
+def acquire_lock(tool: str, version: str, input_key: str) -> str | None:
+    """
+    Take the lock on running `tool` for `input_key`, taking over a stale one.
+    Returns the owner token to release it with, or None if another run holds it.
+    """
+    owner = uuid.uuid4().hex
+    key = (tool, version, input_key)
+    with session() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT host, pid, acquired_at FROM tool_locks WHERE tool = ? AND version = ? AND input_key = ?", key
+        ).fetchone()
+        if row is not None:
+            if not _lock_is_stale(row):
+                return None
+            print(f"🚨 Taking over a stale {tool} lock held by process {row['pid']} on {row['host']}.")
+            conn.execute("DELETE FROM tool_locks WHERE tool = ? AND version = ? AND input_key = ?", key)
+        conn.execute(
+            "INSERT INTO tool_locks (tool, version, input_key, owner, host, pid, acquired_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (*key, owner, socket.gethostname(), os.getpid(), time.time()),
+        )
+    return owner
+
+
+def release_lock(tool: str, version: str, input_key: str, owner: str) -> None:
+    with session() as conn:
+        conn.execute(
+            "DELETE FROM tool_locks WHERE tool = ? AND version = ? AND input_key = ? AND owner = ?",
+            (tool, version, input_key, owner),
+        )
+
+
+def lock_held(tool: str, version: str, input_key: str) -> bool:
+    """Whether another live run holds the lock for `input_key`."""
+    with session() as conn:
+        row = conn.execute(
+            "SELECT host, pid, acquired_at FROM tool_locks WHERE tool = ? AND version = ? AND input_key = ?",
+            (tool, version, input_key),
+        ).fetchone()
+    return row is not None and not _lock_is_stale(row)
+
+
+def _cached_result(tool: str, version: str, input_str, params: str = "") -> tuple[str | None, list, str | None]:
+    """(input_key, input_hashes, cached output) of a tool input; the cache never fails the tool."""
+    try:
+        input_key, input_hashes = input_fingerprint(input_str, params)
+        cached = lookup(tool, version, input_key) if input_key else None
+        # The artifact ids in a remembered output resolve to its files in this process too
+        artifacts.adopt(cached)
+        return input_key, input_hashes, cached
+    except Exception as e:
+        print(f"🚨 Tool cache unavailable for {tool}: {e}")
+        return None, [], None
+
+
+def _remember_result(tool: str, version: str, input_key: str | None, input_hashes: list, output: str) -> None:
+    # A run cut short by cancellation or its deadline may have saved partial results
+    if not input_key or cancellation.interrupted():
+        return
+    files = output_files(output)
+    if files:
+        try:
+            remember(tool, version, input_key, input_hashes, output, files)
+        except Exception as e:
+            print(f"🚨 Error caching the result of {tool}: {e}")
+
+
+def _try_lock(tool: str, version: str, input_key: str) -> tuple[bool, str | None]:
+    """
+    (acquired, owner) for this run. If the lock table is unavailable the run
+    goes ahead unlocked, with acquired True and no owner.
+    """
+    try:
+        owner = acquire_lock(tool, version, input_key)
+        return owner is not None, owner
+    except Exception as e:
+        print(f"🚨 Tool lock unavailable for {tool}: {e}")
+        return True, None
+
+
+def _release(tool: str, version: str, input_key: str, owner: str | None) -> None:
+    if owner is None:
+        return
+    try:
+        release_lock(tool, version, input_key, owner)
+    except Exception as e:
+        print(f"🚨 Error releasing the {tool} lock: {e}")
+
+
+class _Flight:
+    """The outcome of a coalesced run, for the caller that ran it and those that joined it."""
+    __slots__ = ("leader", "output", "error", "interrupted")
+
+    def __init__(self, leader, output=None, error=None, interrupted=False):
+        self.leader = leader
+        self.output = output
+        self.error = error
+        self.interrupted = interrupted
+
+
+def _lead(leader, output=None, error=None) -> _Flight:
+    # A run cancelled, or cut short by its deadline, only stands for the caller whose token it ran under
+    return _Flight(leader, output, error, error is not None or cancellation.partial() is not None)
+
+
+def _rejoin(flight: _Flight, caller, tool: str) -> bool:
+    """
+    Whether `caller` has to run again, under its own token, because the run it
+    joined was cancelled or cut short. Raises the cancellation of its own run.
+    """
+    if flight.leader is caller:
+        if flight.error is not None:
+            raise flight.error
+        return False
+    if not flight.interrupted:
+        return False
+    print(f"⏳ {tool}: the run it joined was cancelled or cut short; running it again.")
+    cancellation.check()
+    return True
+
+
+def _params_key(args, kwargs) -> str:
+    return json.dumps([args, kwargs], sort_keys=True, default=str) if args or kwargs else ""
+
+
+def memoize(tool: str, version: str):
+    """
+    Wrap a Tool function taking one input string so a run whose input files
+    have the same contents as a previous run's returns that run's output, as
+    long as the output files it reported are unchanged on disk. Bump `version`
+    whenever the tool's output for the same input changes.
+    Runs are also single-flight: a call arriving while the same tool runs on
+    the same input (in this process or another one on the host) waits for that
+    run and returns its output instead of repeating the work, unless that run
+    was cancelled or stopped at its deadline: then it runs again. Coroutine
+    functions are wrapped as coroutines, with hashing, lookups and locks in a
+    worker thread.
+    """
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            async def run_locked(input_str, input_key, input_hashes, args, kwargs):
+                while True:
+                    acquired, owner = await asyncio.to_thread(_try_lock, tool, version, input_key)
+                    if acquired:
+                        try:
+                            # The run we may have waited for finished just before
+                            cached = await asyncio.to_thread(lookup, tool, version, input_key) if owner else None
+                            if cached is not None:
+                                return cached
+                            output = await func(input_str, *args, **kwargs)
+                            await asyncio.to_thread(_remember_result, tool, version, input_key, input_hashes, output)
+                            return output
+                        finally:
+                            await asyncio.to_thread(_release, tool, version, input_key, owner)
+                    print(f"⏳ {tool}: waiting for another process running it on the same input files...")
+                    while await asyncio.to_thread(lock_held, tool, version, input_key):
+                        await asyncio.sleep(TOOL_LOCK_POLL_SECONDS)
+                    cached = await asyncio.to_thread(lookup, tool, version, input_key)
+                    if cached is not None:
+                        return cached
+
+            @functools.wraps(func)
+            async def async_wrapper(input_str, *args, **kwargs):
+                with tracing.span(f"tool {tool}", version=version) as span:
+                    params = _params_key(args, kwargs)
+                    input_key, input_hashes, cached = await asyncio.to_thread(_cached_result, tool, version, input_str, params)
+                    span.set(cache_hit=cached is not None)
+                    if cached is not None:
+                        print(f"♻️ {tool}: reusing the result of a previous run on the same input files.")
+                        return cached
+                    if not input_key:
+                        return await func(input_str, *args, **kwargs)
+                    caller = object()
+
+                    async def lead():
+                        try:
+                            return _lead(caller, await run_locked(input_str, input_key, input_hashes, args, kwargs))
+                        except cancellation.Cancelled as e:
+                            return _lead(caller, error=e)
+
+                    while True:
+                        if _async_flights.in_flight((tool, version, input_key)):
+                            print(f"⏳ {tool}: joining the run already in progress on the same input files.")
+                            span.set(joined_run=True)
+                        flight = await _async_flights.do((tool, version, input_key), lead)
+                        if not _rejoin(flight, caller, tool):
+                            return flight.output
+            return async_wrapper
+
+        def run_locked(input_str, input_key, input_hashes, args, kwargs):
+            while True:
+                acquired, owner = _try_lock(tool, version, input_key)
+                if acquired:
+                    try:
+                        # The run we may have waited for finished just before
+                        cached = lookup(tool, version, input_key) if owner else None
+                        if cached is not None:
+                            return cached
+                        output = func(input_str, *args, **kwargs)
+                        _remember_result(tool, version, input_key, input_hashes, output)
+                        return output
+                    finally:
+                        _release(tool, version, input_key, owner)
+                print(f"⏳ {tool}: waiting for another process running it on the same input files...")
+                while lock_held(tool, version, input_key):
+                    time.sleep(TOOL_LOCK_POLL_SECONDS)
+                cached = lookup(tool, version, input_key)
+                if cached is not None:
+                    return cached
+
+        @functools.wraps(func)
+        def wrapper(input_str, *args, **kwargs):
+            with tracing.span(f"tool {tool}", version=version) as span:
+                input_key, input_hashes, cached = _cached_result(tool, version, input_str, _params_key(args, kwargs))
+                span.set(cache_hit=cached is not None)
+                if cached is not None:
+                    print(f"♻️ {tool}: reusing the result of a previous run on the same input files.")
+                    return cached
+                if not input_key:
+                    return func(input_str, *args, **kwargs)
+                caller = object()
+
+                def lead():
+                    try:
+                        return _lead(caller, run_locked(input_str, input_key, input_hashes, args, kwargs))
+                    except cancellation.Cancelled as e:
+                        return _lead(caller, error=e)
+
+                while True:
+                    if _flights.in_flight((tool, version, input_key)):
+                        print(f"⏳ {tool}: joining the run already in progress on the same input files.")
+                        span.set(joined_run=True)
+                    flight = _flights.do((tool, version, input_key), lead)
+                    if not _rejoin(flight, caller, tool):
+                        return flight.output
+        return wrapper
+    return decorator
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or invalidate cached tool results.")
+    parser.add_argument("command", choices=["list", "invalidate"])
+    parser.add_argument("--tool", default=None, help="Only results of this tool.")
+    parser.add_argument("--file", default=None, help="Only results of runs that read this file.")
+    args = parser.parse_args()
+
+    if args.command == "invalidate":
+        print(f"Dropped {invalidate(tool=args.tool, path=args.file)} cached tool results.")
+    else:
+        with session() as conn:
+            for row in conn.execute("SELECT tool, version, created_at, output FROM tool_results ORDER BY created_at"):
+                print(f"{row['created_at']}  {row['tool']} v{row['version']}  {row['output'].splitlines()[0]}")
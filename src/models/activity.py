@@ -0,0 +1,163 @@
+import sys
+
+ACTIVITY_FIELDS = ("activity", "concept", "materials", "description", "page")
+
+
+def _intern(value) -> str:
+    return sys.intern(value) if isinstance(value, str) else ("" if value is None else sys.intern(str(value)))
+
+
+def normalize_pages(value) -> tuple:
+    """Return a page field (int, list or None) as a tuple of page numbers."""
+    if value is None:
+        return ()
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    return (value,)
+
+
+class Activity:
+    """
+    One textbook activity.
+    Uses `__slots__` instead of a per-object dict, and interns the concept and
+    material strings, which repeat heavily across a catalog. Keys the model
+    does not know about are kept in `extra` so nothing is lost on a round trip.
+    """
+
+    __slots__ = ("activity", "concept", "materials", "description", "page", "extra")
+
+    def __init__(self, activity: str, concept: str = "", materials=(), description: str = "", page=(), extra: dict | None = None):
+        self.activity = activity if isinstance(activity, str) else str(activity)
+        self.concept = _intern(concept)
+        if isinstance(materials, str):
+            materials = [materials]
+        self.materials = tuple(_intern(m) for m in materials or ())
+        self.description = description if isinstance(description, str) else ("" if description is None else str(description))
+        self.page = normalize_pages(page)
+        self.extra = extra or None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Activity":
+        extra = {k: v for k, v in data.items() if k not in ACTIVITY_FIELDS}
+        return cls(
+            activity=data.get("activity", ""),
+            concept=data.get("concept", ""),
+            materials=data.get("materials", ()),
+            description=data.get("description", ""),
+            page=data.get("page"),
+            extra=extra,
+        )
+
+    def to_dict(self) -> dict:
+        data = {
+            "activity": self.activity,
+            "concept": self.concept,
+            "materials": list(self.materials),
+            "description": self.description,
+            "page": list(self.page),
+        }
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def key(self) -> tuple:
+        """Identity used to line activities up with match records."""
+        return self.activity, self.page
+
+    def __eq__(self, other):
+        if not isinstance(other, Activity):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f"Activity(activity={self.activity!r}, page={list(self.page)!r})"
+
+
+class ActivityBatch:
+    """
+    Columnar (struct-of-arrays) form of a list of activities, for catalog-wide
+    operations such as filtering and deduplication that scan one or two fields.
+    """
+
+    __slots__ = ("activity", "concept", "materials", "description", "page", "extra")
+
+    def __init__(self, activity=None, concept=None, materials=None, description=None, page=None, extra=None):
+        self.activity = activity or []
+        self.concept = concept or []
+        self.materials = materials or []
+        self.description = description or []
+        self.page = page or []
+        self.extra = extra or [None] * len(self.activity)
+
+    @classmethod
+    def from_activities(cls, activities) -> "ActivityBatch":
+        batch = cls()
+        for item in activities:
+            batch.append(item)
+        return batch
+
+    def append(self, item) -> None:
+        if isinstance(item, dict):
+            item = Activity.from_dict(item)
+        self.activity.append(item.activity)
+        self.concept.append(item.concept)
+        self.materials.append(item.materials)
+        self.description.append(item.description)
+        self.page.append(item.page)
+        self.extra.append(item.extra)
+
+    def __len__(self) -> int:
+        return len(self.activity)
+
+    def __getitem__(self, i: int) -> Activity:
+        item = Activity.__new__(Activity)
+        item.activity = self.activity[i]
+        item.concept = self.concept[i]
+        item.materials = self.materials[i]
+        item.description = self.description[i]
+        item.page = self.page[i]
+        item.extra = self.extra[i]
+        return item
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def take(self, indices) -> "ActivityBatch":
+        """Return a new batch with the rows at `indices`, in that order."""
+        indices = list(indices)
+        return ActivityBatch(
+            activity=[self.activity[i] for i in indices],
+            concept=[self.concept[i] for i in indices],
+            materials=[self.materials[i] for i in indices],
+            description=[self.description[i] for i in indices],
+            page=[self.page[i] for i in indices],
+            extra=[self.extra[i] for i in indices],
+        )
+
+    def keys(self):
+        return zip(self.activity, self.page)
+
+    def to_activities(self) -> list:
+        return list(self)
+
+    def to_dicts(self) -> list:
+        return [item.to_dict() for item in self]
+
+
+def activities_from_json(data) -> tuple[list | None, str | None]:
+    """
+    Validate parsed JSON and convert it to a list of Activity objects.
+    Returns (activities, None) on success or (None, error message) on failure.
+    """
+    if data is None:
+        return None, "Error loading JSON data. Please check the file contents."
+    if not isinstance(data, list):
+        return None, "Invalid JSON format. Expected a list of activities."
+    if not all(isinstance(item, dict) for item in data):
+        return None, "Invalid JSON structure. Expected list of objects."
+    return [Activity.from_dict(item) for item in data], None
+
+
+def activities_to_dicts(activities) -> list:
+    """Convert Activity objects (or an ActivityBatch) back to plain dicts for JSON output."""
+    return [item.to_dict() if isinstance(item, Activity) else item for item in activities]
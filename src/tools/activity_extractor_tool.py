@@ -1,26 +1,44 @@
+import asyncio
 import os
+import math
 import fitz  # PyMuPDF 
 import numpy as np
 import json
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 # import faiss # Uncomment if you want to use FAISS for vector store
 from src.tools.clients import openai_client, mistral_client
+from src.tools import llm
+from src.models.activity import activities_from_json, activities_to_dicts
+from src.db import catalog, ocr_cache
+from src.tools.sharded_ocr import extract_text_sharded, timeout_ms, OCR_SHARD_THRESHOLD
+from src.tools.activity_segmenter import SEGMENTER_ENABLED, segment_pdf, describe_segments, adescribe_segments
+from src.utils.prompt_builder import compact_json, compact_text, count_tokens, report_savings
+from src.utils.helper import atomic_write
+from src.utils import artifacts, cancellation, tracing, workspace
+from src.config import model_route
 from pathlib import Path
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Pages with less text than this are taken to be images that need OCR
+MIN_CHARS_PER_PAGE = 50
+# Pages of text sent to the LLM per extraction call
+EXTRACTION_CHUNK_PAGES = 10
+
 def need_ocr(pdf_path: str, pages_to_check: int = 5) -> bool:
     """
     Return True if the first `pages_to_check` pages contain fewer than
     MIN_CHARS_PER_PAGE characters each (likely image‑only).
     """
-    minimum_chars_per_page = 50
     try:
         doc = fitz.open(pdf_path)
         for i in range(min(pages_to_check, len(doc))):
             page = doc[i]
             text = page.get_text("text").strip()
-            if len(text) > minimum_chars_per_page:
+            if len(text) > MIN_CHARS_PER_PAGE:
                 return False
         doc.close()
         print(f"🚨 PDF likely contains images only. OCR is required for {pdf_path}.")
@@ -29,29 +47,46 @@ def need_ocr(pdf_path: str, pages_to_check: int = 5) -> bool:
         print(f"🚨 Error checking PDF for OCR: {e}")
         return False
 
-def get_pdf_signed_url(pdf_path: str) -> str:
+def get_pdf_signed_url(pdf_path: str, doc_sha256: str | None = None) -> str:
     """
     Upload a PDF to Mistral's file store for OCR and return the signed URL.
+    With the file's SHA-256, a still valid signed URL or an earlier upload of
+    the same content is reused instead of uploading again.
     """
     if not os.path.exists(pdf_path):
         print(f"🚨 PDF file not found: {pdf_path}")
         return None
-    
-    print("Uploading PDF to Mistral's file store for OCR...")
-    
-    with open(pdf_path, "rb") as f:
-        uploaded = mistral_client.files.upload(
-            file={
-                "file_name": os.path.basename(pdf_path),
-                "content": f,
-            },
-            purpose="ocr"
-        )
-    if not uploaded:
-        print("🚨 Failed to upload PDF to Mistral's file store.")
-        return None
-    
-    url = mistral_client.files.get_signed_url(file_id=uploaded.id).url
+
+    file_id = None
+    if doc_sha256:
+        file_id, url = ocr_cache.cached_upload(doc_sha256)
+        if url:
+            print("♻️ Reusing cached signed URL for this PDF.")
+            return url
+
+    if file_id:
+        print("♻️ PDF already uploaded to Mistral's file store, requesting a new signed URL...")
+    else:
+        print("Uploading PDF to Mistral's file store for OCR...")
+
+        with open(pdf_path, "rb") as f, tracing.span("mistral.upload", bytes=os.path.getsize(pdf_path)):
+            uploaded = mistral_client.files.upload(
+                file={
+                    "file_name": os.path.basename(pdf_path),
+                    "content": f,
+                },
+                purpose="ocr",
+                timeout_ms=timeout_ms(),
+            )
+        if not uploaded:
+            print("🚨 Failed to upload PDF to Mistral's file store.")
+            return None
+        file_id = uploaded.id
+
+    url = mistral_client.files.get_signed_url(file_id=file_id, expiry=ocr_cache.SIGNED_URL_EXPIRY_HOURS,
+                                              timeout_ms=timeout_ms()).url
+    if doc_sha256:
+        ocr_cache.remember_upload(doc_sha256, os.path.basename(pdf_path), file_id, url)
     print(f"🚀 PDF uploaded successfully. Signed URL: {url}")
     return url
 
@@ -68,10 +103,14 @@ def extract_text_with_mistral(url: str) -> dict:
             print("🚨 No URL provided for Mistral OCR.")
             return {}
         
-        ocr_response = mistral_client.ocr.process(
-            model="mistral-ocr-latest",
-            document={"type": "document_url", "document_url": url}
-        )
+        cancellation.check()
+        with tracing.span("mistral.ocr") as span:
+            ocr_response = mistral_client.ocr.process(
+                model="mistral-ocr-latest",
+                document={"type": "document_url", "document_url": url},
+                timeout_ms=timeout_ms(),
+            )
+            span.record_usage(ocr_response)
 
         if not hasattr(ocr_response, 'pages') or not ocr_response.pages:
             print("🚨 OCR response has no 'pages' attribute or it's empty.")
@@ -94,12 +133,46 @@ def extract_text_with_mistral(url: str) -> dict:
         print(f"🚨 Error using Mistral AI OCR: {str(e)}")
         return {}
 
+def extract_text_with_ocr(pdf_path: str) -> dict:
+    """
+    OCR a scanned PDF with Mistral AI, going through the OCR cache: a file (or
+    set of pages) seen before is returned without uploading or running OCR.
+    Long scans are OCR'd as concurrent page-range shards, skipping cached pages.
+    """
+    doc_sha256 = ocr_cache.file_sha256(pdf_path)
+    hashes = ocr_cache.page_hashes(pdf_path)
+
+    with tracing.span("ocr_cache.lookup", pages=len(hashes)) as span:
+        cached = ocr_cache.cached_pages(doc_sha256, hashes)
+        span.set(cache_hit=bool(cached))
+    if cached:
+        print(f"♻️ OCR cache hit: {len(cached)} pages for {os.path.basename(pdf_path)}.")
+        return cached
+
+    if len(hashes) > OCR_SHARD_THRESHOLD:
+        known = ocr_cache.cached_pages_by_hash(hashes)
+        pages = {**known, **extract_text_sharded(pdf_path, skip_pages=set(known))}
+        if len(pages) == len(hashes):
+            ocr_cache.store_pages(doc_sha256, os.path.basename(pdf_path), pages, hashes)
+        return dict(sorted(pages.items()))
+
+    doc_url = get_pdf_signed_url(pdf_path, doc_sha256)
+    if not doc_url:
+        print("🚨 Failed to get signed URL for OCR processing.")
+        return {}
+
+    pages = extract_text_with_mistral(doc_url)
+    if pages:
+        ocr_cache.store_pages(doc_sha256, os.path.basename(pdf_path), pages, hashes)
+    return pages
+
 def extract_text_with_pymupdf(pdf_path: str) -> dict:
     """Extract text from a text-based PDF using PyMuPDF, using sequential page numbers."""
     pages = {}
     try:
         doc = fitz.open(pdf_path)
         for i, page in enumerate(doc):
+            cancellation.check()
             text = page.get_text("text").strip()
             page_number = i + 1
             pages[page_number] = text if text else ""
@@ -110,6 +183,16 @@ def extract_text_with_pymupdf(pdf_path: str) -> dict:
         print(f"🚨 Error using PyMuPDF: {str(e)}")
         return {}
 
+def iter_pages_with_pymupdf(pdf_path: str):
+    """Lazily yield (page_number, text) from a text-based PDF, one page at a time."""
+    doc = fitz.open(pdf_path)
+    try:
+        for i, page in enumerate(doc):
+            text = page.get_text("text").strip()
+            yield i + 1, text if text else ""
+    finally:
+        doc.close()
+
 def get_embedding(text):
     """Generate OpenAI embedding for a given text."""
     if not openai_client:
@@ -147,87 +230,221 @@ def build_vector_store(pages):
     
     return index, text_data
 
+EXTRACTION_EXAMPLE = compact_json([{
+    "activity": "Activity 4.1: Let us explore",
+    "concept": "Magnetic and Non-Magnetic Materials",
+    "materials": ["Magnet", "Various objects"],
+    "description": "Step-by-step process to perform the activity",
+    "page": [41],
+}])
+# Bump when the extractor's output for the same PDF changes (invalidates memoized results);
+# changing the extractor's models (see src/config.py) does too
+EXTRACTOR_VERSION = f"3-{model_route('extractor').key}"
+# Numbered activity headings, e.g. "Activity 4.1", for the coverage check of a chunk's answer
+ACTIVITY_HEADING_RE = re.compile(r"\bactivity\s+(\d+\.\d+)", re.IGNORECASE)
+
+def extraction_prompt(text: str, page_numbers: list) -> str:
+    """The prompt asking GPT for the activities in a chunk of page-marked text."""
+    return f"""You are analyzing a school textbook to extract class activities that students can perform in a live classroom to understand a concept.
+Activities are marked by keywords like "Activity", "Let us do", "Let us perform", "Let us explore", "Think like a scientist", "Activity 1.1", "Activity 2.1".
+The text has page markers 'Page X:'; use them for the exact page(s) of each activity (pages in this text: {page_numbers}).
+For each activity return: activity name, concept taught, materials required, a short description of how to perform it, and its page numbers.
+Return ONLY valid JSON, no explanations, e.g.:
+{EXTRACTION_EXAMPLE}
+
+Text:
+\"\"\"{text}\"\"\"
+"""
+
+def build_extraction_prompt(text: str, page_numbers: list) -> list:
+    """Chat messages asking GPT for the activities in a chunk of pages; reports the prompt size."""
+    prompt = extraction_prompt(text, page_numbers)
+    report_savings(
+        f"Pages {page_numbers[0]}-{page_numbers[-1]}" if page_numbers else "Chunk",
+        prompt,
+        lambda: count_tokens(extraction_prompt("", page_numbers)) + count_tokens(text),
+    )
+    return [{"role": "system", "content": "Extract structured details from textbook activities."},
+            {"role": "user", "content": prompt}]
+
+def parse_activity_details(content: str, page_numbers: list, strict: bool = False) -> list:
+    """
+    Activity objects from GPT's JSON answer for a chunk of pages. An answer that
+    is not a valid activity list gives [], or raises ValueError with `strict`.
+    """
+    try:
+        result = json.loads(content)
+        # print(f"GPT-4 response for page numbers {page_numbers}: {result}")  # Debug
+        activities, error = activities_from_json(result)
+        if error:
+            if strict:
+                raise ValueError(error)
+            print(f"Unexpected response for page numbers {page_numbers}: {error}")
+            return []
+        # Ensure page field matches the provided list or subset
+        for activity in activities:
+            if not activity.page:
+                activity.page = tuple(page_numbers)
+        return activities
+    except (json.JSONDecodeError, TypeError) as e:
+        if strict:
+            raise ValueError(f"invalid JSON: {e}") from e
+        print(f"JSON decode error for page numbers {page_numbers}: {e}")
+        return []
+
+def activity_coverage(text: str, activities: list) -> float:
+    """Share of the numbered activity headings in a chunk's text that the answer returned activities for."""
+    expected = set(ACTIVITY_HEADING_RE.findall(text))
+    if not expected:
+        return 1.0
+    return min(1.0, len(activities) / len(expected))
+
 def extract_activity_details(text:str, page_numbers:list) -> list:
-    """Use GPT to extract structured activity details from a chunk of pages."""
-    prompt = f"""
-    You are analyzing a school textbook to extract class activities which could be performed in the ongoing class.
-
-    Activity should be like a student can perform it in the live classroom by which some concepts could be understood.
-
-    Search the keywords like: 
-    "Activity", "Let us do", "Let us perform", "Let us explore", "Think like a scientist", "Activity 1.1", "Activity 2.1" etc.
-
-    These all keywords are used to identify the activities in the text.
-    The text includes page markers in the format 'Page X:' where X is the page number. Use these markers to determine the exact page(s) where each activity appears.
-
-    For each activity, identify:
-    1. **Activity Name**
-    2. **Concept being taught**
-    3. **Materials required**
-    4. **Short description of how to perform the activity**
-    5. **Page number(s)** (provided as a list of page numbers: {page_numbers})
-    💡 **Example Output Format (JSON), return valid JSON only**:
-    [
-        {{
-            "activity": "Activity 4.1: Let us explore",
-            "concept": "Magnetic and Non-Magnetic Materials",
-            "materials": ["Magnet", "Various objects"], 
-            "description": "Step-by-step process to perform the activity",
-            "page": [41]
-        }}
-    ]
-
-    Output should only be JSON and no any other explanations.
-
-    Extract relevant details from the following text:
-    \"\"\"{text}\"\"\"
     """
+    Use GPT to extract structured activity details from a chunk of pages, as Activity objects.
+    The extractor's fast model answers first; its answer is re-asked of the stronger
+    model if it does not parse or misses too many of the chunk's numbered activities.
+    """
+    messages = build_extraction_prompt(text, page_numbers)
 
     if not openai_client:
         print("🚨 OpenAI client not initialized. Check your API key.")
         return []
 
-    response = openai_client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "system", "content": "Extract structured details from textbook activities."},
-                  {"role": "user", "content": prompt}],
-        temperature=0
-    )
     try:
-        result = json.loads(response.choices[0].message.content)
-        # print(f"GPT-4 response for page numbers {page_numbers}: {result}")  # Debug
-        # Ensure page field matches the provided list or subset
-        for activity in result:
-            if "page" not in activity or activity["page"] is None:
-                activity["page"] = page_numbers
-        return result
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error for page numbers {page_numbers}: {e}")
+        return llm.chat(
+            "extractor", messages,
+            parse=lambda content: parse_activity_details(content, page_numbers, strict=True),
+            coverage=lambda activities: activity_coverage(text, activities),
+        )
+    except ValueError as e:
+        print(f"Unexpected response for page numbers {page_numbers}: {e}")
         return []
 
+async def aextract_activity_details(text: str, page_numbers: list) -> list:
+    """Async counterpart of `extract_activity_details`, using the async OpenAI client."""
+    messages = build_extraction_prompt(text, page_numbers)
+    try:
+        return await llm.achat(
+            "extractor", messages,
+            parse=lambda content: parse_activity_details(content, page_numbers, strict=True),
+            coverage=lambda activities: activity_coverage(text, activities),
+        )
+    except ValueError as e:
+        print(f"Unexpected response for page numbers {page_numbers}: {e}")
+        return []
+
+ACTIVITY_KEYWORDS = ["activity", "let us do", "let us perform", "let us explore",
+                     "think like a scientist", "activity 1.1", "activity 2.1"]
+
+def has_activity_keywords(text: str) -> bool:
+    text = text.lower()
+    return any(keyword in text for keyword in ACTIVITY_KEYWORDS)
+
+def marked_text(chunk: list) -> tuple[str, list]:
+    """Text of a chunk with 'Page X:' markers added, and its page numbers."""
+    text = "\n\n".join([f"Page {item['page']}: {compact_text(item['text'])}" for item in chunk])
+    return text, [item["page"] for item in chunk]
+
+def mark_chunk(chunk: list) -> tuple[str, list] | None:
+    """Page-marked text and page numbers of a chunk, or None if it has no activity keywords."""
+    text, page_numbers = marked_text(chunk)
+
+    print(f"Processing chunk for page numbers {page_numbers}")
+    # Check for activity keywords in the chunk
+    if has_activity_keywords(text):
+        return text, page_numbers
+    return None
+
+def process_chunk(chunk: list) -> list:
+    """Extract activities from one chunk of {"page", "text"} items."""
+    cancellation.check()
+    with tracing.span("chunk", pages=f"{chunk[0]['page']}-{chunk[-1]['page']}") as span:
+        marked = mark_chunk(chunk)
+        span.set(skipped=marked is None)
+        return extract_activity_details(*marked) if marked else []
+
+async def aprocess_chunk(chunk: list) -> list:
+    """Async counterpart of `process_chunk`."""
+    cancellation.check()
+    with tracing.span("chunk", pages=f"{chunk[0]['page']}-{chunk[-1]['page']}") as span:
+        marked = mark_chunk(chunk)
+        span.set(skipped=marked is None)
+        return await aextract_activity_details(*marked) if marked else []
+
 def search_activity(index, text_data) -> list:
-    """Search for activities in chunks of 10 pages."""
+    """Search for activities in chunks of EXTRACTION_CHUNK_PAGES pages, up to the request's deadline."""
     results = []
-    chunk_size = 10
+    chunk_size = EXTRACTION_CHUNK_PAGES
     for i in range(0, len(text_data), chunk_size):
         end_idx = min(i + chunk_size, len(text_data))
-        chunk = text_data[i:end_idx]
-        
-        # Add page markers to the text
-        marked_text = "\n\n".join([f"Page {item['page']}: {item['text']}" for item in chunk])
-        # Get list of page numbers for the chunk
-        page_numbers = [item["page"] for item in chunk]
-        
-        print(f"Processing chunk for page numbers {page_numbers}")
-        # Check for activity keywords in the chunk
-        activity_keywords = ["activity", "let us do", "let us perform", "let us explore", 
-                           "think like a scientist", "activity 1.1", "activity 2.1"]
-        if any(keyword in marked_text.lower() for keyword in activity_keywords):
-            activity_details = extract_activity_details(marked_text, page_numbers)
-            results.extend(activity_details)
+        try:
+            results.extend(process_chunk(text_data[i:end_idx]))
+        except cancellation.DeadlineExceeded:
+            cancellation.stop_at_deadline("extractor", i // chunk_size, math.ceil(len(text_data) / chunk_size))
+            break
     
     return results
 
+async def asearch_activity(text_data, chunk_size: int = EXTRACTION_CHUNK_PAGES, max_concurrency: int | None = None) -> list:
+    """
+    Async counterpart of `search_activity`: up to `max_concurrency` chunks (by
+    default the extractor's configured concurrency) are awaited on the LLM at
+    once, and results keep page order.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or model_route("extractor").concurrency)
+
+    async def run(chunk):
+        async with semaphore:
+            try:
+                return await aprocess_chunk(chunk)
+            except cancellation.DeadlineExceeded:
+                return None
+
+    chunks = [text_data[i:i + chunk_size] for i in range(0, len(text_data), chunk_size)]
+    done = [activities for activities in await asyncio.gather(*(run(chunk) for chunk in chunks)) if activities is not None]
+    if len(done) < len(chunks):
+        cancellation.stop_at_deadline("extractor", len(done), len(chunks))
+    return [activity for activities in done for activity in activities]
+
+def iter_page_chunks(pages, chunk_size: int = EXTRACTION_CHUNK_PAGES):
+    """Group an iterable of (page_number, text) pairs into chunks of `chunk_size` pages."""
+    chunk = []
+    for page_number, text in pages:
+        chunk.append({"page": page_number, "text": text})
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def iter_activities(pages, chunk_size: int = EXTRACTION_CHUNK_PAGES, max_workers: int | None = None):
+    """
+    Streaming counterpart of `search_activity`.
+    Yields activities chunk by chunk, in page order, while up to `max_workers`
+    chunks (by default the extractor's configured concurrency) are being sent to
+    the LLM in the background. Only those in-flight chunks are held in memory.
+    At the request's deadline the chunks not yet extracted are dropped.
+    """
+    max_workers = max_workers or model_route("extractor").concurrency
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        done = 0
+        try:
+            for chunk in iter_page_chunks(pages, chunk_size):
+                cancellation.check()
+                pending.append(executor.submit(tracing.bind(process_chunk), chunk))
+                while len(pending) >= max_workers:
+                    yield from pending.popleft().result()
+                    done += 1
+            while pending:
+                yield from pending.popleft().result()
+                done += 1
+        except cancellation.DeadlineExceeded:
+            for future in pending:
+                future.cancel()
+            cancellation.stop_at_deadline("extractor", done)
+
 def save_results_to_json(results: list, file_name: str = "activities.json", output_dir: str = r"D:\Python\LangChain-Tutorial\Activity_agent\output") -> str:
     """Save results to JSON."""
     output_dir = Path(output_dir)
@@ -239,53 +456,63 @@ def save_results_to_json(results: list, file_name: str = "activities.json", outp
 
     out_path = output_dir / file_name
 
-    with out_path.open("w", encoding="utf-8") as f:
-        json.dump(results, f, indent=4, ensure_ascii=False)
+    with atomic_write(out_path) as f:
+        json.dump(activities_to_dicts(results), f, indent=4, ensure_ascii=False)
     
-    return f"Results saved to {out_path}"
+    return artifacts.saved("Results", out_path, results)
 
-def extract_activities_from_pdf(pdf_path: str = None) -> str:
+def record_in_catalog(pdf_path: str, activities: list, out_path, pages=None) -> int | None:
     """
-    Extract activities from a PDF file and save them to a JSON file.    
+    Store a textbook, its pages and its extracted activities in the catalog and
+    register the JSON output as its 'activities' export. Returns the textbook id.
+    """
+    try:
+        with catalog.session() as conn:
+            textbook_id = catalog.register_textbook(conn, pdf_path)
+            if pages:
+                catalog.store_pages(conn, textbook_id, pages)
+            catalog.store_activities(conn, textbook_id, activities)
+            catalog.record_export(conn, out_path, textbook_id, "activities")
+        return textbook_id
+    except Exception as e:
+        print(f"🚨 Error recording activities in the catalog: {e}")
+        return None
+
+def load_pdf_pages(pdf_path: str | None) -> tuple[dict | None, str | None]:
+    """
+    Check the PDF path and extract its pages, with OCR if the PDF is image-based.
+    Returns ({page_number: text}, None), or (None, error message).
     """
     if pdf_path is None:
         print("🚨 No PDF path provided.")
-        return "Please provide a valid PDF file path."
+        return None, "Please provide a valid PDF file path."
     
     if not os.path.exists(pdf_path):
         print(f"🚨 PDF file not found: {pdf_path}")
-        return "Pdf file not found at the specified path."
+        return None, "Pdf file not found at the specified path."
 
     if not pdf_path.lower().endswith('.pdf'):
         print(f"🚨 Invalid file type: {pdf_path}. Only PDF files are supported.")
-        return "Invalid file type. Only PDF files are supported."
+        return None, "Invalid file type. Only PDF files are supported."
 
-    # Check if OCR is needed based on the PDF content
-    use_ocr = need_ocr(pdf_path)
+    with tracing.span("load_pdf") as span:
+        # Check if OCR is needed based on the PDF content
+        use_ocr = need_ocr(pdf_path)
 
-    if use_ocr:
-        doc_url = get_pdf_signed_url(pdf_path)
-        if not doc_url:
-            print("🚨 Failed to get signed URL for OCR processing.")
-            return "Failed to get signed URL for OCR processing."
+        if use_ocr:
+            pages = extract_text_with_ocr(pdf_path)
         else:
-            pages = extract_text_with_mistral(doc_url)
-            output_dir = Path(r"D:\Python\LangChain-Tutorial\Activity_agent\output")
-            file_name = "activities.json"
-    else:
-        pages = extract_text_with_pymupdf(pdf_path)
+            pages = extract_text_with_pymupdf(pdf_path)
+        span.set(method="ocr" if use_ocr else "pymupdf", pages=len(pages))
 
     if not pages:
         print("🚨 No pages extracted from the PDF.")
-        return "No pages extracted from the PDF."
-    
-    index, text_data = build_vector_store(pages)
-    if text_data is None:
-        print("🚨 Failed to build vector store.")
-        return "Failed to build vector store."
-    
-    activities = search_activity(index, text_data)
-    output_dir = Path(pdf_path).resolve().parent
+        return None, "No pages extracted from the PDF."
+    return pages, None
+
+def save_extracted_activities(pdf_path: str, pages: dict, activities: list) -> str:
+    """Save the activities as <name>_activities.json in the run's workspace and record them in the catalog."""
+    output_dir = workspace.current_dir()
     file_name = Path(pdf_path).stem + "_activities.json"
 
     if not activities:
@@ -294,8 +521,55 @@ def extract_activities_from_pdf(pdf_path: str = None) -> str:
     else:
         print(f"Found {len(activities)} activities in the PDF.")
         save_results = save_results_to_json(activities, file_name, output_dir)
+        record_in_catalog(pdf_path, activities, Path(output_dir) / file_name, pages)
         print(save_results)
         return save_results
+
+def extract_activities_from_pdf(pdf_path: str = None) -> str:
+    """
+    Extract activities from a PDF file and save them to a JSON file.    
+    """
+    pages, error = load_pdf_pages(pdf_path)
+    if error:
+        return error
+
+    # Well-typeset books are cut into activities locally; only those are sent to the LLM
+    segments = segment_pdf(pdf_path) if SEGMENTER_ENABLED else []
+    if segments:
+        print(f"Found {len(segments)} activity headings in the PDF's layout; describing them with the LLM.")
+        activities = describe_segments(segments, pages)
+        return save_extracted_activities(pdf_path, pages, activities)
+
+    index, text_data = build_vector_store(pages)
+    if text_data is None:
+        print("🚨 Failed to build vector store.")
+        return "Failed to build vector store."
+    
+    activities = search_activity(index, text_data)
+    return save_extracted_activities(pdf_path, pages, activities)
+
+async def aextract_activities_from_pdf(pdf_path: str = None) -> str:
+    """
+    Async counterpart of `extract_activities_from_pdf`. PDF reading, OCR and
+    saving run in a worker thread; the per-chunk LLM calls are awaited concurrently.
+    """
+    pages, error = await asyncio.to_thread(load_pdf_pages, pdf_path)
+    if error:
+        return error
+
+    segments = await asyncio.to_thread(segment_pdf, pdf_path) if SEGMENTER_ENABLED else []
+    if segments:
+        print(f"Found {len(segments)} activity headings in the PDF's layout; describing them with the LLM.")
+        activities = await adescribe_segments(segments, pages)
+        return await asyncio.to_thread(save_extracted_activities, pdf_path, pages, activities)
+
+    index, text_data = build_vector_store(pages)
+    if text_data is None:
+        print("🚨 Failed to build vector store.")
+        return "Failed to build vector store."
+
+    activities = await asearch_activity(text_data)
+    return await asyncio.to_thread(save_extracted_activities, pdf_path, pages, activities)
     
 if __name__ == "__main__":
     pdf_path = r"C:\Users\LPT029\Downloads\CLS_7.pdf"
@@ -1,7 +1,23 @@
 import json
 import os
-from pathlib import Path
 from src.utils.helper import parse_json_file
+from src.models.activity import ActivityBatch, activities_to_dicts, normalize_pages
+from src.db import catalog
+from src.utils.helper import atomic_write
+from src.utils import artifacts, workspace
+
+# Bump when the filter's output for the same input files changes (invalidates memoized results)
+FILTER_VERSION = "1"
+
+def filter_unmatched(activities, match_data: list) -> list:
+    """
+    Return the activities that have no entry in `match_data`.
+    Works on a whole catalog or on a single streamed batch and its matches.
+    """
+    matched = {(entry.get('json1_activity'), normalize_pages(entry.get('page'))) for entry in match_data}
+    batch = activities if isinstance(activities, ActivityBatch) else ActivityBatch.from_activities(activities)
+    keep = [i for i, key in enumerate(batch.keys()) if key not in matched]
+    return batch.take(keep).to_activities()
 
 def activity_filter(master_json_path: str, match_json_path: str) -> str:
     """
@@ -23,44 +39,48 @@ def activity_filter(master_json_path: str, match_json_path: str) -> str:
     if not os.path.isfile(match_json_path):
         return f"Match JSON file not found: {match_json_path}"
     
-    # Load the master and match JSON files
-    with open(master_json_path, "r") as f:
-        master_data = json.load(f)
-    
-    with open(match_json_path, "r") as f:
-        match_data = json.load(f)
+    # Load the master and match JSON files; outputs of earlier tools in this process come from memory
+    master_activities, error = artifacts.load_activities(master_json_path, required=("activity", "page"))
+    if error:
+        return error
+
+    match_data = artifacts.load_json(match_json_path)
     
-    # Check if the JSON data is in the expected format
-    if master_data is None or match_data is None:
+    if match_data is None:
         return "Error loading JSON data. Please check the file contents."
     
-    if not isinstance(master_data, list) or not isinstance(match_data, list):
+    if not isinstance(match_data, list):
         return "Invalid JSON format. Expected a list of activities."
     
-    if not all(isinstance(item, dict) for item in master_data) or not all(isinstance(item, dict) for item in match_data):
+    if not all(isinstance(item, dict) for item in match_data):
         return "Invalid JSON structure. Expected list of objects."
 
-    if "activity" not in master_data[0] or "page" not in master_data[0]:
-        return "Invalid JSON structure. Expected 'activity' and 'page' keys in the objects."
+    file_name = os.path.basename(master_json_path).replace(".json", "_filtered.json")
+    output_path = str(workspace.output_path(file_name))
 
-    filtered_data = [
-        item for item in master_data
-        if not any(item['page'] == entry['page'] and item['activity'] == entry['json1_activity'] for entry in match_data)
-    ]
+    # Catalogued master: load the matches into the indexed table and export the anti-join
+    textbook_id = catalog.find_textbook(master_json_path)
+    if textbook_id is not None:
+        try:
+            with catalog.session() as conn:
+                catalog.import_matches(conn, textbook_id, match_data)
+                catalog.export_view(conn, textbook_id, "filtered", output_path)
+        except Exception as e:
+            print(f"Error saving filtered activities: {e}")
+            return f"Error saving filtered activities: {e}"
+        return artifacts.saved("Filtered activities", output_path)
 
-    output_dir = Path(master_json_path).parent.resolve()
-    file_name = os.path.basename(master_json_path).replace(".json", "_filtered.json")
-    output_path = os.path.join(output_dir, file_name)
+    filtered_data = filter_unmatched(master_activities, match_data)
 
     try:
         # Save final results to a JSON file
-        with open(output_path, "w") as outfile:
-            json.dump(filtered_data, outfile, indent=2)
+        with atomic_write(output_path) as outfile:
+            json.dump(activities_to_dicts(filtered_data), outfile, indent=2)
     except Exception as e:
         print(f"Error saving filtered activities: {e}")
         return f"Error saving filtered activities: {e}"
     
-    return f"Filtered activities saved to {output_path}"
+    return artifacts.saved("Filtered activities", output_path, filtered_data)
 
 # Wrapper function to parse input string and call the activity_filter function
 def activity_filter_wrapper(input_str: str) -> str:
@@ -1,125 +1,228 @@
-from src.tools.clients import openai_client
+from src.tools import llm
+from src.config import model_route
+from src.utils.dedup import collapse_near_duplicates
+from src.utils.clustering import coherence, concept_groups
+from src.models.activity import activities_from_json, activities_to_dicts
+from src.db import catalog
+from src.utils.helper import atomic_write
+from src.utils import artifacts, cancellation, workspace
+from src.utils.prompt_builder import compact_json, count_tokens, project, report_savings
+import asyncio
 import json
 import os
-from pathlib import Path
 import math
 
+# Fields the generator needs from every activity
+GENERATOR_FIELDS = ("activity", "concept", "materials", "description", "page")
+# Activities are batched by related concept, at most GENERATOR_BATCH_SIZE per LLM call, and
+# each call returns up to ACTIVITIES_PER_CALL new ones (see the prompt). With a target count
+# (GENERATOR_TARGET_COUNT, 0 for no target) only the most coherent batches needed to reach
+# it are sent
+GENERATOR_BATCH_SIZE = int(os.getenv("GENERATOR_BATCH_SIZE", "20"))
+GENERATOR_MIN_BATCH_SIZE = 3
+ACTIVITIES_PER_CALL = 4
+GENERATOR_TARGET_COUNT = int(os.getenv("GENERATOR_TARGET_COUNT", "0"))
+# Bump when the generator's output for the same input file changes (invalidates memoized results);
+# changing the generator's models (see src/config.py) or batching does too
+GENERATOR_VERSION = (f"3-{model_route('generator').key}"
+                     f"-b{GENERATOR_BATCH_SIZE}" + (f"-t{GENERATOR_TARGET_COUNT}" if GENERATOR_TARGET_COUNT else ""))
+
 def build_prompt(json_chunk):
-        return f"""
-    You are a Hands on Activity maker expert means which can be performed in the live class so for the school students.
-
-    You are given one json:
-    It contains a list of activity objects with fields like "activity", "concept", "materials", "description", and "page".
-
-    ----
-    Your task:
-    You have to generate new activities based on activities provided in JSON Chunk (It could be the combination of two or more activities).
-    Output format should be same as the json but pageNo will be all page numbers which you are combining (like page : [1,2,3])
-
-    While creating new activity you have to make sure following criteria.
-
-    - The activity should be Hands-on activities
-    - Strand coverage – try to include at least one activity from each strand, if possible
-    - Ensure the activity can be conducted safely in class.
-    - Concepts should have some depth.
-    - Material accessibility, It should be of low cost and easily available.
-    - Must include as much skills coverage as possible
-    - Transdisciplinary coverage is a plus.
-    - Description should be well defined keeping in mind that the user who is seeing output of this does not have parent json.
-    - Avoid the activities which includes pen, paper or drawing posters, banners, etc..
-
-    ⚠️ Rules:
-    - The output must be **strictly valid JSON**.
-    - Do NOT return any explanations, comments, or code. Only return a JSON array.
-    - Do NOT wrap the result in markdown or triple backticks.
-    - Include only four or less than four best activities.
-
-    *** You are free to create new activities based on the activities provided in JSON Chunk. Add extra materials if needed. But make sure that the new activity is not too long and can be performed in a single class.***
-    *** Activities created should be able to judge the concepts of students like engage, explore, explain and extend ***
-
-    JSON Chunk:
-    {json.dumps(json_chunk, indent=2)}
+    return f"""You are an expert in hands-on activities that school students can perform in a live class.
+The JSON chunk below lists activities ("activity", "concept", "materials", "description", "page").
+Create new activities based on them (a new activity may combine two or more). Use the same format; "page" lists all combined pages (e.g. [1,2,3]).
+Criteria:
+- Hands-on, and safe to conduct in class.
+- Strand coverage: include at least one activity from each strand if possible.
+- Concepts with some depth; as much skills coverage as possible; transdisciplinary coverage is a plus.
+- Low-cost, easily available materials; extra materials may be added.
+- Short enough for a single class, and able to assess students' concepts (engage, explore, explain, extend).
+- Self-contained descriptions: the reader does not have the source JSON.
+- Avoid pen-and-paper tasks or drawing posters, banners, etc.
+Return ONLY a strictly valid JSON array of at most four of the best activities. No explanations, no markdown.
+
+JSON chunk:
+{compact_json(json_chunk)}"""
+
+def load_generator_input(filtered_master_json_path: str) -> tuple[list | None, str | None]:
     """
-
-def generate_activities(filtered_master_json_path:str) -> str:
-    """
-    Generate activities from the filtered master JSON file using OpenAI's API.
-
-    Args:
-        filtered_master_json_path (str): Path to the filtered master JSON file.
-
-    Returns:
-        str: Path to the generated activities JSON file.
+    Validate and load the filtered master JSON (path or artifact id), collapsing repeated experiments.
+    Returns (activities, None) or (None, error message).
     """
     # Check if the provided path is a valid JSON file
     if not filtered_master_json_path.endswith('.json'):
-        return "Invalid input. Please provide a valid JSON file path."
+        return None, "Invalid input. Please provide a valid JSON file path."
     
     # Check if the file exists
     if not os.path.isfile(filtered_master_json_path):
-        return f"Filtered master JSON file not found: {filtered_master_json_path}"
+        return None, f"Filtered master JSON file not found: {filtered_master_json_path}"
 
-    # Load the filtered master JSON file
-    with open(filtered_master_json_path, "r") as f:
-        filered_json = json.load(f)
-
-    # Check if the JSON data is in the expected format
-    if filered_json is None:
-        return "Error loading JSON data. Please check the file contents."
-    
-    if not isinstance(filered_json, list):
-        return "Invalid JSON format. Expected a list of activities."
-    
-    if not all(isinstance(item, dict) for item in filered_json):
-        return "Invalid JSON structure. Expected list of objects."
+    # Load the filtered master JSON file (from memory if an earlier tool in this process wrote it)
+    # and check that the JSON data is in the expected format
+    filered_json, error = artifacts.load_activities(filtered_master_json_path)
+    if error:
+        return None, error
     
-    batch_size = 20
-    all_activities = []
-
-    # Process the JSON data in chunks
-    for i in range(0, len(filered_json), batch_size):
-        json_chunk = filered_json[i:i + batch_size]
-        prompt = build_prompt(json_chunk)
-        
-        print(f"Sending chunk {i // batch_size + 1}/{math.ceil(len(filered_json) / batch_size)}")
-        try:
-            response = openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "Combining activities create a new activity"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0
-            )
-
-            chunk_result_raw = response.choices[0].message.content
-
-            try:
-                chunk_matches = json.loads(chunk_result_raw)
-                all_activities.extend(chunk_matches)
-            except json.JSONDecodeError:
-                print(f"Failed to parse chunk {i // batch_size + 1}:")
-                print(chunk_result_raw)
-                continue
-        except Exception as e:
-            print(f"Error in chunk {i // batch_size + 1}: {e}")
-            continue
+    # Collapse repeated experiments before they are sent to the LLM
+    return collapse_near_duplicates(filered_json), None
+
+def build_chunk_messages(json_chunk: list, chunk_number: int) -> list:
+    """Chat messages asking for new activities based on one chunk; reports the prompt size."""
+    prompt = build_prompt(project(json_chunk, GENERATOR_FIELDS))
+    report_savings(
+        f"Chunk {chunk_number}",
+        prompt,
+        lambda: count_tokens(build_prompt([])) + count_tokens(json.dumps(activities_to_dicts(json_chunk), indent=2)),
+    )
+    return [
+        {"role": "system", "content": "Combining activities create a new activity"},
+        {"role": "user", "content": prompt}
+    ]
+
+def parse_generated(chunk_result_raw: str, chunk_number: int, strict: bool = False) -> list:
+    """
+    Activity objects from the LLM's answer for one chunk; empty if it is not a
+    valid activity list, or ValueError with `strict`.
+    """
+    try:
+        chunk_matches, error = activities_from_json(json.loads(chunk_result_raw))
+        if error:
+            if strict:
+                raise ValueError(error)
+            print(f"Unexpected response for chunk {chunk_number}: {error}")
+            return []
+        return chunk_matches
+    except (json.JSONDecodeError, TypeError) as e:
+        if strict:
+            raise ValueError(f"invalid JSON: {e}") from e
+        print(f"Failed to parse chunk {chunk_number}:")
+        print(chunk_result_raw)
+        return []
+
+def plan_batches(activities: list, target_count: int | None = None) -> list:
+    """
+    Batches of related activities to send to the LLM, in book order. Without a
+    target every activity is sent; with one, only the most coherent batches
+    needed for `target_count` new activities (ACTIVITIES_PER_CALL per call).
+    """
+    groups, vectors = concept_groups(activities, GENERATOR_BATCH_SIZE, GENERATOR_MIN_BATCH_SIZE)
+    if target_count:
+        needed = math.ceil(target_count / ACTIVITIES_PER_CALL)
+        if needed < len(groups):
+            ranked = sorted(groups, key=lambda group: (coherence(vectors, group), len(group)), reverse=True)
+            kept = {id(group) for group in ranked[:needed]}
+            print(f"Sending {needed} of {len(groups)} batches for a target of {target_count} activities")
+            groups = [group for group in groups if id(group) in kept]
+    return [[activities[i] for i in group] for group in groups]
+
+def save_generated_activities(filtered_master_json_path: str, all_activities: list,
+                              target_count: int | None = None) -> str:
+    """
+    Save generated activities (at most `target_count`) as new_activities.json in
+    the run's workspace and record them in the catalog.
+    """
+    # Different batches often come back with near-identical activities
+    all_activities = collapse_near_duplicates(all_activities)
+    if target_count:
+        all_activities = all_activities[:target_count]
 
-    output_dir = Path(filtered_master_json_path).parent.resolve()
-    output_path = os.path.join(output_dir, "new_activities.json")
+    output_path = str(workspace.output_path("new_activities.json"))
 
     try:
-        with open(output_path, "w") as outfile:
-            json.dump(all_activities, outfile, indent=2)
+        with atomic_write(output_path) as outfile:
+            json.dump(activities_to_dicts(all_activities), outfile, indent=2)
     except Exception as e:
         print(f"Error saving generated activities: {e}")
         return f"Error saving generated activities: {e}"
-    
-    return f"Generated activities saved to {output_path}"
-        
 
+    textbook_id = catalog.find_textbook(filtered_master_json_path)
+    if textbook_id is not None:
+        try:
+            with catalog.session() as conn:
+                catalog.store_generated(conn, textbook_id, all_activities)
+                catalog.record_export(conn, output_path, textbook_id, "generated")
+        except Exception as e:
+            print(f"🚨 Error recording generated activities in the catalog: {e}")
     
+    return artifacts.saved("Generated activities", output_path, all_activities)
 
+def generate_activities(filtered_master_json_path:str, target_count: int | None = None) -> str:
+    """
+    Generate activities from the filtered master JSON file using OpenAI's API.
 
+    Args:
+        filtered_master_json_path (str): Path to the filtered master JSON file.
+        target_count (int): How many new activities to aim for; by default
+            GENERATOR_TARGET_COUNT, or as many as every batch yields.
 
-      
\ No newline at end of file
+    Returns:
+        str: Path to the generated activities JSON file.
+    """
+    # Artifact ids of earlier tool outputs stand for their files
+    filtered_master_json_path = artifacts.resolve(filtered_master_json_path)
+    filered_json, error = load_generator_input(filtered_master_json_path)
+    if error:
+        return error
+
+    target_count = target_count or GENERATOR_TARGET_COUNT
+    batches = plan_batches(filered_json, target_count)
+    all_activities = []
+
+    # Process the JSON data in batches of related activities, up to the request's deadline
+    for chunk_number, json_chunk in enumerate(batches, 1):
+        messages = build_chunk_messages(json_chunk, chunk_number)
+        
+        print(f"Sending chunk {chunk_number}/{len(batches)}")
+        try:
+            all_activities.extend(llm.chat(
+                "generator", messages,
+                parse=lambda content: parse_generated(content, chunk_number, strict=True),
+                chunk=chunk_number,
+            ))
+        except cancellation.DeadlineExceeded:
+            cancellation.stop_at_deadline("generator", chunk_number - 1, len(batches))
+            break
+        except Exception as e:
+            print(f"Error in chunk {chunk_number}: {e}")
+            continue
+
+    return save_generated_activities(filtered_master_json_path, all_activities, target_count)
+
+async def agenerate_activities(filtered_master_json_path: str, target_count: int | None = None,
+                               max_concurrency: int | None = None) -> str:
+    """
+    Async counterpart of `generate_activities`: file and catalog work runs in a
+    worker thread and up to `max_concurrency` chunks (by default the generator's
+    configured concurrency) are awaited at once.
+    """
+    filtered_master_json_path = artifacts.resolve(filtered_master_json_path)
+    filered_json, error = await asyncio.to_thread(load_generator_input, filtered_master_json_path)
+    if error:
+        return error
+
+    target_count = target_count or GENERATOR_TARGET_COUNT
+    batches = await asyncio.to_thread(plan_batches, filered_json, target_count)
+    semaphore = asyncio.Semaphore(max_concurrency or model_route("generator").concurrency)
+
+    async def run(chunk_number, json_chunk):
+        async with semaphore:
+            messages = build_chunk_messages(json_chunk, chunk_number)
+            print(f"Sending chunk {chunk_number}/{len(batches)}")
+            try:
+                return await llm.achat(
+                    "generator", messages,
+                    parse=lambda content: parse_generated(content, chunk_number, strict=True),
+                    chunk=chunk_number,
+                )
+            except cancellation.DeadlineExceeded:
+                return None
+            except Exception as e:
+                print(f"Error in chunk {chunk_number}: {e}")
+                return []
+
+    done = [activities for activities in await asyncio.gather(*(run(n, chunk) for n, chunk in enumerate(batches, 1)))
+            if activities is not None]
+    if len(done) < len(batches):
+        cancellation.stop_at_deadline("generator", len(done), len(batches))
+    all_activities = [activity for activities in done for activity in activities]
+    return await asyncio.to_thread(save_generated_activities, filtered_master_json_path, all_activities, target_count)
@@ -1,51 +1,215 @@
-from src.tools.clients import openai_client
+from src.tools import llm
+from src.config import model_route
 from src.utils.helper import parse_json_file
+from src.models.activity import activities_to_dicts, normalize_pages
+from src.db import catalog
+from src.utils.helper import atomic_write
+from src.utils import artifacts, cancellation, workspace
+import asyncio
 import json
 import os
 import math
-from pathlib import Path
 import re
+import sqlite3
+from src.utils.prompt_builder import CandidateIndex, compact_json, count_tokens, project, report_savings
+
+# Matching only needs the names and pages of JSON1
+MATCH_FIELDS = ("activity", "page")
+# JSON1 activities sent to the LLM per matching call
+MATCH_BATCH_SIZE = 10
+# Bump when the matcher's output for the same input files changes (invalidates memoized results);
+# changing the matcher's models (see src/config.py) does too
+MATCHER_VERSION = f"3-{model_route('matcher').key}"
+
 # Load JSON1 and JSON2 from files to build the prompt
-def build_prompt(json1_chunk, json2):
-    return f"""
-You are a JSON extraction expert.
+def build_prompt(json1_chunk, json2_names):
+    return f"""You are a JSON extraction expert.
+JSON1 is a list of activities ("activity" name, "page"). JSON2 is a list of activity names from the user's units.
+For each JSON2 name that exactly matches the "activity" of a JSON1 item, return {{"page": <page from JSON1>, "json1_activity": <JSON1 activity>, "json2_activity": <JSON2 name>}}.
+Return ONLY a strictly valid JSON array, [] if nothing matches. No explanations, no markdown.
+
+JSON1:
+{compact_json(json1_chunk)}
+
+JSON2:
+{compact_json(json2_names)}"""
 
-You are given two JSONs:
+def build_chunk_messages(json1_chunk: list, json2, chunk_number: int) -> list | None:
+    """
+    Chat messages asking for the matches between one chunk of JSON1 and JSON2.
+    `json2` is the users JSON or a CandidateIndex built from it; only the JSON2
+    names that could match this chunk are sent. Returns None if there are none.
+    """
+    units = json2 if isinstance(json2, CandidateIndex) else CandidateIndex(json2)
+    json1_projected = project(json1_chunk, MATCH_FIELDS)
+    candidates = units.candidates(item.get("activity", "") for item in json1_projected)
+    if not candidates:
+        print(f"Chunk {chunk_number}: no candidate names in JSON2, skipping the LLM call")
+        return None
 
-### JSON1 (activities)
-It contains a list of activity objects with fields like "activity", "concept", "materials", "description", and "page".
+    prompt = build_prompt(json1_projected, candidates)
+    report_savings(f"Chunk {chunk_number}", prompt, lambda: (
+        count_tokens(build_prompt([], []))
+        + count_tokens(json.dumps(activities_to_dicts(json1_chunk), indent=2))
+        + units.full_tokens()
+    ))
+    return [
+        {"role": "system", "content": "Extract activities common in both"},
+        {"role": "user", "content": prompt}
+    ]
 
-### JSON2 (units)
-It is a list of units. Each unit contains one or more activity names under the "activity" key.
+def parse_matches(chunk_result_raw: str, chunk_number: int, strict: bool = False) -> list:
+    """The matches in the LLM's answer for one chunk; [] if it is not a JSON array, or ValueError with `strict`."""
+    try:
+        matches = json.loads(chunk_result_raw)
+        if not isinstance(matches, list):
+            raise ValueError("expected a JSON array")
+        return matches
+    except (ValueError, TypeError) as e:
+        if strict:
+            raise ValueError(f"invalid JSON array: {e}") from e
+        print(f"Failed to parse chunk {chunk_number}:")
+        print(chunk_result_raw)
+        return []
 
----
+def match_chunk(json1_chunk: list, json2, chunk_number: int) -> list:
+    """
+    Ask the LLM for the matches between one chunk of JSON1 and JSON2, skipping
+    the call if JSON2 has no candidate names for the chunk.
+    Returns an empty list if the call or the parsing fails.
+    """
+    messages = build_chunk_messages(json1_chunk, json2, chunk_number)
+    if messages is None:
+        return []
+    try:
+        return llm.chat(
+            "matcher", messages,
+            parse=lambda content: parse_matches(content, chunk_number, strict=True),
+            chunk=chunk_number,
+        )
+    except Exception as e:
+        print(f"Error in chunk {chunk_number}: {e}")
+        return []
 
-Your task:
+async def amatch_chunk(json1_chunk: list, json2, chunk_number: int) -> list:
+    """Async counterpart of `match_chunk`, using the async OpenAI client."""
+    messages = build_chunk_messages(json1_chunk, json2, chunk_number)
+    if messages is None:
+        return []
+    try:
+        return await llm.achat(
+            "matcher", messages,
+            parse=lambda content: parse_matches(content, chunk_number, strict=True),
+            chunk=chunk_number,
+        )
+    except Exception as e:
+        print(f"Error in chunk {chunk_number}: {e}")
+        return []
 
-For each unit in JSON2, find activity names that exactly match any "activity" field in JSON1. For each match, return an object with:
+def iter_matches(activities, json2: list, batch_size: int = MATCH_BATCH_SIZE):
+    """
+    Streaming counterpart of `match_activities`.
+    Consumes activities as they arrive and yields (batch, matches) for every
+    `batch_size` activities, so matching starts before extraction has finished.
+    """
+    units = json2 if isinstance(json2, CandidateIndex) else CandidateIndex(json2)
+    batch = []
+    chunk_number = 0
+    try:
+        for activity in activities:
+            batch.append(activity)
+            if len(batch) == batch_size:
+                chunk_number += 1
+                print(f"Sending streamed chunk {chunk_number}")
+                yield batch, match_chunk(batch, units, chunk_number)
+                batch = []
+        if batch:
+            chunk_number += 1
+            print(f"Sending streamed chunk {chunk_number}")
+            yield batch, match_chunk(batch, units, chunk_number)
+    except cancellation.DeadlineExceeded:
+        cancellation.stop_at_deadline("matcher", chunk_number - 1)
 
-- "page": page number from JSON1
-- "json1_activity": full activity string from JSON1
-- "json2_activity": matching string from JSON2
+def prepare_matching(master_json_path, users_json_path) -> tuple[tuple | None, str | None]:
+    """
+    Validate and load both JSON files. Catalogued master files are matched
+    right away with an indexed join; only their activities the join misses
+    but JSON2 has candidate names for are left to the LLM.
+    returns:
+        ((json1, units, output_path, catalogued), None), where json1 is what the LLM
+        has to match and catalogued is None or (textbook_id, the join's matches),
+        or (None, error message).
+    """
+    # Check if the provided paths are valid JSON files
+    if not (master_json_path.endswith('.json') and users_json_path.endswith('.json')):
+        return None, "Invalid input. Please provide valid JSON file paths."
 
-⚠️ Rules:
-- The output must be **strictly valid JSON**.
-- Do NOT return any explanations, comments, or code. Only return a JSON array.
-- If no matches are found, return an **empty array**: `[]`
-- Do NOT wrap the result in markdown or triple backticks.
+    # Checking if the files exist
+    if not os.path.exists(master_json_path):
+        return None, f"Master JSON file not found: {master_json_path}"
+    if not os.path.exists(users_json_path):
+        return None, f"Users JSON file not found: {users_json_path}"
+    
+    # Load your JSON data; outputs of earlier tools in this process come from memory
+    json1, error = artifacts.load_activities(master_json_path)
+    json2 = artifacts.load_json(users_json_path)
 
----
+    # Check if the JSON data is loaded correctly and in the expected format
+    if error:
+        return None, error
+    if json2 is None:
+        return None, "Error loading JSON data. Please check the file contents."
+    if not isinstance(json2, list):
+        return None, "Invalid JSON format. Expected a list of activities."
 
-JSON1 chunk:
-{json.dumps(json1_chunk, indent=2)}
+    output_path = str(workspace.output_path("matched_activities.json"))
+    # Index JSON2 once instead of re-sending all of it with every chunk
+    units = CandidateIndex(json2)
 
----
+    # Master files written by the extractor are in the catalog: match them with
+    # an indexed join on the normalized activity name instead of the LLM
+    try:
+        textbook_id = catalog.find_textbook(master_json_path)
+        if textbook_id is not None:
+            print(f"Matching textbook {textbook_id} against the catalog")
+            with catalog.session() as conn:
+                joined = catalog.match_by_name(conn, textbook_id, units.names)
+            matched = {match["json1_activity"] for match in joined}
+            json1 = [a for a in json1 if a.activity not in matched and units.candidates([a.activity])]
+            print(f"{len(joined)} matches from the catalog; {len(json1)} activities left for the LLM")
+            return (json1, units, output_path, (textbook_id, joined)), None
+    except (sqlite3.Error, OSError) as e:
+        # A locked or damaged catalog should not fail the match: the LLM path still works
+        print(f"🚨 Error matching against the catalog, falling back to the LLM: {e}")
 
-JSON2 full:
-{json.dumps(json2, indent=2)}
+    return (json1, units, output_path, None), None
 
-Return the matched results in an array format.
-"""
+def save_matches(all_matches: list, output_path: str, catalogued: tuple | None = None) -> str:
+    """
+    Save the LLM's matches, with the catalog join's for a catalogued master (in
+    page order), and record them in the catalog.
+    """
+    if catalogued is not None:
+        all_matches = sorted(catalogued[1] + all_matches,
+                             key=lambda match: min(normalize_pages(match.get("page")), default=0))
+    if all_matches:
+        try:
+            # Save final results to a JSON file
+            with atomic_write(output_path) as outfile:
+                json.dump(all_matches, outfile, indent=2)
+        except Exception as e:
+            print(f"Error saving matched activities: {e}")
+            return f"Error saving matched activities: {e}"
+        if catalogued is not None:
+            try:
+                with catalog.session() as conn:
+                    catalog.import_matches(conn, catalogued[0], all_matches)
+                    catalog.record_export(conn, output_path, catalogued[0], "matched")
+            except Exception as e:
+                print(f"🚨 Error recording matches in the catalog: {e}")
+        return artifacts.saved("Matched activities", output_path, all_matches)
+    else:
+        return "No matches found in the provided JSON files."
 
 # tool to match activities in JSON1 and JSON2
 def match_activities(master_json_path, users_json_path) -> str:
@@ -57,78 +221,54 @@ def match_activities(master_json_path, users_json_path) -> str:
     returns:
         str: A message indicating the result of the operation and path of output json file.
     """
-    batch_size = 10  # You can adjust this depending on how long your activities are
+    batch_size = MATCH_BATCH_SIZE
     all_matches = []
-    
-    # Check if the provided paths are valid JSON files
-    if not (master_json_path.endswith('.json') and users_json_path.endswith('.json')):
-        return "Invalid input. Please provide valid JSON file paths."
-
-    # Checking if the files exist
-    if not os.path.exists(master_json_path):
-        return f"Master JSON file not found: {master_json_path}"
-    if not os.path.exists(users_json_path):
-        return f"Users JSON file not found: {users_json_path}"
-    
-    # Load your JSON data
-    with open(master_json_path, "r") as f1:
-        json1 = json.load(f1)
-
-    with open(users_json_path, "r") as f2:
-        json2 = json.load(f2)
 
-    # Check if the JSON data is loaded correctly
-    if json1 is None or json2 is None:
-        return "Error loading JSON data. Please check the file contents."
-    # Check if the JSON data is in the expected format
-    if not isinstance(json1, list) or not isinstance(json2, list):
-        return "Invalid JSON format. Expected a list of activities."
+    prepared, message = prepare_matching(master_json_path, users_json_path)
+    if prepared is None:
+        return message
+    json1, units, output_path, catalogued = prepared
 
-    # Chunking logic
+    # Chunking logic, up to the request's deadline
     for i in range(0, len(json1), batch_size):
         json1_chunk = json1[i:i + batch_size]
-        prompt = build_prompt(json1_chunk, json2)
-
         print(f"Sending chunk {i // batch_size + 1}/{math.ceil(len(json1) / batch_size)}")
-
         try:
-            response = openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "Extract activities common in both"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0
-            )
+            all_matches.extend(match_chunk(json1_chunk, units, i // batch_size + 1))
+        except cancellation.DeadlineExceeded:
+            cancellation.stop_at_deadline("matcher", i // batch_size, math.ceil(len(json1) / batch_size))
+            break
+        
+    return save_matches(all_matches, output_path, catalogued)
+
+async def amatch_activities(master_json_path, users_json_path, max_concurrency: int | None = None) -> str:
+    """
+    Async counterpart of `match_activities`: file and catalog work runs in a
+    worker thread and up to `max_concurrency` chunks (by default the matcher's
+    configured concurrency) are awaited at once.
+    """
+    batch_size = MATCH_BATCH_SIZE
+    prepared, message = await asyncio.to_thread(prepare_matching, master_json_path, users_json_path)
+    if prepared is None:
+        return message
+    json1, units, output_path, catalogued = prepared
 
-            chunk_result_raw = response.choices[0].message.content
+    semaphore = asyncio.Semaphore(max_concurrency or model_route("matcher").concurrency)
 
+    async def run(i):
+        async with semaphore:
+            print(f"Sending chunk {i // batch_size + 1}/{math.ceil(len(json1) / batch_size)}")
             try:
-                chunk_matches = json.loads(chunk_result_raw)
-                all_matches.extend(chunk_matches)
-            except json.JSONDecodeError:
-                print(f"Failed to parse chunk {i // batch_size + 1}:")
-                print(chunk_result_raw)
-                continue
-        except Exception as e:
-            print(f"Error in chunk {i // batch_size + 1}: {e}")
-            continue
-        
-    if all_matches:
-        output_dir = Path(master_json_path).parent.resolve()
-        output_path = os.path.join(output_dir, "matched_activities.json")
+                return await amatch_chunk(json1[i:i + batch_size], units, i // batch_size + 1)
+            except cancellation.DeadlineExceeded:
+                return None
 
-        try:
-            # Save final results to a JSON file
-            with open(output_path, "w") as outfile:
-                json.dump(all_matches, outfile, indent=2)
-            
-            return f"Matched activities saved to {output_path}"
-        except Exception as e:
-            print(f"Error saving matched activities: {e}")
-            return f"Error saving matched activities: {e}"
-    else:
-        return "No matches found in the provided JSON files."
+    chunk_count = math.ceil(len(json1) / batch_size)
+    done = [matches for matches in await asyncio.gather(*(run(i) for i in range(0, len(json1), batch_size))) if matches is not None]
+    if len(done) < chunk_count:
+        cancellation.stop_at_deadline("matcher", len(done), chunk_count)
+    all_matches = [match for matches in done for match in matches]
+    return await asyncio.to_thread(save_matches, all_matches, output_path, catalogued)
 
 
 # Wrapper function to parse input string and call the match_activities function
@@ -147,6 +287,15 @@ def activity_match_wrapper(input_str: str) -> str:
     
     return match_activities(master_json_path, users_json_path)
 
+async def aactivity_match_wrapper(input_str: str) -> str:
+    """Async counterpart of `activity_match_wrapper`."""
+    master_json_path, users_json_path = parse_json_file(input_str)
+
+    if not master_json_path or not users_json_path:
+        return "Invalid input. Please provide two valid JSON file paths."
+
+    return await amatch_activities(master_json_path, users_json_path)
+
 
 if __name__ == "__main__":
     # Example usage
@@ -0,0 +1,129 @@
+import os
+import time
+from pathlib import Path
+from src.tools.activity_extractor_tool import (
+    need_ocr,
+    extract_text_with_ocr,
+    iter_pages_with_pymupdf,
+    iter_activities,
+    record_in_catalog,
+    EXTRACTION_CHUNK_PAGES,
+    EXTRACTOR_VERSION,
+)
+from src.tools.activity_match_tool import iter_matches, MATCHER_VERSION
+from src.tools.activity_filter_tool import filter_unmatched, FILTER_VERSION
+from src.utils.helper import parse_pdf_and_json, JsonArrayWriter
+from src.models.activity import activities_to_dicts
+from src.db import catalog
+from src.utils import artifacts, workspace
+
+# The pipeline's output changes with any of its stages (invalidates memoized results)
+PIPELINE_VERSION = f"1-{EXTRACTOR_VERSION}.{MATCHER_VERSION}.{FILTER_VERSION}"
+
+def stream_pipeline(pdf_path: str, users_json_path: str, chunk_size: int = EXTRACTION_CHUNK_PAGES, max_workers: int | None = None) -> str:
+    """
+    Run extraction, matching and filtering as one streaming pipeline.
+    Pages are read lazily, activities are emitted per chunk and matched/filtered
+    as they arrive, and every stage appends to its output file as it goes.
+    args:
+        pdf_path (str): Path to the source PDF textbook.
+        users_json_path (str): Path to the users JSON file containing units.
+        chunk_size (int): Number of pages sent to the LLM per extraction call.
+        max_workers (int): Number of extraction chunks kept in flight (default: the extractor's concurrency).
+    returns:
+        str: A message with the paths of the three output files, or an error message.
+    """
+    if not os.path.exists(pdf_path):
+        return "Pdf file not found at the specified path."
+    if not pdf_path.lower().endswith('.pdf'):
+        return "Invalid file type. Only PDF files are supported."
+    if not os.path.exists(users_json_path):
+        return f"Users JSON file not found: {users_json_path}"
+
+    json2 = artifacts.load_json(users_json_path)
+    if not isinstance(json2, list):
+        return "Invalid JSON format. Expected a list of activities."
+
+    if need_ocr(pdf_path):
+        # Mistral OCR returns the whole document in one response, so only the
+        # downstream stages can stream in this case.
+        pages = extract_text_with_ocr(pdf_path)
+        if not pages:
+            return "No pages extracted from the PDF."
+        pages = pages.items()
+    else:
+        pages = iter_pages_with_pymupdf(pdf_path)
+
+    output_dir = workspace.current_dir()
+    master_path = output_dir / (Path(pdf_path).stem + "_activities.json")
+    matched_path = output_dir / "matched_activities.json"
+    filtered_path = output_dir / (Path(pdf_path).stem + "_activities_filtered.json")
+
+    start = time.perf_counter()
+    first_result_at = None
+    # Activities and matches are small next to page text; keep them for the catalog
+    all_activities = []
+    all_matches = []
+    all_filtered = []
+
+    def record_activities(activities):
+        # Tee every extracted activity into the master file before matching sees it
+        for activity in activities:
+            master_out.write(activity.to_dict())
+            all_activities.append(activity)
+            yield activity
+
+    try:
+        with JsonArrayWriter(master_path) as master_out, \
+             JsonArrayWriter(matched_path) as matched_out, \
+             JsonArrayWriter(filtered_path) as filtered_out:
+            activities = record_activities(iter_activities(pages, chunk_size, max_workers))
+            for batch, matches in iter_matches(activities, json2):
+                if first_result_at is None:
+                    first_result_at = time.perf_counter() - start
+                    print(f"First results after {first_result_at:.1f}s")
+                matched_out.write_many(matches)
+                all_matches.extend(matches)
+                filtered = filter_unmatched(batch, matches)
+                filtered_out.write_many(activities_to_dicts(filtered))
+                all_filtered.extend(filtered)
+    except Exception as e:
+        print(f"🚨 Error in streaming pipeline: {e}")
+        return f"Error in streaming pipeline: {e}"
+
+    if master_out.count == 0:
+        return "No activities found in the PDF."
+
+    textbook_id = record_in_catalog(pdf_path, all_activities, master_path)
+    if textbook_id is not None:
+        try:
+            with catalog.session() as conn:
+                catalog.import_matches(conn, textbook_id, all_matches)
+                catalog.record_export(conn, matched_path, textbook_id, "matched")
+                catalog.record_export(conn, filtered_path, textbook_id, "filtered")
+        except Exception as e:
+            print(f"🚨 Error recording matches in the catalog: {e}")
+
+    print(f"Streaming pipeline finished in {time.perf_counter() - start:.1f}s "
+          f"({master_out.count} activities, {matched_out.count} matches, {filtered_out.count} filtered).")
+    return "\n".join([
+        artifacts.saved("Activities", master_path, all_activities),
+        artifacts.saved("Matched activities", matched_path, all_matches),
+        artifacts.saved("Filtered activities", filtered_path, all_filtered),
+    ])
+
+# Wrapper function to parse input string and call the stream_pipeline function
+def stream_pipeline_wrapper(input_str: str) -> str:
+    """
+    Wrapper function to parse input string and call the stream_pipeline function.
+    args:
+        input_str (str): Input string containing a PDF path and a users JSON path.
+    returns:
+        str: Result of the stream_pipeline function or error message.
+    """
+    pdf_path, users_json_path = parse_pdf_and_json(input_str)
+
+    if not pdf_path or not users_json_path:
+        return "Invalid input. Please provide a PDF file path and a users JSON file path."
+
+    return stream_pipeline(pdf_path, users_json_path)
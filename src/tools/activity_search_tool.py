@@ -0,0 +1,45 @@
+import re
+from src.db import catalog
+
+def parse_search_input(input_str: str) -> tuple[str, int | None, int | None]:
+    """
+    Split the tool input into search words and an optional page range,
+    e.g. 'magnets pages 10-40' -> ('magnets', 10, 40).
+    """
+    page_from = page_to = None
+    match = re.search(r"\bpages?\s*(\d+)\s*(?:-|to)\s*(\d+)", input_str, re.IGNORECASE)
+    if match:
+        page_from, page_to = int(match.group(1)), int(match.group(2))
+        input_str = input_str[:match.start()] + input_str[match.end():]
+    return input_str.strip(), page_from, page_to
+
+def search_activities_tool(input_str: str) -> str:
+    """
+    Search the already extracted activities of all catalogued textbooks.
+    args:
+        input_str (str): Search words, optionally followed by a page range like 'pages 10-40'.
+    returns:
+        str: The best matching activities with their textbook and pages, or a message if none match.
+    """
+    query, page_from, page_to = parse_search_input(input_str)
+    if not query:
+        return "Please provide words to search for."
+
+    try:
+        with catalog.session() as conn:
+            results = catalog.search_activities(conn, query, page_from=page_from, page_to=page_to, limit=10)
+    except Exception as e:
+        print(f"🚨 Error searching activities: {e}")
+        return f"Error searching activities: {e}"
+
+    if not results:
+        return f"No extracted activities match '{query}'."
+
+    lines = [f"Found {len(results)} matching activities:"]
+    for result in results:
+        materials = ", ".join(result["materials"])
+        lines.append(
+            f"- {result['activity']} (pages {result['page']}, {result['textbook']}): "
+            f"{result['concept']}. Materials: {materials}."
+        )
+    return "\n".join(lines)
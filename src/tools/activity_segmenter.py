@@ -0,0 +1,259 @@
+import asyncio
+import json
+import math
+import os
+import re
+from collections import Counter
+import fitz  # PyMuPDF
+from src.config import model_route
+from src.models.activity import Activity
+from src.tools import llm
+from src.utils import cancellation, tracing
+from src.utils.prompt_builder import compact_json, compact_text, count_tokens, report_savings
+
+# Set ACTIVITY_SEGMENTER=0 to always send whole pages to the LLM
+SEGMENTER_ENABLED = os.getenv("ACTIVITY_SEGMENTER", "1") != "0"
+# Activities end at SEGMENT_MAX_CHARS of body text (books do not mark where one ends),
+# and SEGMENTS_PER_CALL activities are described per LLM call
+SEGMENT_MAX_CHARS = int(os.getenv("SEGMENT_MAX_CHARS", "1500"))
+SEGMENTS_PER_CALL = int(os.getenv("SEGMENTS_PER_CALL", "6"))
+
+# Lines that open an activity, e.g. "Activity 4.1", "Let us explore", "Think like a scientist"
+HEADING_RE = re.compile(
+    r"^\s*(activity\s+\d+(?:\.\d+)*|let\s+us\s+(?:do|perform|explore|try|investigate)|think\s+like\s+a\s+scientist)\b",
+    re.IGNORECASE,
+)
+# Headings are set apart from body text by weight or size; much larger text (chapter and
+# section titles) ends the activity before it
+HEADING_SIZE_RATIO = 1.1
+SECTION_SIZE_RATIO = 1.3
+MAX_HEADING_CHARS = 120
+BOLD_FLAG = 1 << 4
+
+
+class Line:
+    __slots__ = ("page", "text", "size", "bold")
+
+    def __init__(self, page: int, text: str, size: float, bold: bool):
+        self.page = page
+        self.text = text
+        self.size = size
+        self.bold = bold
+
+
+def iter_lines(doc):
+    """(page, text, font size, bold) of every text line of an open document, in reading order."""
+    for index, page in enumerate(doc):
+        cancellation.check()
+        for block in page.get_text("dict", sort=True)["blocks"]:
+            if block.get("type") != 0:
+                continue
+            for line in block["lines"]:
+                spans = [span for span in line["spans"] if span["text"].strip()]
+                if not spans:
+                    continue
+                text = " ".join("".join(span["text"] for span in line["spans"]).split())
+                first = spans[0]
+                bold = bool(first["flags"] & BOLD_FLAG) or "bold" in first["font"].lower()
+                yield Line(index + 1, text, max(span["size"] for span in spans), bold)
+
+
+def body_font_size(lines: list) -> float:
+    """The font size most of the text is set in."""
+    sizes = Counter()
+    for line in lines:
+        sizes[round(line.size, 1)] += len(line.text)
+    return sizes.most_common(1)[0][0] if sizes else 0.0
+
+
+def is_heading(line: Line, body_size: float) -> bool:
+    return (
+        len(line.text) <= MAX_HEADING_CHARS
+        and HEADING_RE.match(line.text) is not None
+        and (line.bold or line.size >= body_size * HEADING_SIZE_RATIO)
+    )
+
+
+def is_bare_heading(text: str) -> bool:
+    """True for a heading with no title of its own, e.g. "Activity 4.1"."""
+    match = HEADING_RE.match(text)
+    return match is not None and match.end() >= len(text.rstrip(" :.-"))
+
+
+def segment_lines(lines: list) -> list:
+    """
+    Cut a book's lines into activities: each runs from an activity heading to the
+    next one, a chapter/section title or SEGMENT_MAX_CHARS of text, across page
+    breaks. Returns dicts with the heading as "activity", the pages it spans and
+    its body "text".
+    """
+    body_size = body_font_size(lines)
+    segments = []
+    current = None
+    for line in lines:
+        if is_heading(line, body_size):
+            # "Activity 4.1" followed by "Let us explore" is one heading
+            if current is not None and current["bare"] and not current["lines"] and line.page == current["page"][-1]:
+                current["activity"] = f"{current['activity']}: {line.text}"
+                current["bare"] = False
+                continue
+            current = {"activity": line.text, "page": [line.page], "lines": [], "chars": 0,
+                       "bare": is_bare_heading(line.text)}
+            segments.append(current)
+            continue
+        if current is None:
+            continue
+        if line.size >= body_size * SECTION_SIZE_RATIO:
+            current = None
+            continue
+        if current["bare"] and not current["lines"] and line.bold and line.page == current["page"][-1] \
+                and len(line.text) <= MAX_HEADING_CHARS:
+            # A bold title under a bare "Activity 4.1" heading belongs to the name
+            current["activity"] = f"{current['activity']}: {line.text}"
+            current["bare"] = False
+            continue
+        current["lines"].append(line.text)
+        current["chars"] += len(line.text) + 1
+        if line.page != current["page"][-1]:
+            current["page"].append(line.page)
+        if current["chars"] >= SEGMENT_MAX_CHARS:
+            current = None
+
+    return [
+        {"activity": segment["activity"], "page": segment["page"], "text": "\n".join(segment["lines"])}
+        for segment in segments
+    ]
+
+
+def segment_pdf(pdf_path: str) -> list:
+    """Activity segments of a text-based PDF from its layout; [] if it has no text layer or no headings."""
+    with tracing.span("segment_pdf") as span:
+        doc = fitz.open(pdf_path)
+        try:
+            lines = list(iter_lines(doc))
+        finally:
+            doc.close()
+        segments = segment_lines(lines) if lines else []
+        span.set(lines=len(lines), segments=len(segments))
+    return segments
+
+
+def build_segment_prompt(batch: list, pages: dict | None = None) -> list:
+    """
+    Chat messages asking for the concept, materials and description of each
+    activity in a batch of segments. With `pages`, reports the prompt size
+    against sending the batch's whole pages instead.
+    """
+    items = "\n\n".join(f"[{number}] {segment['activity']}\n{compact_text(segment['text'])}"
+                        for number, segment in enumerate(batch, 1))
+    example = compact_json([{"id": 1, "concept": "Magnetic and Non-Magnetic Materials",
+                             "materials": ["Magnet", "Various objects"],
+                             "description": "Step-by-step process to perform the activity"}])
+    prompt = f"""Each numbered item below is one classroom activity cut out of a school textbook, starting with its heading.
+For each item return its "id", the concept it teaches, the materials required and a short description of how to perform it.
+Return ONLY valid JSON, e.g.:
+{example}
+
+Items:
+\"\"\"{items}\"\"\"
+"""
+    if pages:
+        covered = sorted({number for segment in batch for number in segment["page"]})
+        report_savings(
+            f"Activities on pages {covered[0]}-{covered[-1]}",
+            prompt,
+            lambda: count_tokens(prompt) - count_tokens(items) + sum(count_tokens(pages.get(number, "")) for number in covered),
+        )
+    return [{"role": "system", "content": "Extract structured details from textbook activities."},
+            {"role": "user", "content": prompt}]
+
+
+def parse_segment_details(content: str, batch: list) -> list:
+    """
+    Activities for a batch: name and pages from the layout, the other fields from
+    the LLM's answer. Raises ValueError if the answer is not a JSON list.
+    """
+    try:
+        details = json.loads(content)
+    except (json.JSONDecodeError, TypeError) as e:
+        raise ValueError(f"invalid JSON: {e}") from e
+    if not isinstance(details, list):
+        raise ValueError("expected a JSON array")
+    by_id = {}
+    for item in details:
+        if isinstance(item, dict):
+            try:
+                by_id[int(item.get("id"))] = item
+            except (TypeError, ValueError):
+                continue
+    activities = []
+    for number, segment in enumerate(batch, 1):
+        item = by_id.get(number, {})
+        activities.append(Activity(
+            activity=segment["activity"],
+            concept=item.get("concept", ""),
+            materials=item.get("materials", ()),
+            description=item.get("description", ""),
+            page=segment["page"],
+        ))
+    return activities
+
+
+def described_share(activities: list) -> float:
+    return sum(1 for activity in activities if activity.description) / len(activities) if activities else 1.0
+
+
+def describe_batch(batch: list, pages: dict | None = None) -> list:
+    """Activities for one batch of segments; if the LLM fails they keep only their name and pages."""
+    cancellation.check()
+    with tracing.span("segment_batch", pages=f"{batch[0]['page'][0]}-{batch[-1]['page'][-1]}", segments=len(batch)):
+        messages = build_segment_prompt(batch, pages)
+        try:
+            return llm.chat("extractor", messages, parse=lambda content: parse_segment_details(content, batch),
+                            coverage=described_share)
+        except ValueError as e:
+            print(f"Unexpected response for activities {batch[0]['activity']}..{batch[-1]['activity']}: {e}")
+            return parse_segment_details("[]", batch)
+
+
+async def adescribe_batch(batch: list, pages: dict | None = None) -> list:
+    """Async counterpart of `describe_batch`."""
+    cancellation.check()
+    with tracing.span("segment_batch", pages=f"{batch[0]['page'][0]}-{batch[-1]['page'][-1]}", segments=len(batch)):
+        messages = build_segment_prompt(batch, pages)
+        try:
+            return await llm.achat("extractor", messages, parse=lambda content: parse_segment_details(content, batch),
+                                   coverage=described_share)
+        except ValueError as e:
+            print(f"Unexpected response for activities {batch[0]['activity']}..{batch[-1]['activity']}: {e}")
+            return parse_segment_details("[]", batch)
+
+
+def describe_segments(segments: list, pages: dict | None = None) -> list:
+    """Activity objects for all segments, SEGMENTS_PER_CALL per LLM call, in book order, up to the request's deadline."""
+    activities = []
+    for i in range(0, len(segments), SEGMENTS_PER_CALL):
+        try:
+            activities.extend(describe_batch(segments[i:i + SEGMENTS_PER_CALL], pages))
+        except cancellation.DeadlineExceeded:
+            cancellation.stop_at_deadline("segmenter", i // SEGMENTS_PER_CALL, math.ceil(len(segments) / SEGMENTS_PER_CALL))
+            break
+    return activities
+
+
+async def adescribe_segments(segments: list, pages: dict | None = None, max_concurrency: int | None = None) -> list:
+    """Async counterpart of `describe_segments`, with up to `max_concurrency` calls at once."""
+    semaphore = asyncio.Semaphore(max_concurrency or model_route("extractor").concurrency)
+
+    async def run(batch):
+        async with semaphore:
+            try:
+                return await adescribe_batch(batch, pages)
+            except cancellation.DeadlineExceeded:
+                return None
+
+    batches = [segments[i:i + SEGMENTS_PER_CALL] for i in range(0, len(segments), SEGMENTS_PER_CALL)]
+    done = [described for described in await asyncio.gather(*(run(batch) for batch in batches)) if described is not None]
+    if len(done) < len(batches):
+        cancellation.stop_at_deadline("segmenter", len(done), len(batches))
+    return [activity for described in done for activity in described]
@@ -1,16 +1,147 @@
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
 from mistralai import Mistral
+import httpx
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from src.config import MODEL_ROUTES, model_route
 
 load_dotenv()
 
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# One keep-alive connection pool per provider, shared by the tools and the agent's LLM, so
+# bursts of parallel chunk calls reuse open (already TLS-handshaken) connections. The OpenAI
+# pool fits every stage running at its configured concurrency at once (the streaming
+# pipeline extracts and matches together) plus HTTP_POOL_HEADROOM; the Mistral pool fits
+# the OCR shards in flight. OPENAI_MAX_CONNECTIONS / MISTRAL_MAX_CONNECTIONS override them.
+# HTTP2=1 multiplexes calls over fewer connections (needs `pip install httpx[http2]`).
+HTTP_POOL_HEADROOM = int(os.getenv("HTTP_POOL_HEADROOM", "8"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "120"))
+HTTP2 = os.getenv("HTTP2", "0") == "1"
+# OpenAI calls carry their stage's timeout; Mistral calls would otherwise have none
+MISTRAL_TIMEOUT_SECONDS = float(os.getenv("MISTRAL_TIMEOUT_SECONDS", "300"))
+
+
+def openai_pool_size() -> int:
+    return int(os.getenv("OPENAI_MAX_CONNECTIONS") or
+               sum(model_route(stage).concurrency for stage in MODEL_ROUTES) + HTTP_POOL_HEADROOM)
+
+
+def mistral_pool_size() -> int:
+    return int(os.getenv("MISTRAL_MAX_CONNECTIONS") or int(os.getenv("OCR_MAX_PARALLEL", "4")) + 2)
+
+
+class PoolStats:
+    """
+    Connection reuse of one provider's pool, from httpcore's trace events: a
+    request that did not open a connection reused a kept-alive one.
+    """
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+        self.connect_seconds = 0.0
+
+    def _event(self, name: str, started: dict) -> None:
+        # e.g. "connection.connect_tcp.started" / ".complete", "connection.start_tls.complete"
+        if name.endswith(".started"):
+            started[name[:-len(".started")]] = time.perf_counter()
+            return
+        step = name.rsplit(".", 1)[0]
+        if step not in ("connection.connect_tcp", "connection.start_tls") or not name.endswith(".complete"):
+            return
+        elapsed = time.perf_counter() - started.pop(step, time.perf_counter())
+        with self._lock:
+            if step == "connection.connect_tcp":
+                self.connections += 1
+            else:
+                self.tls_handshakes += 1
+            self.connect_seconds += elapsed
+
+    def on_request(self, request: httpx.Request) -> None:
+        """httpx request hook; traces the request's connection setup."""
+        with self._lock:
+            self.requests += 1
+        started = {}
+        request.extensions["trace"] = lambda name, info: self._event(name, started)
+
+    async def aon_request(self, request: httpx.Request) -> None:
+        """Async counterpart of `on_request`; httpcore awaits the trace callback of async clients."""
+        with self._lock:
+            self.requests += 1
+        started = {}
+
+        async def trace(name, info):
+            self._event(name, started)
+        request.extensions["trace"] = trace
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            reused = max(self.requests - self.connections, 0)
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections,
+                "tls_handshakes": self.tls_handshakes,
+                "reused": reused,
+                "reuse_rate": round(reused / self.requests, 3) if self.requests else None,
+                "connect_seconds": round(self.connect_seconds, 3),
+            }
+
+
+def _http2() -> bool:
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        print("🚨 HTTP2=1 needs the h2 package (pip install httpx[http2]); using HTTP/1.1.")
+        return False
+    return True
+
+
+_use_http2 = _http2()
+
+
+def _pool(client_class, size: int, hook):
+    """An httpx client of `client_class` keeping up to `size` connections alive, reporting to `hook`."""
+    return client_class(
+        limits=httpx.Limits(max_connections=size, max_keepalive_connections=size,
+                            keepalive_expiry=HTTP_KEEPALIVE_SECONDS),
+        http2=_use_http2,
+        event_hooks={"request": [hook]},
+    )
+
+
+openai_stats = PoolStats("openai")
+mistral_stats = PoolStats("mistral")
+
+# The SDKs' defaults (redirects, timeouts) with our limits; the agent's ChatOpenAI uses these too
+openai_http_client = _pool(DefaultHttpxClient, openai_pool_size(), openai_stats.on_request)
+async_openai_http_client = _pool(DefaultAsyncHttpxClient, openai_pool_size(), openai_stats.aon_request)
+mistral_http_client = _pool(httpx.Client, mistral_pool_size(), mistral_stats.on_request)
+async_mistral_http_client = _pool(httpx.AsyncClient, mistral_pool_size(), mistral_stats.aon_request)
+
+openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=openai_http_client)
 if not openai_client:
     print("🚨 OpenAI client not initialized. Check your API key.")
-    raise ValueError("OpenAI client not initialized. Check your API key.")  
+    raise ValueError("OpenAI client not initialized. Check your API key.")
 
-mistral_client = Mistral(api_key=os.getenv("MISTRAL_API_KEY"))
+# Async client for the async serving path (asgi_app.py), where tools await their LLM calls
+async_openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=async_openai_http_client)
+
+mistral_client = Mistral(api_key=os.getenv("MISTRAL_API_KEY"), timeout_ms=int(MISTRAL_TIMEOUT_SECONDS * 1000),
+                         client=mistral_http_client, async_client=async_mistral_http_client)
 if not mistral_client:
     print("🚨 Mistral client not initialized. Check your API key.")
-    raise ValueError("Mistral client not initialized. Check your API key.")
\ No newline at end of file
+    raise ValueError("Mistral client not initialized. Check your API key.")
+
+
+def pool_stats() -> dict:
+    """Connection reuse per provider, e.g. for /stats/http and benchmarks."""
+    return {
+        "openai": {**openai_stats.snapshot(), "max_connections": openai_pool_size()},
+        "mistral": {**mistral_stats.snapshot(), "max_connections": mistral_pool_size()},
+    }
@@ -0,0 +1,344 @@
+import argparse
+import math
+import os
+import re
+import fitz  # PyMuPDF
+from src.config import MODEL_PRICES, OCR_PRICE_PER_PAGE, model_route
+from src.db import ocr_cache
+from src.db.tool_cache import input_fingerprint, lookup
+from src.tools.activity_extractor_tool import (
+    ACTIVITY_HEADING_RE,
+    EXTRACTION_CHUNK_PAGES,
+    EXTRACTOR_VERSION,
+    MIN_CHARS_PER_PAGE,
+    extraction_prompt,
+    has_activity_keywords,
+    marked_text,
+    need_ocr,
+)
+from src.tools.activity_generator_tool import (
+    ACTIVITIES_PER_CALL,
+    GENERATOR_BATCH_SIZE,
+    GENERATOR_TARGET_COUNT,
+    build_prompt as generator_prompt,
+)
+from src.tools.activity_match_tool import MATCH_BATCH_SIZE, build_prompt as matcher_prompt
+from src.tools.activity_pipeline import PIPELINE_VERSION
+from src.tools.activity_segmenter import SEGMENTER_ENABLED, SEGMENTS_PER_CALL, build_segment_prompt, segment_pdf
+from src.tools.sharded_ocr import OCR_MAX_PARALLEL, OCR_SHARD_PAGES, OCR_SHARD_THRESHOLD
+from src.utils import artifacts
+from src.utils.helper import find_json_refs
+from src.utils.prompt_builder import CandidateIndex, count_tokens
+
+# Latency model of one call: seconds to the first token and completion tokens per second.
+# Rough figures; compare against the openai.chat spans of a trace (src/utils/tracing.py)
+MODEL_LATENCY = {
+    "gpt-4o": (0.8, 60),
+    "gpt-4o-mini": (0.5, 90),
+    "gpt-4": (1.5, 25),
+}
+DEFAULT_LATENCY = (1.0, 40)
+OCR_SECONDS_PER_PAGE = float(os.getenv("OCR_SECONDS_PER_PAGE", "0.4"))
+# Sizes of what the models return, and of page text that is not known before OCR
+OUTPUT_TOKENS_PER_ACTIVITY = 110
+OUTPUT_TOKENS_PER_MATCH = 35
+OCR_TOKENS_PER_PAGE = 450
+ACTIVITIES_PER_UNKNOWN_CHUNK = 3
+
+
+class StageEstimate:
+    """Predicted calls, tokens, cost and time of one stage."""
+    __slots__ = ("name", "model", "escalate_to", "concurrency", "calls", "prompt_tokens", "output_tokens",
+                 "latencies", "fixed_cost", "note")
+
+    def __init__(self, name: str, model: str, concurrency: int, escalate_to: str | None = None, note: str = ""):
+        self.name = name
+        self.model = model
+        self.escalate_to = escalate_to
+        self.concurrency = max(1, concurrency)
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.latencies = []
+        self.fixed_cost = 0.0
+        self.note = note
+
+    @classmethod
+    def for_stage(cls, name: str, stage: str, note: str = "") -> "StageEstimate":
+        route = model_route(stage)
+        return cls(name, route.model, route.concurrency, route.escalate_to, note)
+
+    def add_call(self, prompt_tokens: int, output_tokens: int, seconds: float | None = None) -> None:
+        first_token, tokens_per_second = MODEL_LATENCY.get(self.model, DEFAULT_LATENCY)
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.output_tokens += output_tokens
+        self.latencies.append(seconds if seconds is not None else first_token + output_tokens / tokens_per_second)
+
+    @property
+    def cost(self) -> float:
+        prompt_price, output_price = MODEL_PRICES.get(self.model, (0.0, 0.0))
+        return (self.prompt_tokens * prompt_price + self.output_tokens * output_price) / 1e6 + self.fixed_cost
+
+    @property
+    def seconds(self) -> float:
+        """Wall time with `concurrency` calls in flight."""
+        if not self.latencies:
+            return 0.0
+        return max(max(self.latencies), sum(self.latencies) / self.concurrency)
+
+    @property
+    def sequential_seconds(self) -> float:
+        return sum(self.latencies)
+
+
+def _message_tokens(messages: list) -> int:
+    return sum(count_tokens(message["content"]) for message in messages)
+
+
+def scan_pdf(pdf_path: str) -> dict:
+    """
+    The cheap local pass: page text where PyMuPDF has it, pages that need OCR,
+    and whether the extractor will OCR the book (and find it in the OCR cache).
+    """
+    doc = fitz.open(pdf_path)
+    try:
+        pages = {index + 1: page.get_text("text").strip() for index, page in enumerate(doc)}
+    finally:
+        doc.close()
+    scan = {
+        "pages": pages,
+        "ocr_pages": sum(1 for text in pages.values() if len(text) <= MIN_CHARS_PER_PAGE),
+        "uses_ocr": need_ocr(pdf_path),
+        "ocr_cached": False,
+    }
+    if scan["uses_ocr"]:
+        try:
+            cached = ocr_cache.cached_pages(ocr_cache.file_sha256(pdf_path), ocr_cache.page_hashes(pdf_path))
+        except Exception as e:
+            print(f"🚨 OCR cache unavailable for the estimate: {e}")
+            cached = None
+        if cached:
+            scan["pages"] = cached
+            scan["ocr_cached"] = True
+    scan["text_known"] = not scan["uses_ocr"] or scan["ocr_cached"]
+    scan["keyword_pages"] = sum(1 for text in scan["pages"].values() if has_activity_keywords(text)) \
+        if scan["text_known"] else None
+    return scan
+
+
+def estimate_ocr(scan: dict) -> StageEstimate | None:
+    """Mistral OCR of the whole book, as one call or as page-range shards; None if not needed."""
+    if not scan["uses_ocr"] or scan["ocr_cached"]:
+        return None
+    page_count = len(scan["pages"])
+    shard_pages = OCR_SHARD_PAGES if page_count > OCR_SHARD_THRESHOLD else page_count
+    stage = StageEstimate("OCR", "mistral-ocr-latest", OCR_MAX_PARALLEL if page_count > OCR_SHARD_THRESHOLD else 1)
+    for start in range(0, page_count, shard_pages):
+        stage.add_call(0, 0, seconds=min(shard_pages, page_count - start) * OCR_SECONDS_PER_PAGE)
+    stage.fixed_cost = page_count * OCR_PRICE_PER_PAGE
+    return stage
+
+
+def estimate_chunk_extraction(scan: dict) -> tuple[StageEstimate, int]:
+    """
+    Extraction from 10-page chunks; only chunks with activity keywords are sent.
+    Returns the stage and the number of activities expected.
+    """
+    route = model_route("extractor")
+    stage = StageEstimate.for_stage("extraction (page chunks)", "extractor")
+    items = [{"page": number, "text": text} for number, text in sorted(scan["pages"].items())]
+    activities = 0
+    if not scan["text_known"]:
+        # The text only exists after OCR: assume every chunk is sent
+        stage.note = "page text unknown before OCR; assumes every chunk has activities"
+        instruction_tokens = count_tokens(extraction_prompt("", []))
+        for start in range(0, len(items), EXTRACTION_CHUNK_PAGES):
+            pages = min(EXTRACTION_CHUNK_PAGES, len(items) - start)
+            activities += ACTIVITIES_PER_UNKNOWN_CHUNK
+            stage.add_call(instruction_tokens + pages * OCR_TOKENS_PER_PAGE,
+                           OUTPUT_TOKENS_PER_ACTIVITY * ACTIVITIES_PER_UNKNOWN_CHUNK)
+        return stage, activities
+
+    skipped = 0
+    for start in range(0, len(items), EXTRACTION_CHUNK_PAGES):
+        text, page_numbers = marked_text(items[start:start + EXTRACTION_CHUNK_PAGES])
+        if not has_activity_keywords(text):
+            skipped += 1
+            continue
+        expected = max(1, len(set(ACTIVITY_HEADING_RE.findall(text))))
+        activities += expected
+        output_tokens = expected * OUTPUT_TOKENS_PER_ACTIVITY
+        stage.add_call(count_tokens(extraction_prompt(text, page_numbers)),
+                       min(output_tokens, route.max_tokens) if route.max_tokens else output_tokens)
+    if skipped:
+        stage.note = f"{skipped} chunks without activity keywords skipped"
+    return stage, activities
+
+
+def estimate_segment_extraction(segments: list) -> StageEstimate:
+    """Extraction of layout segments, SEGMENTS_PER_CALL activities per call."""
+    stage = StageEstimate.for_stage("extraction (layout segments)", "extractor",
+                                    note=f"{len(segments)} activity headings found in the layout")
+    for start in range(0, len(segments), SEGMENTS_PER_CALL):
+        batch = segments[start:start + SEGMENTS_PER_CALL]
+        stage.add_call(_message_tokens(build_segment_prompt(batch)), len(batch) * OUTPUT_TOKENS_PER_ACTIVITY)
+    return stage
+
+
+def estimate_matching(activity_count: int, users: list, names: list | None = None) -> tuple[StageEstimate, int]:
+    """
+    LLM matching of `activity_count` activities against the user's JSON, in
+    batches of MATCH_BATCH_SIZE. With the activity `names` (from the layout)
+    only batches with candidate names are counted. Returns the stage and the
+    number of matches expected.
+    """
+    stage = StageEstimate.for_stage("matching", "matcher")
+    units = CandidateIndex(users)
+    instruction_tokens = count_tokens(matcher_prompt([], []))
+    matched = 0
+    for start in range(0, activity_count, MATCH_BATCH_SIZE):
+        size = min(MATCH_BATCH_SIZE, activity_count - start)
+        if names:
+            batch_names = names[start:start + size]
+            candidates = units.candidates(batch_names)
+            if not candidates:
+                continue
+            hits = min(size, len(candidates))
+        else:
+            candidates = [item.get("activity", "") if isinstance(item, dict) else str(item) for item in users]
+            hits = 0
+        matched += hits
+        stage.add_call(instruction_tokens + size * 15 + count_tokens(str(candidates)),
+                       max(1, hits) * OUTPUT_TOKENS_PER_MATCH)
+    if not names:
+        stage.note = "activity names unknown before extraction; assumes every batch has candidates"
+    return stage, matched
+
+
+def estimate_generation(activity_count: int) -> StageEstimate:
+    """Generation from `activity_count` filtered activities, honouring GENERATOR_TARGET_COUNT."""
+    stage = StageEstimate.for_stage("generation", "generator")
+    batches = math.ceil(activity_count / GENERATOR_BATCH_SIZE)
+    if GENERATOR_TARGET_COUNT:
+        batches = min(batches, math.ceil(GENERATOR_TARGET_COUNT / ACTIVITIES_PER_CALL))
+        stage.note = f"target of {GENERATOR_TARGET_COUNT} activities"
+    instruction_tokens = count_tokens(generator_prompt([]))
+    for batch in range(batches):
+        size = min(GENERATOR_BATCH_SIZE, activity_count - batch * GENERATOR_BATCH_SIZE)
+        stage.add_call(instruction_tokens + size * 80, ACTIVITIES_PER_CALL * 130)
+    return stage
+
+
+def _cached(tool: str, version: str, input_str: str) -> bool:
+    try:
+        input_key, _ = input_fingerprint(input_str)
+        return bool(input_key) and lookup(tool, version, input_key) is not None
+    except Exception as e:
+        print(f"🚨 Tool cache unavailable for the estimate: {e}")
+        return False
+
+
+def estimate(pdf_path: str, users_json_path: str | None = None) -> dict:
+    """
+    Predict the OCR/LLM calls, tokens, cost and wall time of extracting a PDF
+    with TextbookActivityExtractor and, with the user's JSON, of the full
+    StreamingActivityPipeline followed by ActivityGenerator. Runs locally: it
+    reads the PDF's text layer and layout and consults the OCR and tool caches.
+    """
+    scan = scan_pdf(pdf_path)
+    ocr = estimate_ocr(scan)
+    segments = segment_pdf(pdf_path) if SEGMENTER_ENABLED and not scan["uses_ocr"] else []
+    if segments:
+        extraction, activity_count = estimate_segment_extraction(segments), len(segments)
+    else:
+        extraction, activity_count = estimate_chunk_extraction(scan)
+
+    result = {
+        "pdf": pdf_path,
+        "pages": len(scan["pages"]),
+        "ocr_pages": scan["ocr_pages"],
+        "uses_ocr": scan["uses_ocr"],
+        "ocr_cached": scan["ocr_cached"],
+        "keyword_pages": scan["keyword_pages"],
+        "activities": activity_count,
+        "extraction": [stage for stage in (ocr, extraction) if stage],
+        "extraction_cached": _cached("TextbookActivityExtractor", EXTRACTOR_VERSION, pdf_path),
+        "pipeline": None,
+    }
+    if users_json_path:
+        users = artifacts.load_json(users_json_path)
+        # The pipeline always extracts page chunks
+        chunks, chunk_activities = estimate_chunk_extraction(scan)
+        names = [segment["activity"] for segment in segments] if segments else None
+        matching, matched = estimate_matching(len(names) if names else chunk_activities,
+                                              users if isinstance(users, list) else [], names)
+        generation = estimate_generation(max(0, (len(names) if names else chunk_activities) - matched))
+        result["pipeline"] = [stage for stage in (ocr, chunks, matching, generation) if stage]
+        result["pipeline_cached"] = _cached("StreamingActivityPipeline", PIPELINE_VERSION,
+                                            f"{pdf_path}, {users_json_path}")
+    return result
+
+
+def _calls(count: int) -> str:
+    return f"{count} call" + ("" if count == 1 else "s")
+
+
+def _format_stages(title: str, stages: list, cached: bool) -> list:
+    lines = [f"{title}:" + (" (a previous result for the same input files would be reused at no cost)" if cached else "")]
+    for stage in stages:
+        tokens = f", {stage.prompt_tokens:,} prompt + {stage.output_tokens:,} output tokens" if stage.prompt_tokens else ""
+        line = (f"  {stage.name}: {_calls(stage.calls)} to {stage.model}{tokens}, ${stage.cost:.4f}, "
+                f"~{stage.seconds:.0f}s at concurrency {stage.concurrency} (~{stage.sequential_seconds:.0f}s one at a time)")
+        if stage.escalate_to:
+            line += f"; escalation to {stage.escalate_to} can add up to {_calls(stage.calls)}"
+        lines.append(line + (f" [{stage.note}]" if stage.note else ""))
+    lines.append(f"  total: {_calls(sum(stage.calls for stage in stages))}, "
+                 f"{sum(stage.prompt_tokens + stage.output_tokens for stage in stages):,} tokens, "
+                 f"${sum(stage.cost for stage in stages):.4f}, ~{sum(stage.seconds for stage in stages):.0f}s")
+    return lines
+
+
+def format_estimate(result: dict) -> str:
+    keyword = f", {result['keyword_pages']} with activity keywords" if result["keyword_pages"] is not None else ""
+    ocr = (" (OCR text cached)" if result["ocr_cached"] else ", OCR needed") if result["uses_ocr"] else ""
+    lines = [f"Estimate for {result['pdf']}: {result['pages']} pages, {result['ocr_pages']} without a text layer"
+             f"{ocr}{keyword}, ~{result['activities']} activities"]
+    lines += _format_stages("Extraction (TextbookActivityExtractor)", result["extraction"], result["extraction_cached"])
+    if result["pipeline"]:
+        lines += _format_stages("Full pipeline (StreamingActivityPipeline + ActivityGenerator)",
+                                result["pipeline"], result["pipeline_cached"])
+    return "\n".join(lines)
+
+
+def cost_estimator_tool(input_str: str) -> str:
+    """
+    Agent tool: estimate a textbook run before starting it.
+    args:
+        input_str (str): A PDF path, optionally with the user's JSON path (or artifact id) for the full pipeline.
+    returns:
+        str: The estimate, or an error message.
+    """
+    pdf_paths = re.findall(r"['\"]?([^,'\"\s]+\.pdf)['\"]?", input_str, re.IGNORECASE)
+    if not pdf_paths:
+        return "Invalid input. Please provide a PDF file path."
+    pdf_path = pdf_paths[0]
+    json_refs = find_json_refs(input_str)
+    users_json_path = json_refs[0] if json_refs else None
+    if not os.path.isfile(pdf_path):
+        return f"PDF file not found: {pdf_path}"
+    if users_json_path and not os.path.isfile(users_json_path):
+        return f"Users JSON file not found: {users_json_path}"
+    try:
+        return format_estimate(estimate(pdf_path, users_json_path))
+    except Exception as e:
+        print(f"🚨 Error estimating {pdf_path}: {e}")
+        return f"Error estimating {pdf_path}: {e}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate the cost and time of processing a textbook.")
+    parser.add_argument("pdf")
+    parser.add_argument("users_json", nargs="?", help="The user's JSON, to estimate the full pipeline too.")
+    args = parser.parse_args()
+    print(format_estimate(estimate(args.pdf, args.users_json)))
@@ -0,0 +1,75 @@
+from openai import APIConnectionError
+from src.config import model_route
+from src.tools.clients import openai_client, async_openai_client
+from src.utils import cancellation, tracing
+
+
+def _escalation_reason(route, parse, coverage, content: str, is_last: bool):
+    """(result, None) if the answer is usable, else (None, why the next model should be asked)."""
+    try:
+        result = parse(content)
+    except ValueError as e:
+        if is_last:
+            raise
+        return None, f"the answer did not parse ({e})"
+    if not is_last and coverage is not None:
+        covered = coverage(result)
+        if covered < route.min_coverage:
+            return None, f"the answer covered {covered:.0%} of the input (< {route.min_coverage:.0%})"
+    return result, None
+
+
+def chat(stage: str, messages: list, parse, coverage=None, **span_attrs):
+    """
+    Ask the stage's model (see `src.config.MODEL_ROUTES`) and return `parse(content)`.
+    If `parse` raises ValueError, or `coverage(result)` is below the stage's
+    min_coverage, the stage's `escalate_to` model is asked instead. A ValueError
+    from the last model is raised to the caller. The request times out no later
+    than the current work's deadline (see `src.utils.cancellation`); a timeout
+    or connection error past the deadline is raised as DeadlineExceeded.
+    """
+    route = model_route(stage)
+    models = route.models
+    for attempt, model in enumerate(models):
+        with tracing.span("openai.chat", stage=stage, model=model, attempt=attempt + 1, **span_attrs) as span:
+            cancellation.check()
+            try:
+                response = openai_client.chat.completions.create(
+                    model=model, messages=messages, temperature=0,
+                    max_tokens=route.max_tokens, timeout=cancellation.timeout(route.timeout),
+                )
+            except APIConnectionError:
+                # A timeout cut short by the deadline is the deadline, for the callers' handlers
+                cancellation.check()
+                raise
+            span.record_usage(response)
+        result, reason = _escalation_reason(route, parse, coverage, response.choices[0].message.content,
+                                            attempt == len(models) - 1)
+        if reason is None:
+            return result
+        print(f"↗️ {stage}: {model} escalated to {models[attempt + 1]}: {reason}")
+
+
+async def achat(stage: str, messages: list, parse, coverage=None, **span_attrs):
+    """
+    Async counterpart of `chat`, using the async OpenAI client. The request is
+    aborted as soon as the current work is cancelled.
+    """
+    route = model_route(stage)
+    models = route.models
+    for attempt, model in enumerate(models):
+        with tracing.span("openai.chat", stage=stage, model=model, attempt=attempt + 1, **span_attrs) as span:
+            try:
+                response = await cancellation.guard(async_openai_client.chat.completions.create(
+                    model=model, messages=messages, temperature=0,
+                    max_tokens=route.max_tokens, timeout=cancellation.timeout(route.timeout),
+                ))
+            except APIConnectionError:
+                cancellation.check()
+                raise
+            span.record_usage(response)
+        result, reason = _escalation_reason(route, parse, coverage, response.choices[0].message.content,
+                                            attempt == len(models) - 1)
+        if reason is None:
+            return result
+        print(f"↗️ {stage}: {model} escalated to {models[attempt + 1]}: {reason}")
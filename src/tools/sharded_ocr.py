@@ -0,0 +1,137 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+import fitz  # PyMuPDF
+from src.tools.clients import mistral_client, MISTRAL_TIMEOUT_SECONDS
+from src.utils import cancellation, tracing
+
+# Scans longer than OCR_SHARD_THRESHOLD pages are split into OCR_SHARD_PAGES-page
+# sub-documents, with at most OCR_MAX_PARALLEL shards uploaded/OCR'd at once.
+OCR_SHARD_THRESHOLD = int(os.getenv("OCR_SHARD_THRESHOLD", "40"))
+OCR_SHARD_PAGES = int(os.getenv("OCR_SHARD_PAGES", "20"))
+OCR_MAX_PARALLEL = int(os.getenv("OCR_MAX_PARALLEL", "4"))
+OCR_SHARD_RETRIES = int(os.getenv("OCR_SHARD_RETRIES", "3"))
+
+
+def shard_ranges(page_count: int, shard_pages: int, skip_pages: set | None = None) -> list:
+    """
+    0-based (start, end) page ranges of `shard_pages` pages each; ranges whose
+    pages (1-based) are all in `skip_pages` are left out.
+    """
+    skip_pages = skip_pages or set()
+    ranges = []
+    for start in range(0, page_count, shard_pages):
+        end = min(start + shard_pages, page_count)
+        if not all(number + 1 in skip_pages for number in range(start, end)):
+            ranges.append((start, end))
+    return ranges
+
+
+def shard_bytes(doc, start: int, end: int) -> bytes:
+    """The pages [start, end) of an open document as a standalone PDF."""
+    shard = fitz.open()
+    try:
+        shard.insert_pdf(doc, from_page=start, to_page=end - 1)
+        return shard.tobytes(garbage=3, deflate=True)
+    finally:
+        shard.close()
+
+
+def timeout_ms() -> int:
+    """The Mistral SDK's `timeout_ms` for a call made now: MISTRAL_TIMEOUT_SECONDS, cut to the time left before the current deadline."""
+    return int(cancellation.timeout(MISTRAL_TIMEOUT_SECONDS) * 1000)
+
+
+def ocr_shard(client, file_name: str, data: bytes, start: int, retries: int = OCR_SHARD_RETRIES) -> dict:
+    """
+    Upload and OCR one shard, retrying with backoff. Page numbers in the
+    result are global: the shard-local `page.index` is shifted by `start`.
+    No call is started, and no retry waited for, once the work is cancelled.
+    """
+    for attempt in range(1, retries + 1):
+        cancellation.check()
+        try:
+            with tracing.span("mistral.upload", shard=file_name, bytes=len(data), attempt=attempt):
+                uploaded = client.files.upload(file={"file_name": file_name, "content": data}, purpose="ocr",
+                                               timeout_ms=timeout_ms())
+                url = client.files.get_signed_url(file_id=uploaded.id, timeout_ms=timeout_ms()).url
+            cancellation.check()
+            with tracing.span("mistral.ocr", shard=file_name, attempt=attempt) as span:
+                ocr_response = client.ocr.process(
+                    model="mistral-ocr-latest",
+                    document={"type": "document_url", "document_url": url},
+                    timeout_ms=timeout_ms(),
+                )
+                span.record_usage(ocr_response)
+            pages = {}
+            for page in ocr_response.pages or []:
+                raw_text = page.markdown if page.markdown is not None else ""
+                pages[start + page.index + 1] = raw_text.strip()
+            return pages
+        except Exception as e:
+            print(f"🚨 OCR of {file_name} failed (attempt {attempt}/{retries}): {e}")
+            if attempt < retries:
+                cancellation.sleep(2 ** (attempt - 1))
+    raise RuntimeError(f"OCR of {file_name} failed after {retries} attempts")
+
+
+def extract_text_sharded(pdf_path: str, client=None, shard_pages: int = OCR_SHARD_PAGES,
+                         max_workers: int = OCR_MAX_PARALLEL, retries: int = OCR_SHARD_RETRIES,
+                         skip_pages: set | None = None) -> dict:
+    """
+    OCR a large scanned PDF as concurrent page-range shards.
+    Shards are cut on the calling thread (PyMuPDF is not thread-safe) only as
+    worker slots free up, so at most `max_workers` shards are in memory. Each
+    shard is retried on its own; pages of shards that still fail are missing
+    from the result.
+    args:
+        pdf_path (str): Path to the scanned PDF.
+        client: Mistral client (or a stand-in with the same files/ocr API).
+        skip_pages (set): 1-based page numbers that are already known (e.g. cached).
+    returns:
+        dict: {global page number: markdown} for every page that was OCR'd.
+    """
+    client = client or mistral_client
+    stem = Path(pdf_path).stem
+    pages = {}
+    failed = []
+
+    doc = fitz.open(pdf_path)
+    try:
+        ranges = shard_ranges(len(doc), shard_pages, skip_pages)
+        print(f"OCR of {len(doc)} pages in {len(ranges)} shards, {max_workers} at a time...")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {}
+            remaining = iter(ranges)
+            try:
+                while True:
+                    # Top up the in-flight shards
+                    for start, end in remaining:
+                        cancellation.check()
+                        name = f"{stem}_p{start + 1}-{end}.pdf"
+                        future = executor.submit(tracing.bind(ocr_shard), client, name, shard_bytes(doc, start, end), start, retries)
+                        pending[future] = (start, end)
+                        if len(pending) >= max_workers:
+                            break
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        start, end = pending.pop(future)
+                        try:
+                            pages.update(future.result())
+                        except Exception as e:
+                            print(f"🚨 {e}")
+                            failed.append((start + 1, end))
+            except cancellation.Cancelled:
+                # Shards not started yet are dropped; running ones stop at their next check
+                for future in pending:
+                    future.cancel()
+                raise
+    finally:
+        doc.close()
+
+    if failed:
+        print(f"🚨 OCR failed for page ranges {failed}.")
+    print(f"Extracted text from {len(pages)} image-based pages using sharded Mistral OCR.")
+    return pages
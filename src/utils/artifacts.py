@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from src.models.activity import Activity, activities_from_json, activities_to_dicts
+from src.utils import cancellation
+
+# Tool outputs stay in memory, under a short artifact id, until they take up more than
+# ARTIFACT_MEMORY_MB; the least recently used ones are then only kept on disk
+ARTIFACT_MEMORY_MB = float(os.getenv("ARTIFACT_MEMORY_MB", "64"))
+ARTIFACT_ID_RE = re.compile(r"\bart-[0-9a-f]{8}\b")
+
+
+def artifact_id(path) -> str:
+    """The id of the artifact saved at `path`; the same in every process."""
+    return "art-" + hashlib.sha256(str(Path(path).resolve()).encode()).hexdigest()[:8]
+
+
+def _file_state(path: str):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class Artifact:
+    __slots__ = ("artifact_id", "path", "state", "data")
+
+    def __init__(self, artifact_id: str, path: str, state, data=None):
+        self.artifact_id = artifact_id
+        self.path = path
+        self.state = state
+        self.data = data
+
+
+class ArtifactStore:
+    """
+    The JSON outputs of tools by artifact id, so the next tool in a chain can be
+    handed a short id instead of a path and reuses the parsed (and validated)
+    objects instead of reading the file back. Every artifact is also saved to
+    disk; its objects are dropped from memory (least recently used first) past
+    `memory_limit` bytes of file size, or as soon as the file changes.
+    """
+
+    def __init__(self, memory_limit: int = int(ARTIFACT_MEMORY_MB * 1024 * 1024)):
+        self.memory_limit = memory_limit
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._in_memory = OrderedDict()  # artifact_id -> bytes on disk, least recently used first
+        self._memory_used = 0
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, path, data=None) -> str:
+        """
+        Register the file just saved at `path`, keeping `data` (what was written)
+        in memory. Returns its artifact id.
+        """
+        path = str(path)
+        artifact = Artifact(artifact_id(path), path, _file_state(path), data)
+        with self._lock:
+            self._drop(artifact.artifact_id)
+            self._by_id[artifact.artifact_id] = artifact
+            if data is not None and artifact.state is not None and artifact.state[0] <= self.memory_limit:
+                self._in_memory[artifact.artifact_id] = artifact.state[0]
+                self._memory_used += artifact.state[0]
+                while self._memory_used > self.memory_limit:
+                    self._spill(next(iter(self._in_memory)))
+            else:
+                artifact.data = None
+        return artifact.artifact_id
+
+    def _spill(self, key: str) -> None:
+        self._memory_used -= self._in_memory.pop(key)
+        self._by_id[key].data = None
+
+    def _drop(self, key: str) -> None:
+        if key in self._in_memory:
+            self._spill(key)
+        self._by_id.pop(key, None)
+
+    def path(self, ref: str) -> str | None:
+        """The file of an artifact id, None if the id is unknown."""
+        with self._lock:
+            artifact = self._by_id.get(ref)
+        return artifact.path if artifact else None
+
+    def get(self, ref: str):
+        """The in-memory objects of an artifact (by id or path) if its file is unchanged, else None."""
+        key = ref if ARTIFACT_ID_RE.fullmatch(ref) else artifact_id(ref)
+        with self._lock:
+            artifact = self._by_id.get(key)
+            if artifact is None or artifact.data is None:
+                self.misses += 1
+                return None
+            if _file_state(artifact.path) != artifact.state:
+                # Changed on disk since: the file is the truth
+                self._spill(key)
+                self.misses += 1
+                return None
+            self._in_memory.move_to_end(key)
+            self.hits += 1
+            return artifact.data
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"artifacts": len(self._by_id), "in_memory": len(self._in_memory),
+                    "memory_bytes": self._memory_used, "hits": self.hits, "misses": self.misses}
+
+
+store = ArtifactStore()
+
+
+def saved(label: str, path, data=None) -> str:
+    """
+    Register an output file and the tool message reporting it, e.g. "Matched
+    activities (art-1a2b3c4d) saved to ...", noting on the next line if a stage
+    stopped early at the request's deadline.
+    """
+    message = f"{label} ({store.put(path, data)}) saved to {path}"
+    note = cancellation.partial()
+    return f"{message}\n{note}" if note else message
+
+
+def adopt(message: str) -> None:
+    """Register the files a (remembered) tool message reports, so the artifact ids in it resolve in this process."""
+    for match in re.finditer(r"\((art-[0-9a-f]{8})\) saved to ['\"]?(.+?)['\"]?\s*$", str(message or ""), re.MULTILINE):
+        if store.path(match.group(1)) is None and os.path.isfile(match.group(2)):
+            store.put(match.group(2))
+
+
+def resolve(ref: str) -> str:
+    """The path of an artifact id; anything else is returned as given."""
+    ref = ref.strip().strip("'\"")
+    path = store.path(ref)
+    if path is None and ARTIFACT_ID_RE.fullmatch(ref):
+        print(f"🚨 Unknown artifact id {ref}; its file path is needed instead.")
+    return path or ref
+
+
+def expand(text: str) -> str:
+    """`text` with every known artifact id replaced by its file path."""
+    return ARTIFACT_ID_RE.sub(lambda match: store.path(match.group(0)) or match.group(0), str(text or ""))
+
+
+def load_json(path: str):
+    """The data of a JSON file, from memory if it is an unchanged artifact (activities as plain dicts)."""
+    data = store.get(path)
+    if data is not None:
+        return activities_to_dicts(data) if isinstance(data, list) else data
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def load_activities(path: str, required: tuple = ()) -> tuple[list | None, str | None]:
+    """
+    (activities, None) for a JSON file of activities, without re-reading or
+    re-validating an unchanged artifact; (None, error message) if it is invalid
+    or its objects lack a `required` key.
+    """
+    data = store.get(path)
+    if isinstance(data, list) and all(isinstance(item, Activity) for item in data):
+        return list(data), None
+    if data is None:
+        with open(path, "r") as f:
+            data = json.load(f)
+    activities, error = activities_from_json(data)
+    if not error and data and any(key not in data[0] for key in required):
+        return None, f"Invalid JSON structure. Expected {' and '.join(repr(key) for key in required)} keys in the objects."
+    return activities, error
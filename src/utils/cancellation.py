@@ -0,0 +1,258 @@
+import asyncio
+import os
+import select
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from langchain_core.callbacks import BaseCallbackHandler
+
+# How long one chat request may run before its tools stop and save what they have
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", "600"))
+# How often a watcher looks for a client that hung up
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.5"))
+
+
+class Cancelled(BaseException):
+    """
+    Raised by `check` once the work's CancelToken has been cancelled. Like
+    asyncio.CancelledError it is not an Exception, so the tools' error handling
+    does not turn a cancellation into an error result.
+    """
+
+
+class DeadlineExceeded(Cancelled):
+    """Raised by `check` once the work has run past its CancelToken's deadline."""
+
+
+class CancelToken:
+    """
+    Cooperative cancellation: long-running loops call `check` between units of
+    work. A token with a `timeout` (seconds) also stops the work at its deadline.
+    """
+
+    def __init__(self, timeout: float | None = None):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.reason = None
+        self.partial = None
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """
+        Call `callback()` (from the cancelling thread) when the token is
+        cancelled, right away if it already is. Returns a function removing it.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def remaining(self) -> float | None:
+        """Seconds left until the deadline (0 once it has passed), None without one."""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def check(self) -> None:
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+        if self.expired:
+            raise DeadlineExceeded("deadline exceeded")
+
+
+_current_token = ContextVar("cancel_token", default=None)
+
+
+@contextmanager
+def scope(token: CancelToken):
+    """Make `token` the one `check` consults for the code run in this context."""
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+def request_token(requested_timeout=None) -> CancelToken:
+    """
+    A token for one chat request, due after CHAT_DEADLINE_SECONDS or the
+    client's own (shorter) timeout in seconds, if it asked for one.
+    """
+    timeout = CHAT_DEADLINE_SECONDS
+    try:
+        if requested_timeout is not None and float(requested_timeout) > 0:
+            timeout = min(float(requested_timeout), timeout)
+    except (TypeError, ValueError):
+        pass
+    return CancelToken(timeout)
+
+
+def current() -> CancelToken | None:
+    return _current_token.get()
+
+
+def check() -> None:
+    """Raise Cancelled if the current work has been cancelled; a no-op outside a `scope`."""
+    token = _current_token.get()
+    if token is not None:
+        token.check()
+
+
+def interrupted() -> bool:
+    """Whether the current work has been cancelled or has run past its deadline."""
+    token = _current_token.get()
+    return token is not None and (token.cancelled or token.expired)
+
+
+def stop_at_deadline(stage: str, done: int, total: int | None = None) -> None:
+    """
+    Record that `stage` stopped at the deadline after `done` chunks (of `total`),
+    keeping what it has: outputs saved from here on are reported as partial.
+    """
+    progress = f"{done} of {total}" if total is not None else str(done)
+    print(f"⏳ {stage}: deadline reached after {progress} chunks; keeping the partial results.")
+    token = _current_token.get()
+    if token is not None:
+        token.partial = f"Partial results: {stage} reached the request's deadline after {progress} chunks."
+
+
+def partial() -> str | None:
+    """The note on a stage that stopped early at the current deadline, if one did."""
+    token = _current_token.get()
+    return token.partial if token is not None else None
+
+
+def timeout(default: float | None) -> float | None:
+    """`default` (seconds, for an HTTP call) cut down to the time left before the current deadline."""
+    token = _current_token.get()
+    remaining = token.remaining() if token is not None else None
+    if remaining is None:
+        return default
+    return remaining if default is None else min(default, remaining)
+
+
+def sleep(seconds: float) -> None:
+    """time.sleep that wakes up to raise Cancelled as soon as the current work is cancelled or due."""
+    token = _current_token.get()
+    if token is None:
+        time.sleep(seconds)
+        return
+    remaining = token.remaining()
+    token._event.wait(seconds if remaining is None else min(seconds, remaining))
+    token.check()
+
+
+async def guard(awaitable):
+    """
+    Await `awaitable`, cancelling it (and so the HTTP request it is waiting on)
+    as soon as the current work is cancelled or reaches its deadline, which is
+    then raised as Cancelled or DeadlineExceeded.
+    """
+    token = _current_token.get()
+    if token is None:
+        return await awaitable
+    try:
+        token.check()
+    except Cancelled:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise
+    task = asyncio.ensure_future(awaitable)
+    loop = asyncio.get_running_loop()
+    remove = token.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+    try:
+        return await asyncio.wait_for(task, token.remaining())
+    except asyncio.CancelledError:
+        if token.cancelled and task.cancelled():
+            raise Cancelled(token.reason) from None
+        raise
+    except TimeoutError:
+        raise DeadlineExceeded("deadline exceeded") from None
+    finally:
+        remove()
+
+
+@contextmanager
+def watch_socket(sock, token: CancelToken, interval: float = DISCONNECT_POLL_SECONDS):
+    """
+    Cancel `token` if the client on `sock` hangs up while the block runs. A
+    watcher thread peeks at the socket; it gives up on sockets it cannot peek
+    at (TLS) or that carry the client's next request. A no-op without a socket.
+    """
+    if sock is None:
+        yield token
+        return
+    done = threading.Event()
+
+    def watch():
+        while not done.is_set():
+            try:
+                readable, _, _ = select.select([sock], [], [], interval)
+                if not readable:
+                    continue
+                if sock.recv(1, socket.MSG_PEEK) == b"":
+                    token.cancel("client disconnected")
+                return
+            except (OSError, ValueError):
+                return
+
+    watcher = threading.Thread(target=watch, name="disconnect-watch", daemon=True)
+    watcher.start()
+    try:
+        yield token
+    finally:
+        done.set()
+
+
+class CancelCallbackHandler(BaseCallbackHandler):
+    """
+    Stops the agent from starting another LLM or tool call once its work is
+    cancelled or due, and keeps the last tool output, so a request that ran
+    out of time can still report what it saved. Runs inline so the raise
+    reaches async agents too.
+    """
+    run_inline = True
+    raise_error = True
+
+    def __init__(self):
+        self.last_output = None
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        check()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        check()
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        check()
+
+    def on_tool_end(self, output, **kwargs):
+        self.last_output = str(output)
@@ -0,0 +1,136 @@
+import math
+import re
+import numpy as np
+from src.models.activity import ActivityBatch
+
+_WORD_RE = re.compile(r"[a-z][a-z0-9]+")
+_STOPWORDS = frozenset(
+    "the and for with from into that this then them they their are was were has have its use used using"
+    " how what when which will can each other some more also".split()
+)
+# The concept names the topic in a few words; the description is long and mostly procedure
+CONCEPT_WEIGHT = 2
+
+
+def _terms(text: str) -> list:
+    return [word for word in _WORD_RE.findall(text.lower()) if word not in _STOPWORDS]
+
+
+def tfidf_vectors(batch: ActivityBatch) -> np.ndarray:
+    """
+    L2-normalized TF-IDF rows (float32) over the concept and description of each
+    activity, with concept terms counted CONCEPT_WEIGHT times.
+    """
+    vocabulary = {}
+    documents = []
+    for i in range(len(batch)):
+        counts = {}
+        for weight, text in ((CONCEPT_WEIGHT, batch.concept[i]), (1, batch.description[i])):
+            for term in _terms(text or ""):
+                index = vocabulary.setdefault(term, len(vocabulary))
+                counts[index] = counts.get(index, 0) + weight
+        documents.append(counts)
+
+    vectors = np.zeros((len(documents), max(len(vocabulary), 1)), dtype=np.float32)
+    for row, counts in enumerate(documents):
+        if counts:
+            vectors[row, list(counts)] = list(counts.values())
+    document_frequency = np.count_nonzero(vectors, axis=0)
+    np.log1p(vectors, out=vectors)
+    vectors *= (np.log((1 + len(documents)) / (1 + document_frequency)) + 1).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def _kmeans(vectors: np.ndarray, k: int, iterations: int = 20, seed: int = 1) -> np.ndarray:
+    """Cluster labels from spherical k-means (cosine similarity) with k-means++ seeding."""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    centroids = [vectors[0]]
+    for _ in range(1, k):
+        distance = 1 - np.max(vectors @ np.array(centroids).T, axis=1)
+        np.clip(distance, 0, None, out=distance)
+        total = distance.sum()
+        centroids.append(vectors[rng.choice(n, p=distance / total) if total > 0 else rng.integers(n)])
+    centroids = np.array(centroids)
+
+    labels = np.full(n, -1)
+    for _ in range(iterations):
+        similarity = vectors @ centroids.T
+        new_labels = np.argmax(similarity, axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for cluster in range(k):
+            members = labels == cluster
+            if not members.any():
+                # Re-seed an empty cluster with the activity least like its own centroid
+                worst = int(np.argmin(similarity[np.arange(n), labels]))
+                centroids[cluster] = vectors[worst]
+                continue
+            centroid = vectors[members].sum(axis=0)
+            norm = np.linalg.norm(centroid)
+            centroids[cluster] = centroid / norm if norm > 0 else centroid
+    return labels
+
+
+def _split(vectors: np.ndarray, indices: np.ndarray, max_size: int) -> list:
+    """Bisect a group with 2-means until every part has at most `max_size` members."""
+    if len(indices) <= max_size:
+        return [indices]
+    labels = _kmeans(vectors[indices], 2)
+    left, right = indices[labels == 0], indices[labels == 1]
+    if not len(left) or not len(right):
+        # Indistinguishable texts: split in half
+        left, right = indices[:len(indices) // 2], indices[len(indices) // 2:]
+    return _split(vectors, left, max_size) + _split(vectors, right, max_size)
+
+
+def _centroid(vectors: np.ndarray, indices) -> np.ndarray:
+    centroid = vectors[indices].sum(axis=0)
+    norm = np.linalg.norm(centroid)
+    return centroid / norm if norm > 0 else centroid
+
+
+def coherence(vectors: np.ndarray, indices) -> float:
+    """Mean pairwise cosine similarity of a group's activities; 0 for a single activity."""
+    n = len(indices)
+    if n < 2:
+        return 0.0
+    summed = vectors[indices].sum(axis=0)
+    return float((summed @ summed - n) / (n * (n - 1)))
+
+
+def concept_groups(activities, max_size: int = 20, min_size: int = 3) -> tuple:
+    """
+    Group activities with related concepts and descriptions into batches of at
+    most `max_size`. Activities are clustered with spherical k-means over their
+    TF-IDF vectors; clusters that are too large are bisected, and groups smaller
+    than `min_size` join the most similar group that still has room.
+    Returns (groups, vectors): lists of activity indices ordered by their first
+    activity, and the TF-IDF rows they were clustered on.
+    """
+    batch = activities if isinstance(activities, ActivityBatch) else ActivityBatch.from_activities(activities)
+    vectors = tfidf_vectors(batch)
+    if len(batch) <= max_size:
+        return ([list(range(len(batch)))] if len(batch) else []), vectors
+
+    labels = _kmeans(vectors, math.ceil(len(batch) / max_size))
+    groups = []
+    for cluster in np.unique(labels):
+        groups.extend(_split(vectors, np.flatnonzero(labels == cluster), max_size))
+    groups = [list(group) for group in groups]
+
+    # Fold groups that are too small to combine into the most similar one with room
+    for group in sorted((g for g in groups if len(g) < min_size), key=len):
+        others = [other for other in groups if other is not group and len(other) + len(group) <= max_size]
+        if not others:
+            continue
+        centroid = _centroid(vectors, group)
+        target = max(others, key=lambda other: float(_centroid(vectors, other) @ centroid))
+        target.extend(group)
+        groups.remove(group)
+
+    groups = [sorted(int(i) for i in group) for group in groups]
+    groups.sort(key=lambda group: group[0])
+    return groups, vectors
@@ -0,0 +1,161 @@
+import re
+import numpy as np
+from src.models.activity import ActivityBatch
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_HASH_SHIFT = np.uint64(32)
+_HASH_MASK = 0xFFFFFFFF
+
+
+def _activity_text(batch: ActivityBatch, i: int) -> str:
+    parts = [batch.activity[i], batch.concept[i], " ".join(batch.materials[i]), batch.description[i]]
+    return " ".join(part for part in parts if part).lower()
+
+
+def shingles(text: str, k: int = 3) -> set:
+    """
+    Return the set of hashed word k-shingles of a normalized activity text.
+    Uses Python's string hash, so values are only comparable within one process.
+    """
+    words = _WORD_RE.findall(text)
+    if len(words) < k:
+        return {hash(tuple(words)) & _HASH_MASK} if words else set()
+    return {hash(gram) & _HASH_MASK for gram in zip(*(words[i:] for i in range(k)))}
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def _minhash_signatures(shingle_sets: list, num_perm: int, seed: int) -> np.ndarray:
+    """
+    32-bit MinHash signatures using multiply-shift hashing on 64-bit integers.
+    All shingles are hashed as one flat array per permutation and reduced per
+    activity with `np.minimum.reduceat`.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+    signatures = np.full((len(shingle_sets), num_perm), np.iinfo(np.uint32).max, dtype=np.uint32)
+
+    lengths = np.fromiter((len(s) for s in shingle_sets), dtype=np.int64, count=len(shingle_sets))
+    values = np.fromiter((h for s in shingle_sets for h in s), dtype=np.uint64, count=int(lengths.sum()))
+    rows = np.flatnonzero(lengths)
+    if not len(rows):
+        return signatures
+    starts = (np.cumsum(lengths) - lengths)[rows]
+
+    hashed = np.empty_like(values)
+    with np.errstate(over="ignore"):
+        for perm in range(num_perm):
+            np.multiply(values, a[perm], out=hashed)
+            np.add(hashed, b[perm], out=hashed)
+            np.right_shift(hashed, _HASH_SHIFT, out=hashed)
+            signatures[rows, perm] = np.minimum.reduceat(hashed, starts)
+    return signatures
+
+
+def _band_buckets(band_slice: np.ndarray):
+    """Yield the index lists of LSH buckets with two or more members for one band."""
+    keys = np.ascontiguousarray(band_slice).view(np.dtype((np.void, band_slice.dtype.itemsize * band_slice.shape[1]))).ravel()
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    order = np.argsort(inverse, kind="stable")
+    ends = np.cumsum(counts)
+    for bucket in np.flatnonzero(counts > 1):
+        yield order[ends[bucket] - counts[bucket]:ends[bucket]].tolist()
+
+
+def _merge_pages(page_lists) -> tuple:
+    pages = set()
+    for page in page_lists:
+        pages.update(p for p in page if p is not None)
+    try:
+        return tuple(sorted(pages))
+    except TypeError:
+        return tuple(sorted(pages, key=str))
+
+
+def collapse_near_duplicates(activities: list, threshold: float = 0.8,
+                             num_perm: int = 64, bands: int = 16, seed: int = 1) -> list:
+    """
+    Collapse near-duplicate activities into one representative each.
+    Candidates are found with MinHash/LSH over word shingles of the activity,
+    concept, materials and description fields, and confirmed with the exact
+    shingle Jaccard similarity. The first activity of every group is kept, with
+    the `page` lists of the whole group merged into it.
+    args:
+        activities (list): List of Activity objects (plain dicts are converted).
+        threshold (float): Minimum Jaccard similarity for two activities to be merged.
+        num_perm (int): Number of MinHash permutations; must be divisible by `bands`.
+        bands (int): Number of LSH bands.
+    returns:
+        list: The deduplicated Activity objects, in their original order.
+    """
+    batch = activities if isinstance(activities, ActivityBatch) else ActivityBatch.from_activities(activities)
+    if len(batch) < 2:
+        return batch.to_activities()
+
+    # Exact duplicates (after normalization) are grouped up front, so the
+    # MinHash/LSH stage only runs over distinct texts
+    text_ids = {}
+    text_of = []
+    for i in range(len(batch)):
+        text_of.append(text_ids.setdefault(_activity_text(batch, i), len(text_ids)))
+    texts = list(text_ids)
+
+    rows = num_perm // bands
+    shingle_sets = [shingles(text) for text in texts]
+    signatures = _minhash_signatures(shingle_sets, num_perm, seed)
+
+    # Union-find over distinct text indices
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    rejected = set()
+    for band in range(bands):
+        for members in _band_buckets(signatures[:, band * rows:(band + 1) * rows]):
+            # Compare each member with the groups already seen in this bucket
+            bucket_roots = [find(members[0])]
+            for other in members[1:]:
+                root_other = find(other)
+                for k, root in enumerate(bucket_roots):
+                    root = find(root)
+                    bucket_roots[k] = root
+                    if root == root_other:
+                        break
+                    pair = (root, other)
+                    if pair in rejected:
+                        continue
+                    if jaccard(shingle_sets[root], shingle_sets[other]) >= threshold:
+                        # Keep the earliest text as the root of the group
+                        low, high = min(root, root_other), max(root, root_other)
+                        parent[high] = low
+                        bucket_roots[k] = low
+                        break
+                    rejected.add(pair)
+                else:
+                    bucket_roots.append(root_other)
+
+    # Text ids follow first appearance, so the smallest activity index in a
+    # group always belongs to its root text
+    groups = {}
+    for i, text_id in enumerate(text_of):
+        groups.setdefault(find(text_id), []).append(i)
+
+    collapsed = []
+    for members in sorted(groups.values()):
+        representative = batch[members[0]]
+        if len(members) > 1:
+            representative.page = _merge_pages(batch.page[i] for i in members)
+        collapsed.append(representative)
+
+    if len(collapsed) < len(batch):
+        print(f"Collapsed {len(batch)} activities into {len(collapsed)} after removing near-duplicates.")
+    return collapsed
@@ -0,0 +1,132 @@
+import hashlib
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+import fitz  # PyMuPDF
+
+# Uploaded documents are stored once per content hash as UPLOAD_DIR/<sha256>.pdf
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", Path(__file__).resolve().parent.parent.parent / "uploads"))
+UPLOAD_CHUNK_SIZE = 1 << 20
+# Larger uploads are refused (413) by both servers
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "512"))
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+
+
+class HashingWriter:
+    """
+    Write-only target for an upload that hashes the bytes as they arrive and
+    spools them to a temp file next to the document store, so storing the
+    upload is a rename. The temp file is removed on close unless it was stored.
+    """
+
+    def __init__(self, upload_dir: Path | str | None = None):
+        self.upload_dir = Path(upload_dir or UPLOAD_DIR)
+        incoming = self.upload_dir / ".incoming"
+        incoming.mkdir(parents=True, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(dir=incoming, suffix=".part", delete=False)
+        self.temp_path = Path(self._file.name)
+        self._digest = hashlib.sha256()
+        self.size = 0
+        self.stored = False
+
+    def write(self, data) -> int:
+        self._digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+    # The multipart parser rewinds finished file parts
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def finish(self) -> None:
+        """Close the temp file, keeping it on disk until it is stored or closed."""
+        if not self._file.closed:
+            self._file.close()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+        if not self.stored and self.temp_path.exists():
+            self.temp_path.unlink()
+
+
+def store_stream(stream, upload_dir: Path | str | None = None, chunk_size: int = UPLOAD_CHUNK_SIZE) -> HashingWriter:
+    """Copy a readable stream (e.g. a raw request body) into a HashingWriter, one chunk at a time."""
+    writer = HashingWriter(upload_dir)
+    try:
+        for chunk in iter(lambda: stream.read(chunk_size), b""):
+            writer.write(chunk)
+    except Exception:
+        writer.close()
+        raise
+    return writer
+
+
+@contextmanager
+def open_pdf(path: Path | str):
+    """
+    Open a PDF over a read-only memory map of the file, so PyMuPDF parses
+    the page cache directly instead of a bytes copy of the document.
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    doc = None
+    try:
+        doc = fitz.open(stream=view, filetype="pdf")
+        yield doc
+    finally:
+        if doc is not None:
+            doc.close()
+        view.release()
+        mapped.close()
+
+
+def store_document(writer: HashingWriter, file_name: str | None = None) -> dict:
+    """
+    Move an upload into the document store under its content hash. An upload
+    whose hash is already stored is discarded and the stored copy returned.
+    Raises ValueError if the upload is empty or not a PDF.
+    returns:
+        dict: sha256, path, file_name, size, pages and whether it was a duplicate.
+    """
+    writer.finish()
+    sha256 = writer.hexdigest()
+    path = writer.upload_dir / f"{sha256}.pdf"
+    duplicate = path.exists()
+
+    try:
+        if writer.size == 0:
+            raise ValueError("The uploaded file is empty.")
+        # A duplicate is validated against the stored copy, which it is identical to
+        with open_pdf(path if duplicate else writer.temp_path) as doc:
+            if not doc.is_pdf:
+                raise ValueError("The uploaded file is not a PDF.")
+            pages = len(doc)
+        if not duplicate:
+            os.replace(writer.temp_path, path)
+            writer.stored = True
+    except (fitz.FileDataError, RuntimeError) as e:
+        raise ValueError(f"The uploaded file is not a readable PDF: {e}") from e
+    finally:
+        writer.close()
+
+    return {
+        "sha256": sha256,
+        "path": str(path),
+        "file_name": file_name,
+        "size": writer.size,
+        "pages": pages,
+        "duplicate": duplicate,
+    }
@@ -1,5 +1,17 @@
+from contextlib import contextmanager
 from pathlib import Path
+import json
+import os
 import re
+import tempfile
+from src.utils import artifacts
+
+# JSON inputs are file paths or artifact ids of earlier tool outputs (see src/utils/artifacts.py)
+JSON_REF_RE = re.compile(r"\b(art-[0-9a-f]{8})\b|['\"]?([^,'\"\s]+\.json)['\"]?")
+
+def find_json_refs(input_str: str) -> list:
+    """The JSON file paths in the input string, in order, with artifact ids resolved to their files."""
+    return [artifacts.resolve(artifact) if artifact else path for artifact, path in JSON_REF_RE.findall(input_str)]
 
 # ---- Helper function ----
 def parse_json_file(input_str: str) -> tuple[str | None, str | None]:
@@ -7,8 +19,8 @@ def parse_json_file(input_str: str) -> tuple[str | None, str | None]:
     if not input_str:
         return None, None
     
-    # Regex to find JSON file paths in the input string
-    paths = re.findall(r"['\"]?([^,'\"\s]+\.json)['\"]?", input_str)
+    # Regex to find JSON file paths (or artifact ids) in the input string
+    paths = find_json_refs(input_str)
 
     if len(paths) >= 2:
         path1 = Path(paths[0]).as_posix()
@@ -17,4 +29,79 @@ def parse_json_file(input_str: str) -> tuple[str | None, str | None]:
         return path1, path2
     else:
         print("Parser did not find two valid JSON file paths.")
-        return None, None
\ No newline at end of file
+        return None, None
+
+def parse_pdf_and_json(input_str: str) -> tuple[str | None, str | None]:
+    """Find one PDF path and one JSON file path in the input string."""
+    input_str = input_str.strip()
+    pdf_paths = re.findall(r"['\"]?([^,'\"\s]+\.pdf)['\"]?", input_str, re.IGNORECASE)
+    json_paths = find_json_refs(input_str)
+
+    if pdf_paths and json_paths:
+        pdf_path = Path(pdf_paths[0]).as_posix()
+        json_path = Path(json_paths[0]).as_posix()
+        print(f"Parser found PDF and JSON paths: {pdf_path}, {json_path}")
+        return pdf_path, json_path
+    else:
+        print("Parser did not find a PDF path and a JSON file path.")
+        return None, None
+
+
+@contextmanager
+def atomic_write(path, mode: str = "w", encoding: str | None = "utf-8"):
+    """
+    Open a temp file next to `path` and rename it over `path` once it has been
+    written in full, so readers never see a partial file. On error the temp
+    file is removed and `path` is left as it was.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, encoding=None if "b" in mode else encoding) as f:
+            yield f
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class JsonArrayWriter:
+    """
+    Writes a JSON array to disk one item at a time, so a streamed result
+    never has to be held in memory in full. Items go to a temp file next to
+    `path`, which replaces `path` only when the array is complete.
+    """
+
+    def __init__(self, path, indent: int = 2):
+        self.path = Path(path)
+        self.indent = indent
+        self.count = 0
+        self._file = None
+        self._atomic = None
+
+    def __enter__(self):
+        self._atomic = atomic_write(self.path)
+        self._file = self._atomic.__enter__()
+        self._file.write("[")
+        return self
+
+    def write(self, item) -> None:
+        text = json.dumps(item, indent=self.indent, ensure_ascii=False)
+        prefix = "\n" if self.count == 0 else ",\n"
+        self._file.write(prefix + text)
+        self._file.flush()
+        self.count += 1
+
+    def write_many(self, items) -> None:
+        for item in items:
+            self.write(item)
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._file.write("\n]\n" if self.count else "]\n")
+        return self._atomic.__exit__(exc_type, exc, tb)
@@ -0,0 +1,87 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from src.utils import cancellation
+
+# Speculative work (e.g. extracting an uploaded PDF before anyone asks) runs on at most
+# PREFETCH_WORKERS background threads
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "2"))
+
+
+class Prefetcher:
+    """
+    Runs work ahead of need in background threads, one job per key. The work
+    itself should be reusable by whoever needs it later, e.g. a memoized tool:
+    a call made while the job runs joins it, and a later one gets its cached
+    result. Jobs are cancelled cooperatively, see `src.utils.cancellation`.
+    """
+
+    def __init__(self, max_workers: int = PREFETCH_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def start(self, key, func, *args, **kwargs) -> Future:
+        """Start `func(*args, **kwargs)` for `key` unless a job for it is already queued or running."""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and not job[0].done():
+                return job[0]
+            token = cancellation.CancelToken()
+
+            def run():
+                with cancellation.scope(token):
+                    return func(*args, **kwargs)
+
+            future = self._executor.submit(run)
+            self._jobs[key] = (future, token)
+            future.add_done_callback(lambda _: self._log_outcome(key, future))
+            return future
+
+    def _log_outcome(self, key, future: Future) -> None:
+        if future.cancelled():
+            return
+        error = future.exception()
+        if isinstance(error, cancellation.Cancelled):
+            print(f"Prefetch of {key} cancelled.")
+        elif error is not None:
+            print(f"🚨 Prefetch of {key} failed: {error}")
+        else:
+            print(f"Prefetch of {key} finished.")
+
+    def status(self, key) -> str | None:
+        """'running', 'done', 'failed' or 'cancelled' for the job of `key`, None if there is none."""
+        with self._lock:
+            job = self._jobs.get(key)
+        if job is None:
+            return None
+        future, token = job
+        if not future.done():
+            return "cancelled" if token.cancelled else "running"
+        if future.cancelled() or isinstance(future.exception(), cancellation.Cancelled):
+            return "cancelled"
+        return "failed" if future.exception() is not None else "done"
+
+    def cancel(self, key, wait: float | None = None) -> bool:
+        """
+        Cancel the job of `key`: a queued job never starts, a running one stops at
+        its next cancellation check. Calls that joined its memoized run (e.g. the
+        agent of another session on the same file) are not cancelled with it;
+        they run again on their own. Waits up to `wait` seconds for it to stop.
+        Returns True if there was an unfinished job.
+        """
+        with self._lock:
+            job = self._jobs.pop(key, None)
+        if job is None or job[0].done():
+            return False
+        future, token = job
+        token.cancel(f"prefetch of {key} cancelled")
+        if not future.cancel() and wait:
+            try:
+                future.exception(timeout=wait)
+            except Exception:
+                pass
+        return True
+
+
+prefetcher = Prefetcher()
@@ -0,0 +1,140 @@
+import json
+import os
+import re
+from src.models.activity import Activity
+
+try:
+    import tiktoken
+except ImportError:  # token counts fall back to a character estimate
+    tiktoken = None
+
+# PROMPT_SAVINGS_REPORT=1 prints each call's prompt size against its unoptimized input;
+# off by default, as counting the tokens costs time on every chunk
+PROMPT_SAVINGS_REPORT = os.getenv("PROMPT_SAVINGS_REPORT", "0") == "1"
+
+_encodings = {}
+_TOKEN_RE = re.compile(r"[a-z]+|\d+(?:\.\d+)*")
+
+
+def _encoding(model: str):
+    if model not in _encodings:
+        encoding = None
+        if tiktoken is not None:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                # tiktoken downloads its encodings on first use
+                print(f"Token encoding for {model} unavailable, estimating token counts: {e}")
+        _encodings[model] = encoding
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    """Number of tokens `text` costs for `model` (about 4 characters per token without tiktoken)."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def compact_json(data) -> str:
+    """JSON without indentation or spaces after separators."""
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def project(items, fields: tuple) -> list:
+    """Keep only `fields` of each activity (Activity objects or dicts), dropping empty values."""
+    projected = []
+    for item in items:
+        data = item.to_dict() if isinstance(item, Activity) else item
+        projected.append({field: data[field] for field in fields if data.get(field) not in (None, "", [])})
+    return projected
+
+
+def compact_text(text: str) -> str:
+    """Collapse runs of spaces and blank lines in page text."""
+    text = re.sub(r"[ \t\u00a0]+", " ", text)
+    text = re.sub(r" ?\n ?", "\n", text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def name_tokens(name: str) -> set:
+    """Lowercase words and numbers (like '4.1') of an activity name."""
+    return set(_TOKEN_RE.findall(str(name).lower()))
+
+
+class CandidateIndex:
+    """
+    The activity names of a users JSON (JSON2), indexed by token so each
+    matcher chunk only needs to see the names that could match it.
+    """
+
+    def __init__(self, units: list):
+        self.units = units
+        self.names = []
+        for unit in units:
+            value = unit.get("activity") if isinstance(unit, dict) else unit
+            if isinstance(value, str):
+                self.names.append(value)
+            elif isinstance(value, list):
+                self.names.extend(str(v) for v in value if v)
+        self._tokens = [name_tokens(name) for name in self.names]
+        self._by_token = {}
+        for i, tokens in enumerate(self._tokens):
+            for token in tokens:
+                self._by_token.setdefault(token, set()).add(i)
+        self._common = {token for token, ids in self._by_token.items() if len(ids) > len(self.names) / 2}
+
+    def full_tokens(self, model: str = "gpt-4") -> int:
+        """Tokens of the whole users JSON as the matcher used to send it (indented)."""
+        if not hasattr(self, "_full_tokens"):
+            self._full_tokens = count_tokens(json.dumps(self.units, indent=2), model)
+        return self._full_tokens
+
+    def candidates(self, activity_names, min_overlap: float = 0.5) -> list:
+        """
+        JSON2 names that could match one of `activity_names`, in JSON2 order.
+        Names that both carry numbers (like '4.1') must share one; otherwise they
+        must share `min_overlap` of their distinctive words (words found in most
+        JSON2 names, like 'activity' or 'explore', are ignored). Identical token
+        sets always qualify, so no exact match is ever filtered out.
+        """
+        common = self._common
+        selected = set()
+        for activity_name in activity_names:
+            tokens = name_tokens(activity_name)
+            numbers = {t for t in tokens if t[0].isdigit()}
+            seen = set()
+            for token in tokens:
+                seen.update(self._by_token.get(token, ()))
+            for i in seen:
+                other = self._tokens[i]
+                other_numbers = {t for t in other if t[0].isdigit()}
+                if tokens == other:
+                    selected.add(i)
+                elif numbers and other_numbers:
+                    if numbers & other_numbers:
+                        selected.add(i)
+                else:
+                    words, other_words = tokens - common, other - common
+                    if words and other_words and len(words & other_words) >= min_overlap * min(len(words), len(other_words)):
+                        selected.add(i)
+        return [self.names[i] for i in sorted(selected)]
+
+
+def report_savings(label: str, prompt: str, baseline_tokens, model: str = "gpt-4") -> int | None:
+    """
+    With PROMPT_SAVINGS_REPORT, print the prompt size of one call and the tokens
+    saved against `baseline_tokens()`, the size of the same instructions with the
+    whole, unoptimized input. Returns the number of prompt tokens, None when off.
+    """
+    if not PROMPT_SAVINGS_REPORT:
+        return None
+    prompt_tokens = count_tokens(prompt, model)
+    baseline_tokens = baseline_tokens()
+    saved = baseline_tokens - prompt_tokens
+    ratio = baseline_tokens / prompt_tokens if prompt_tokens else 0
+    print(f"{label}: {prompt_tokens} prompt tokens, saved {saved} ({ratio:.1f}x smaller)")
+    return prompt_tokens
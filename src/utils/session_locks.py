@@ -0,0 +1,28 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class SessionLocks:
+    """
+    One asyncio.Lock per session id, so turns of a session run one after the
+    other while different sessions run concurrently. A session's lock is
+    dropped once no request holds or waits for it.
+    """
+
+    def __init__(self):
+        self._locks = {}  # session_id -> [lock, number of holders and waiters]
+
+    @asynccontextmanager
+    async def hold(self, session_id: str):
+        entry = self._locks.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[session_id]
+
+    def __len__(self) -> int:
+        return len(self._locks)
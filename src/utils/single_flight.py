@@ -0,0 +1,72 @@
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key across threads: the first
+    caller runs the function, callers arriving while it runs wait for it and
+    get the same result (or exception). Nothing is kept once the call returns.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self, key) -> bool:
+        with self._lock:
+            return key in self._calls
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines on one event loop. The shared call runs as a
+    task, so a waiter that is cancelled does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, key, coro_func):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_func())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        return await asyncio.shield(task)
+
+    def in_flight(self, key) -> bool:
+        return key in self._tasks
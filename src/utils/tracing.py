@@ -0,0 +1,335 @@
+import cProfile
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from pathlib import Path
+
+from langchain_core.callbacks import BaseCallbackHandler
+from src.utils.helper import atomic_write
+
+# Traces of opted-in requests are written to TRACE_DIR as <trace id>.jsonl (one span per
+# line) and <trace id>.trace.json (chrome://tracing / Perfetto), plus <trace id>.prof
+# (cProfile, e.g. `python -m pstats`) or <trace id>.folded (sampled stacks, e.g. speedscope)
+TRACE_DIR = Path(os.getenv("TRACE_DIR", Path(__file__).resolve().parent.parent.parent / "traces"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5")) / 1000
+PROFILE_MODES = ("cprofile", "sample")
+# Request header and values that opt a request in, e.g. `X-Trace: 1` or `X-Trace: sample`
+TRACE_HEADER = "X-Trace"
+
+_current_trace = ContextVar("current_trace", default=None)
+_current_span = ContextVar("current_span", default=None)
+
+
+class _NoopSpan:
+    """Returned by `span` outside a trace, so instrumented code costs one context lookup."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def record_usage(self, response):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attrs", "start_ns", "end_ns", "thread_id", "_token")
+
+    def __init__(self, trace, name: str, parent_id: str | None, attrs: dict):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.thread_id = threading.get_ident()
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+        self._token = None
+        trace.threads.add(self.thread_id)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def record_usage(self, response):
+        """Token counts of an OpenAI response, or pages of a Mistral OCR response."""
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.attrs["prompt_tokens"] = getattr(usage, "prompt_tokens", None)
+            self.attrs["completion_tokens"] = getattr(usage, "completion_tokens", None)
+        usage_info = getattr(response, "usage_info", None)
+        if usage_info is not None:
+            self.attrs["pages_processed"] = getattr(usage_info, "pages_processed", None)
+
+    def end(self, error: BaseException | None = None):
+        if self.end_ns is not None:
+            return
+        if error is not None:
+            self.attrs["error"] = repr(error)
+        self.end_ns = time.perf_counter_ns()
+        self.trace.finish(self)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(exc)
+        _current_span.reset(self._token)
+        return False
+
+
+class Trace:
+    """The spans (and optional profile) of one request."""
+
+    def __init__(self, name: str, profile: str | None = None, trace_dir: Path | str | None = None):
+        self.trace_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.name = name
+        self.profile = profile
+        self.trace_dir = Path(trace_dir or TRACE_DIR)
+        self.threads = set()
+        self.spans = []
+        self._lock = threading.Lock()
+        self._origin_ns = time.perf_counter_ns()
+        self._origin_wall = time.time()
+
+    def start_span(self, name: str, parent_id: str | None = None, **attrs) -> Span:
+        return Span(self, name, parent_id, attrs)
+
+    def finish(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def export(self) -> list:
+        """Write the JSONL and Chrome trace files. Returns their paths."""
+        self.trace_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start_ns)
+        jsonl_path = self.trace_dir / f"{self.trace_id}.jsonl"
+        with atomic_write(jsonl_path) as f:
+            for s in spans:
+                f.write(json.dumps({
+                    "trace_id": self.trace_id,
+                    "span_id": s.span_id,
+                    "parent_id": s.parent_id,
+                    "name": s.name,
+                    "start": self._origin_wall + (s.start_ns - self._origin_ns) / 1e9,
+                    "duration_ms": round((s.end_ns - s.start_ns) / 1e6, 3),
+                    "thread": s.thread_id,
+                    "attrs": s.attrs,
+                }, default=str) + "\n")
+        chrome_path = self.trace_dir / f"{self.trace_id}.trace.json"
+        events = [{
+            "name": s.name,
+            "cat": self.name,
+            "ph": "X",
+            "ts": (s.start_ns - self._origin_ns) / 1000,
+            "dur": (s.end_ns - s.start_ns) / 1000,
+            "pid": os.getpid(),
+            "tid": s.thread_id,
+            "args": s.attrs,
+        } for s in spans]
+        with atomic_write(chrome_path) as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+        return [jsonl_path, chrome_path]
+
+
+class _Sampler(threading.Thread):
+    """
+    Samples the stacks of the threads the trace's spans ran on, so concurrent
+    requests on other threads stay out of the profile.
+    """
+
+    def __init__(self, trace: Trace, interval: float):
+        super().__init__(name=f"profile-{trace.trace_id}", daemon=True)
+        self.trace = trace
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.trace.threads):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self) -> Path:
+        self._done.set()
+        self.join()
+        path = self.trace.trace_dir / f"{self.trace.trace_id}.folded"
+        with atomic_write(path) as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+def parse_header(value: str | None) -> tuple[bool, str | None]:
+    """(enabled, profile mode) for a TRACE_HEADER value: 1/true/spans, cprofile or sample."""
+    value = (value or "").strip().lower()
+    if value in PROFILE_MODES:
+        return True, value
+    return value in ("1", "true", "yes", "spans"), None
+
+
+@contextmanager
+def trace(name: str, profile: str | None = None, enabled: bool = True, **attrs):
+    """
+    Trace everything run in this context (and in threads and tasks started
+    through `bind`/`asyncio`) under one root span, optionally with a cProfile
+    of the calling thread or a sampling profile of all of the trace's threads.
+    Yields the Trace, or None when `enabled` is False.
+    """
+    if not enabled:
+        yield None
+        return
+    current = Trace(name, profile)
+    trace_token = _current_trace.set(current)
+    profiler = sampler = None
+    if profile == "cprofile":
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:  # only one cProfile can be active per process
+            print(f"🚨 Not profiling trace {current.trace_id}: {e}")
+            profiler = None
+    root = current.start_span(name, **attrs)
+    if profile == "sample":
+        sampler = _Sampler(current, PROFILE_SAMPLE_INTERVAL)
+        sampler.start()
+    try:
+        with root:
+            yield current
+    finally:
+        _current_trace.reset(trace_token)
+        paths = []
+        if profiler is not None:
+            profiler.disable()
+            current.trace_dir.mkdir(parents=True, exist_ok=True)
+            profile_path = current.trace_dir / f"{current.trace_id}.prof"
+            profiler.dump_stats(profile_path)
+            paths.append(profile_path)
+        try:
+            if sampler is not None:
+                current.trace_dir.mkdir(parents=True, exist_ok=True)
+                paths.append(sampler.stop())
+            paths = current.export() + paths
+            print(f"Trace {current.trace_id}: {len(current.spans)} spans written to {', '.join(map(str, paths))}")
+        except Exception as e:
+            print(f"🚨 Could not write trace {current.trace_id}: {e}")
+
+
+def span(name: str, **attrs):
+    """A child span of the current one, for use as `with span(...) as s:`; a no-op outside a trace."""
+    current = _current_trace.get()
+    if current is None:
+        return NOOP_SPAN
+    parent = _current_span.get()
+    return current.start_span(name, parent.span_id if parent else None, **attrs)
+
+
+def traced(name: str | None = None):
+    """Decorator running a function (or coroutine function) in a span named after it."""
+    def decorator(func):
+        span_name = name or func.__qualname__
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def bind(func):
+    """
+    `func` bound to a copy of the current context, for executor.submit: spans it
+    opens in a worker thread then belong to this trace, and its cancellation
+    checks see the caller's token and deadline. Bind once per submit; a
+    context cannot run in two threads.
+    """
+    return functools.partial(copy_context().run, func)
+
+
+def callbacks() -> list:
+    """LangChain callbacks recording the agent's LLM and tool calls in the current trace, if any."""
+    current = _current_trace.get()
+    if current is None:
+        return []
+    parent = _current_span.get()
+    return [TraceCallbackHandler(current, parent.span_id if parent else None)]
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """
+    Spans for the agent's planning LLM calls (with token counts) and its tool
+    calls, numbered by agent step. Runs inline so async agents record too.
+    """
+    run_inline = True
+
+    def __init__(self, trace: Trace, parent_id: str | None):
+        self.trace = trace
+        self.parent_id = parent_id
+        self.step = 1
+        self._spans = {}
+
+    def _start(self, run_id, name: str, **attrs):
+        self._spans[run_id] = self.trace.start_span(name, self.parent_id, step=self.step, **attrs)
+
+    def _end(self, run_id, error=None, **attrs):
+        span_ = self._spans.pop(run_id, None)
+        if span_ is not None:
+            span_.set(**attrs)
+            span_.end(error)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        model = (kwargs.get("invocation_params") or {}).get("model_name") or (kwargs.get("invocation_params") or {}).get("model")
+        self._start(run_id, "agent.llm", model=model)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "agent.llm")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        self._end(run_id, prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, "agent.tool", tool=(serialized or {}).get("name"), input=str(input_str)[:200])
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+        self.step += 1
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+        self.step += 1
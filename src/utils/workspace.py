@@ -0,0 +1,142 @@
+import argparse
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+# Tool outputs are written to WORKSPACE_DIR/<session>/<run>/, one directory per agent run,
+# and runs untouched for RUN_RETENTION_HOURS are removed
+WORKSPACE_ROOT = Path(os.getenv("WORKSPACE_DIR", Path(__file__).resolve().parent.parent.parent / "workspaces"))
+RUN_RETENTION_HOURS = float(os.getenv("RUN_RETENTION_HOURS", "72"))
+GC_INTERVAL_SECONDS = 3600
+
+_current_run = ContextVar("current_run", default=None)
+_active_runs = set()
+_lock = threading.Lock()
+_last_gc = 0.0
+
+
+def _session_dir_name(session_id: str | None) -> str:
+    """A file-system safe directory name for a session id."""
+    if not session_id:
+        return "adhoc"
+    name = re.sub(r"[^A-Za-z0-9_.-]", "_", str(session_id))[:64].strip(".")
+    if name != session_id:
+        name = f"{name}-{hashlib.sha256(str(session_id).encode()).hexdigest()[:8]}"
+    return name
+
+
+def new_run_dir(session_id: str | None = None, root: Path | str | None = None) -> Path:
+    """Create a uniquely named run directory for a session."""
+    run_name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    path = Path(root or WORKSPACE_ROOT) / _session_dir_name(session_id) / run_name
+    path.mkdir(parents=True)
+    return path
+
+
+@contextmanager
+def run(session_id: str | None = None):
+    """
+    Scope one agent run: tool outputs written while it is active go to its own
+    directory, so concurrent runs never share output paths. Old runs are
+    garbage-collected at most once per GC_INTERVAL_SECONDS when a run starts.
+    """
+    maybe_collect_garbage()
+    path = new_run_dir(session_id)
+    token = _current_run.set(path)
+    with _lock:
+        _active_runs.add(path)
+    try:
+        yield path
+    finally:
+        _current_run.reset(token)
+        with _lock:
+            _active_runs.discard(path)
+
+
+def current_dir() -> Path:
+    """The active run's directory; outside a run, a new one-off run directory."""
+    return _current_run.get() or new_run_dir()
+
+
+def output_path(file_name: str) -> Path:
+    """Where a tool should write its output file `file_name` in this run."""
+    return current_dir() / file_name
+
+
+def _last_modified(path: Path) -> float:
+    latest = path.stat().st_mtime
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                latest = max(latest, os.stat(os.path.join(root, name)).st_mtime)
+            except OSError:
+                pass
+    return latest
+
+
+def collect_garbage(max_age_hours: float = RUN_RETENTION_HOURS, root: Path | str | None = None) -> int:
+    """
+    Remove run directories not modified for `max_age_hours`, except runs active
+    in this process, and then empty session directories. Returns the number of
+    runs removed.
+    """
+    root = Path(root or WORKSPACE_ROOT)
+    if not root.is_dir():
+        return 0
+    cutoff = time.time() - max_age_hours * 3600
+    with _lock:
+        active = set(_active_runs)
+
+    removed = 0
+    for session_dir in root.iterdir():
+        if not session_dir.is_dir():
+            continue
+        for run_dir in session_dir.iterdir():
+            if not run_dir.is_dir() or run_dir in active:
+                continue
+            try:
+                if _last_modified(run_dir) < cutoff:
+                    shutil.rmtree(run_dir)
+                    removed += 1
+            except OSError as e:
+                print(f"🚨 Could not remove old run {run_dir}: {e}")
+        try:
+            session_dir.rmdir()  # only succeeds once the session has no runs left
+        except OSError:
+            pass
+    return removed
+
+
+def maybe_collect_garbage() -> None:
+    """`collect_garbage` if it has not run in this process for GC_INTERVAL_SECONDS."""
+    global _last_gc
+    with _lock:
+        if time.time() - _last_gc < GC_INTERVAL_SECONDS:
+            return
+        _last_gc = time.time()
+    try:
+        removed = collect_garbage()
+        if removed:
+            print(f"Removed {removed} runs older than {RUN_RETENTION_HOURS:g} hours from {WORKSPACE_ROOT}.")
+    except Exception as e:
+        print(f"🚨 Workspace garbage collection failed: {e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage run workspaces.")
+    parser.add_argument("command", choices=["gc", "list"])
+    parser.add_argument("--hours", type=float, default=RUN_RETENTION_HOURS, help="Retention for 'gc'.")
+    args = parser.parse_args()
+
+    if args.command == "gc":
+        print(f"Removed {collect_garbage(args.hours)} runs older than {args.hours:g} hours.")
+    elif WORKSPACE_ROOT.is_dir():
+        for run_dir in sorted(WORKSPACE_ROOT.glob("*/*")):
+            print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(_last_modified(run_dir)))}  {run_dir}")
@@ -1,14 +1,18 @@
 # streamlit_app.py
 import streamlit as st
 import os
+import shutil
 import tempfile
 from pathlib import Path
 import time
 import re # Import regular expressions for parsing file paths
+from concurrent.futures import ThreadPoolExecutor
 
 # Assuming your agent setup and config loading are correct
 try:
-    from src.agent.agent_setup import create_agent
+    from src.agent.agent_setup import create_agent, extract_activities_tool
+    from src.utils import cancellation, tracing, workspace
+    from src.utils.prefetch import prefetcher
     # We assume create_agent or its dependencies will handle loading the key via os.getenv
 except ImportError as e:
     st.error(f"Failed to import necessary modules: {e}")
@@ -30,22 +34,68 @@ if 'temp_pdf_path' not in st.session_state:
 if 'uploaded_file_name' not in st.session_state:
     st.session_state['uploaded_file_name'] = None
 
+# --- Speculative extraction of the uploaded PDF ---
+def prefetch_extraction(pdf_path):
+    """
+    Run the extractor tool on an upload before the first question. When the agent
+    calls the tool on the PDF it joins this run, or reuses its memoized result.
+    """
+    with workspace.run():
+        return extract_activities_tool(pdf_path)
+
+# --- Running the agent so a new upload or rerun can stop it ---
+class AgentProgress(cancellation.CancelCallbackHandler):
+    """Stops the agent once its run is cancelled or due, and remembers the tool it is running."""
+
+    def __init__(self):
+        super().__init__()
+        self.tool = None
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        super().on_tool_start(serialized, input_str, **kwargs)
+        self.tool = (serialized or {}).get("name")
+
+
+def run_agent(agent_executor, agent_input, placeholder):
+    """
+    Invoke the agent in a worker thread while this script run waits for it.
+    Streamlit stops a script run at its next `st` call when the user uploads
+    a new file or reruns, so the wait updates the placeholder every half
+    second; if the run is stopped, the agent's work is cancelled with it.
+    The run also stops at CHAT_DEADLINE_SECONDS.
+    """
+    token = cancellation.request_token()
+    progress = AgentProgress()
+    started = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="agent")
+    try:
+        with cancellation.scope(token):
+            future = executor.submit(tracing.bind(agent_executor.invoke), agent_input, config={"callbacks": [progress]})
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except TimeoutError:
+                step = f"running {progress.tool}, " if progress.tool else ""
+                placeholder.markdown(f"Thinking... 🧠 ({step}{time.monotonic() - started:.0f}s)")
+    except BaseException:
+        token.cancel("stopped by a new upload or rerun")
+        raise
+    finally:
+        executor.shutdown(wait=False)
+
 # --- Helper Function for Temp File Cleanup ---
 def cleanup_temp_file():
     path_to_delete = st.session_state.get('temp_pdf_path')
+    if path_to_delete:
+        # Stop extracting a file that is being replaced before deleting it
+        prefetcher.cancel(path_to_delete, wait=5)
+    # Tool outputs live in the run workspaces, which are garbage-collected on their own
     if path_to_delete and os.path.exists(path_to_delete):
-        # Also try to delete the expected output JSON in the same directory
-        output_json_path = Path(path_to_delete).with_suffix(".json") # Assumes _activities.json convention isn't strictly followed by tool
-        output_json_path_alt = Path(path_to_delete).with_name(Path(path_to_delete).stem + "_activities.json")
-
-        files_to_delete = [path_to_delete, output_json_path, output_json_path_alt]
-        for file_path in files_to_delete:
-             if file_path and os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                    print(f"Cleaned up temp file: {file_path}")
-                except OSError as e:
-                    print(f"Error deleting temp file {file_path}: {e}")
+        try:
+            os.remove(path_to_delete)
+            print(f"Cleaned up temp file: {path_to_delete}")
+        except OSError as e:
+            print(f"Error deleting temp file {path_to_delete}: {e}")
 
     # Always reset state variables after attempting cleanup
     st.session_state['temp_pdf_path'] = None
@@ -66,14 +116,17 @@ with st.sidebar:
 
     # Process uploaded file
     if uploaded_file is not None:
-        if st.session_state['temp_pdf_path'] is None or Path(st.session_state['temp_pdf_path']).name != uploaded_file.name:
+        if st.session_state['temp_pdf_path'] is None or st.session_state['uploaded_file_name'] != uploaded_file.name:
             cleanup_temp_file()
             try:
                 with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tf:
-                    tf.write(uploaded_file.getvalue())
+                    uploaded_file.seek(0)
+                    shutil.copyfileobj(uploaded_file, tf, 1 << 20) # chunked copy, no full-size bytes copy
                     st.session_state['temp_pdf_path'] = tf.name
                     st.session_state['uploaded_file_name'] = uploaded_file.name
                 print(f"Created temp file: {st.session_state['temp_pdf_path']} for {st.session_state['uploaded_file_name']}")
+                if os.getenv("OPENAI_API_KEY"):
+                    prefetcher.start(st.session_state['temp_pdf_path'], prefetch_extraction, st.session_state['temp_pdf_path'])
                 st.success(f"'{st.session_state['uploaded_file_name']}' ready.", icon="✅")
             except Exception as e:
                 st.error(f"Error creating temporary file: {e}")
@@ -86,6 +139,11 @@ with st.sidebar:
     # Display currently active file info
     if st.session_state.get('temp_pdf_path') and st.session_state.get('uploaded_file_name'):
         st.info(f"**Active PDF:** `{st.session_state['uploaded_file_name']}`")
+        prefetch_status = prefetcher.status(st.session_state['temp_pdf_path'])
+        if prefetch_status == "running":
+            st.caption("⏳ Extracting activities in the background...")
+        elif prefetch_status == "done":
+            st.caption("✅ Activities extracted, ready for your questions.")
         # st.caption(f"Temp Path: `{st.session_state['temp_pdf_path']}`") # Optional: Show temp path
 
 
@@ -174,7 +232,8 @@ if prompt := st.chat_input("Ask the agent..."):
 
 
                 # Run the agent
-                response_dict = agent_executor.invoke({"input": full_prompt_for_agent})
+                with workspace.run():
+                    response_dict = run_agent(agent_executor, {"input": full_prompt_for_agent}, message_placeholder)
                 agent_response_text = response_dict.get('output', 'Agent did not produce standard output.')
 
                 # --- Process Intermediate Steps for Logs ---
@@ -198,20 +257,26 @@ if prompt := st.chat_input("Ask the agent..."):
                 match = re.search(r"saved to ['\"]?([^'\"]+\.json)['\"]?", agent_response_text, re.IGNORECASE)
                 if match:
                     potential_path_str = match.group(1)
-                    potential_path = Path(potential_path_str)
-                    temp_dir = Path(st.session_state['temp_pdf_path']).parent if st.session_state.get('temp_pdf_path') else None
+                    potential_path = Path(potential_path_str).resolve()
+                    # Memoized results may point at an earlier run's directory, so any run will do
+                    workspace_root = Path(workspace.WORKSPACE_ROOT).resolve()
 
-                    # Security/Sanity Check: Ensure it exists and is in the expected temp directory
-                    if temp_dir and potential_path.exists() and potential_path.parent == temp_dir:
+                    # Security/Sanity Check: Ensure it exists and is in the run workspaces
+                    if potential_path.is_file() and potential_path.is_relative_to(workspace_root):
                         print(f"Found valid output file path: {potential_path}")
                         download_button_info = {
                             "path": str(potential_path),
                             "name": potential_path.name
                         }
                     else:
-                         print(f"Found path '{potential_path_str}' in response, but it's invalid or not in temp dir.")
+                         print(f"Found path '{potential_path_str}' in response, but it's invalid or not in the workspace.")
 
 
+            except cancellation.DeadlineExceeded:
+                agent_error = "The agent reached its deadline before finishing; any partial results are in the output folder."
+            except cancellation.Cancelled as e:
+                # Not an Exception: without this the script run would crash
+                agent_error = f"The agent's run was cancelled ({e}). Please ask again."
             except Exception as e:
                 agent_error = f"An error occurred during agent execution: {e}"
                 import traceback